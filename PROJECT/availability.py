@@ -0,0 +1,91 @@
+"""
+Teacher availability as bitmasks over the week grid.
+
+Bit (day_index * SLOTS_PER_DAY + slot_index) stands for one (day, slot) cell,
+day_index counting from Monday and slot_index being the slot's position in
+scheduler.TIMETABLE_SLOTS, the grid the availability editor shows. Any other
+grid (a solver's time_slots, exam periods) is mapped onto it by time overlap
+with period_mask(). Masks are stored on Teacher as hex strings so they are
+not limited to 64 bits.
+"""
+from scheduler import TIMETABLE_SLOTS
+
+# Days in bit order; bits are reserved for this many slots per day
+WEEK_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SLOTS_PER_DAY = 16
+
+# Cell states as used by the availability editor and CSV import
+AVAILABLE, UNAVAILABLE, PREFERRED = 'available', 'unavailable', 'preferred'
+
+
+def slot_bit(day, slot_index):
+    """Bit of TIMETABLE_SLOTS[slot_index] on that day."""
+    return 1 << (WEEK_DAYS.index(day) * SLOTS_PER_DAY + slot_index)
+
+
+def period_mask(day, start, end):
+    """Bits of the TIMETABLE_SLOTS cells that day overlapping start-end (HH:MM); 0 for unknown days."""
+    if day not in WEEK_DAYS:
+        return 0
+    mask = 0
+    for i, (slot_start, slot_end) in enumerate(TIMETABLE_SLOTS):
+        # HH:MM strings compare in time order
+        if slot_start < end and start < slot_end:
+            mask |= slot_bit(day, i)
+    return mask
+
+
+def parse_mask(value):
+    """Stored hex string (or None) to int."""
+    return int(value, 16) if value else 0
+
+
+def format_mask(mask):
+    """int to stored hex string; an empty mask is stored as None."""
+    return format(mask, 'x') if mask else None
+
+
+def slot_bits(days, time_slots):
+    """{(day, start, end): period_mask} for a grid, so solvers test a cell with one AND."""
+    return {
+        (day, start, end): period_mask(day, start, end)
+        for day in days
+        for start, end in time_slots
+    }
+
+
+def teacher_masks(session):
+    """{teacher_id: (unavailable_mask, preferred_mask)} for teachers with any constraint, in one query."""
+    from scheduler import Teacher
+
+    rows = session.query(Teacher.id, Teacher.unavailable_mask, Teacher.preferred_mask).filter(
+        (Teacher.unavailable_mask.isnot(None)) | (Teacher.preferred_mask.isnot(None))
+    ).all()
+    return {tid: (parse_mask(unavailable), parse_mask(preferred)) for tid, unavailable, preferred in rows}
+
+
+def set_teacher_availability(teacher, cells):
+    """
+    Replace a teacher's masks from {(day, slot_index): state}, slot_index into
+    TIMETABLE_SLOTS and state AVAILABLE, UNAVAILABLE or PREFERRED. The caller commits.
+    """
+    unavailable = preferred = 0
+    for (day, slot_index), state in cells.items():
+        if state == UNAVAILABLE:
+            unavailable |= slot_bit(day, slot_index)
+        elif state == PREFERRED:
+            preferred |= slot_bit(day, slot_index)
+    teacher.unavailable_mask = format_mask(unavailable)
+    teacher.preferred_mask = format_mask(preferred)
+
+
+def cell_states(teacher, days):
+    """{(day, slot_index): state} of a teacher over TIMETABLE_SLOTS, for the editor."""
+    unavailable = parse_mask(teacher.unavailable_mask)
+    preferred = parse_mask(teacher.preferred_mask)
+    states = {}
+    for day in days:
+        for i in range(len(TIMETABLE_SLOTS)):
+            bit = slot_bit(day, i)
+            states[(day, i)] = UNAVAILABLE if unavailable & bit else PREFERRED if preferred & bit else AVAILABLE
+    return states
@@ -0,0 +1,82 @@
+"""
+Benchmark generate_exam_schedule on a synthetic in-memory database.
+
+    python bench_exam_schedule.py --courses 3000 --classes 1500 --rooms 120 [--pack]
+
+Reports wall time and the number of SQL statements for a fresh run, for
+invigilator assignment on its result, and for a second run that keeps half
+of the draft exams.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import event, insert
+
+from exams import generate_exam_schedule
+from invigilation import assign_invigilators
+from models import Exam
+from scheduler import get_session, Class, Classroom, ClassCourseTeacher, Course, Teacher
+
+
+def build(session, n_courses, n_classes, n_rooms, courses_per_class, seed, n_teachers=1):
+    rng = random.Random(seed)
+    session.execute(insert(Course), [{'name': f"Course {i:05d}"} for i in range(n_courses)])
+    session.execute(insert(Teacher), [{'name': f"Examiner {i:04d}", 'subject': "Any"} for i in range(n_teachers)])
+    session.execute(insert(Classroom), [
+        {'name': f"Room {i:04d}", 'capacity': rng.choice((30, 40, 60, 120, 200))} for i in range(n_rooms)
+    ])
+    session.execute(insert(Class), [{'name': f"Class {i:05d}", 'size': rng.randint(20, 80)} for i in range(n_classes)])
+    course_ids = [course_id for (course_id,) in session.query(Course.id)]
+    teacher_ids = [teacher_id for (teacher_id,) in session.query(Teacher.id)]
+    session.execute(insert(ClassCourseTeacher), [
+        {'class_id': class_id, 'course_id': course_id, 'teacher_id': rng.choice(teacher_ids)}
+        for (class_id,) in session.query(Class.id)
+        for course_id in rng.sample(course_ids, min(courses_per_class, len(course_ids)))
+    ])
+    session.commit()
+
+
+def timed(session, func, **kwargs):
+    """(result, seconds, SQL statements) of func(session, **kwargs)."""
+    statements = []
+    listener = lambda *args: statements.append(1)
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', listener)
+    started = time.perf_counter()
+    try:
+        result = func(session, **kwargs)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return result, time.perf_counter() - started, len(statements)
+
+
+def report(session, label, **kwargs):
+    (created, skipped, min_days), elapsed, statements = timed(session, generate_exam_schedule, **kwargs)
+    print(f"{label}: {created} created, {skipped} skipped, min {min_days} days "
+          f"in {elapsed:.2f}s with {statements} SQL statements")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark exam schedule generation.")
+    parser.add_argument('--courses', type=int, default=3000)
+    parser.add_argument('--classes', type=int, default=1500)
+    parser.add_argument('--rooms', type=int, default=120)
+    parser.add_argument('--courses-per-class', type=int, default=6)
+    parser.add_argument('--teachers', type=int, default=800)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pack', action='store_true', help="let exams share rooms up to capacity")
+    args = parser.parse_args()
+
+    session = get_session('sqlite://')
+    build(session, args.courses, args.classes, args.rooms, args.courses_per_class, args.seed, args.teachers)
+    report(session, "fresh", reset=True, pack=args.pack)
+    result, elapsed, statements = timed(session, assign_invigilators)
+    print(f"invigilators: {result['assigned']} rooms covered, {len(result['unassigned'])} uncovered "
+          f"in {elapsed:.2f}s with {statements} SQL statements")
+
+    # Keep every other draft exam and schedule the rest around them
+    exam_ids = [exam_id for (exam_id,) in session.query(Exam.id).order_by(Exam.id)]
+    session.query(Exam).filter(Exam.id.in_(exam_ids[::2])).delete(synchronize_session=False)
+    session.commit()
+    report(session, "incremental", pack=args.pack)
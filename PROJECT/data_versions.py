@@ -0,0 +1,63 @@
+"""
+Per-table write counters kept in the database, for the caches each worker
+process holds in memory (occurrences, room index, semester calendar, class
+grid fragments).
+
+Every flush or bulk statement that writes a table bumps that table's
+counter in the same transaction. A cache remembers the counters it was
+built from and compares them on read, so a write by any process is noticed;
+a rolled-back write rolls its bump back too. Caches that patch themselves
+on their own process's writes can follow those bumps with on_bump instead of
+rebuilding.
+"""
+import threading
+
+from sqlalchemy import event as sa_event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import DataVersion
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def versions(session, tables):
+    """Tuple of the counters of `tables` (table names), 0 for tables never written."""
+    found = dict(session.execute(select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(tables))).all())
+    return tuple(found.get(table, 0) for table in tables)
+
+
+def on_bump(callback):
+    """Call callback({table: new counter}) after this process bumps counters (inside the writing transaction)."""
+    with _listeners_lock:
+        _listeners.append(callback)
+
+
+def _bump(connection, tables):
+    tables = sorted(tables - {DataVersion.__tablename__})
+    if not tables:
+        return
+    stmt = insert(DataVersion).values([{'name': table, 'version': 1} for table in tables])
+    connection.execute(stmt.on_conflict_do_update(index_elements=['name'],
+                                                  set_={'version': DataVersion.version + 1}))
+    new = dict(connection.execute(
+        select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(tables))).all())
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        callback(new)
+
+
+def _after_flush(session, flush_context):
+    _bump(session.connection(), {obj.__table__.name for obj in (*session.new, *session.dirty, *session.deleted)})
+
+
+def _bulk_write(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _bump(orm_execute_state.session.connection(),
+              {m.local_table.name for m in orm_execute_state.all_mappers})
+
+
+sa_event.listen(Session, 'after_flush', _after_flush)
+sa_event.listen(Session, 'do_orm_execute', _bulk_write)
@@ -0,0 +1,325 @@
+"""
+Exam slot assignment as graph colouring.
+
+Courses are vertices, and two courses conflict when some class takes both;
+a colour is an exam slot, colour c being slot (c % slots_per_day) of day
+(c // slots_per_day) of the exam window.
+"""
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+
+from sqlalchemy import insert
+
+from models import Exam
+from scheduler import Class, Classroom, ClassCourseTeacher, Course
+
+# Exam slots per day
+EXAM_SLOTS = [
+    ("09:00", "11:00"),
+    ("11:30", "13:30"),
+    ("14:00", "16:00"),
+]
+
+
+def course_conflicts(class_courses):
+    """
+    Conflict graph from (class_id, course_id) pairs: ({course_id: set of
+    conflicting course_ids}, {class_id: set of course_ids}). Every course
+    appears in the graph, with or without conflicts.
+    """
+    groups = collections.defaultdict(set)
+    for class_id, course_id in class_courses:
+        groups[class_id].add(course_id)
+    graph = collections.defaultdict(set)
+    for courses in groups.values():
+        for course_id in courses:
+            graph[course_id].update(courses)
+            graph[course_id].discard(course_id)
+    return dict(graph), dict(groups)
+
+
+class ExamRooms:
+    """
+    Rooms per exam slot (colour). By default each exam gets a room to itself:
+    the smallest free room that seats it, else the largest free one. With pack,
+    exams share rooms up to Classroom.capacity, best fit over the rooms sorted
+    by seats left; an exam no room has seats for, or of unknown size (0),
+    takes an empty room to itself as without pack.
+    """
+
+    def __init__(self, rooms, pack=False):
+        # rooms: (room_id, capacity) pairs
+        self.capacity = {room_id: capacity or 0 for room_id, capacity in rooms}
+        self.rooms = sorted((capacity, room_id) for room_id, capacity in self.capacity.items())
+        self.largest = self.rooms[-1][0] if self.rooms else 0
+        self.pack = pack
+        self.seats = {}     # colour -> sorted [(seats left, room_id)] of rooms with seats left
+        self.assigned = {}  # course_id -> room_id
+
+    def copy(self):
+        other = ExamRooms.__new__(ExamRooms)
+        other.__dict__.update(self.__dict__)
+        other.seats = {colour: list(free) for colour, free in self.seats.items()}
+        other.assigned = dict(self.assigned)
+        return other
+
+    def _free(self, colour):
+        if colour not in self.seats:
+            self.seats[colour] = list(self.rooms)
+        return self.seats[colour]
+
+    def _shares(self, size):
+        return self.pack and 0 < size <= self.largest
+
+    def _find(self, colour, size):
+        """Index into the colour's free list of the room an exam of `size` would get, or None."""
+        free = self._free(colour)
+        start = bisect.bisect_left(free, (size,))
+        if self._shares(size) and start < len(free):
+            return start
+        # A room to itself: smallest empty room that seats it, else the largest empty one
+        for i in itertools.chain(range(start, len(free)), range(start - 1, -1, -1)):
+            seats, room_id = free[i]
+            if seats == self.capacity[room_id]:
+                return i
+        return None
+
+    def fits(self, colour, size):
+        return self._find(colour, size) is not None
+
+    def _fill(self, colour, i, size):
+        free = self.seats[colour]
+        seats, room_id = free.pop(i)
+        if self._shares(size) and seats > size:
+            bisect.insort(free, (seats - size, room_id))
+        return room_id
+
+    def take(self, colour, course_id, size):
+        """Seat a course's exam in the colour's slot; returns the room_id, or None if nothing fits."""
+        i = self._find(colour, size)
+        if i is None:
+            return None
+        self.assigned[course_id] = room_id = self._fill(colour, i, size)
+        return room_id
+
+    def book(self, colour, room_id, size):
+        """Record an exam that already sits in room_id during the colour's slot."""
+        free = self._free(colour)
+        for i, (_, free_room_id) in enumerate(free):
+            if free_room_id == room_id:
+                self._fill(colour, i, size)
+                return
+
+    def slots_needed(self, sizes):
+        """Lower bound on the slots that seat exams of these sizes."""
+        if not self.rooms:
+            return 0
+        if self.pack:
+            return -(-sum(sizes) // max(sum(capacity for capacity, _ in self.rooms), 1))
+        return -(-len(sizes) // len(self.rooms))
+
+
+def dsatur(graph, n_colors=None, rooms=None, fixed=None, slots_per_day=None, sizes=None):
+    """
+    DSatur colouring: repeatedly colour the course with the most distinct
+    colours among its neighbours (ties: most neighbours, then id). `fixed`
+    pre-colours courses; with `rooms` (an ExamRooms, updated in place) a
+    course only takes a colour whose slot can still seat its `sizes` entry.
+
+    Without n_colors each course takes the lowest colour it can. With n_colors
+    and slots_per_day it takes the colour whose day has fewest exams of its
+    neighbours, then the least loaded one, spreading each class's exams over
+    the window; courses that fit no colour are left out.
+
+    Returns ({course_id: colour}, [uncoloured course_ids]).
+    """
+    sizes = sizes or {}
+    colours = dict(fixed or {})
+    if rooms is not None and not rooms.rooms:
+        return colours, [v for v in graph if v not in colours]
+    load = collections.Counter(colours.values())
+    neighbour_colours = {v: {colours[u] for u in graph[v] if u in colours} for v in graph}
+    tiebreak = itertools.count()
+    heap = [(-len(neighbour_colours[v]), -len(graph[v]), v, next(tiebreak)) for v in graph if v not in colours]
+    heapq.heapify(heap)
+
+    def fits(c, v):
+        return rooms is None or rooms.fits(c, sizes.get(v, 0))
+
+    uncoloured = []
+    done = set(colours)
+    while heap:
+        sat, _, v, _ = heapq.heappop(heap)
+        if v in done or -sat != len(neighbour_colours[v]):
+            continue  # stale entry, v was re-pushed with a higher saturation
+        done.add(v)
+        taken = neighbour_colours[v]
+        if n_colors is None:
+            colour = next(c for c in itertools.count() if c not in taken and fits(c, v))
+        else:
+            candidates = [c for c in range(n_colors) if c not in taken and fits(c, v)]
+            if not candidates:
+                uncoloured.append(v)
+                continue
+            if slots_per_day:
+                same_day = collections.Counter(colours[u] // slots_per_day for u in graph[v] if u in colours)
+                colour = min(candidates, key=lambda c: (same_day[c // slots_per_day], load[c], c))
+            else:
+                colour = candidates[0]
+        colours[v] = colour
+        load[colour] += 1
+        if rooms is not None:
+            rooms.take(colour, v, sizes.get(v, 0))
+        for u in graph[v]:
+            if u not in done and colour not in neighbour_colours[u]:
+                neighbour_colours[u].add(colour)
+                heapq.heappush(heap, (-len(neighbour_colours[u]), -len(graph[u]), u, next(tiebreak)))
+    return colours, uncoloured
+
+
+def colour_window(graph, n_days, slots_per_day, rooms=None, fixed=None, sizes=None):
+    """
+    Colour into an n_days window, spreading exams over the days; falls back to
+    lowest-colour-first if spreading leaves courses out. Returns (colours,
+    uncoloured, rooms) where rooms is the seated copy of `rooms`.
+    """
+    n_colors = n_days * slots_per_day
+    attempt = rooms.copy() if rooms is not None else None
+    colours, uncoloured = dsatur(graph, n_colors, attempt, fixed, slots_per_day, sizes)
+    if uncoloured:
+        packed = rooms.copy() if rooms is not None else None
+        packed_colours, packed_uncoloured = dsatur(graph, n_colors, packed, fixed, sizes=sizes)
+        if len(packed_uncoloured) < len(uncoloured):
+            return packed_colours, packed_uncoloured, packed
+    return colours, uncoloured, attempt
+
+
+def min_exam_days(graph, slots_per_day, rooms=None, fixed=None, groups=(), sizes=None):
+    """
+    Fewest days in which colour_window places every course, by binary search
+    between a lower bound (the largest class's course count, the slots the
+    rooms need, the latest fixed exam) and the days an unbounded DSatur run
+    needs. None if the courses can't be placed at all (no rooms).
+    """
+    if rooms is not None and not rooms.rooms:
+        return None if graph else 0
+    fixed = fixed or {}
+    if not graph:
+        return 0
+    colours, _ = dsatur(graph, rooms=rooms.copy() if rooms is not None else None, fixed=fixed, sizes=sizes)
+    hi = max(colours.values()) // slots_per_day + 1
+
+    lower = max((len(g) for g in groups), default=1)
+    if rooms is not None:
+        lower = max(lower, rooms.slots_needed([(sizes or {}).get(v, 0) for v in graph]))
+    lo = max(-(-lower // slots_per_day), max(fixed.values(), default=0) // slots_per_day + 1)
+    lo = min(lo, hi)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if colour_window(graph, mid, slots_per_day, rooms, fixed, sizes)[1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    return hi
+
+
+def next_monday(from_date=None):
+    d = from_date or datetime.date.today()
+    days_ahead = (7 - d.weekday()) % 7  # 0=Mon
+    days_ahead = 7 if days_ahead == 0 else days_ahead
+    return d + datetime.timedelta(days=days_ahead)
+
+
+def generate_exam_schedule(db_session, start_date=None, num_days=None, reset=False, slots=EXAM_SLOTS, pack=False):
+    """Generate one exam per course across the upcoming exam window.
+    - Colours the course conflict graph (courses sharing a class) into slots with DSatur
+    - Without num_days, uses the fewest days that fit every exam
+    - Avoids room conflicts and class overlap (a class can't have two exams at the same time)
+    - With pack, several exams share a room up to its capacity (see ExamRooms)
+    The whole plan is built in memory from a handful of queries and saved
+    with one bulk insert.
+    Returns (created_count, skipped_count, min_days) where min_days is the
+    shortest window that fits everything (None if there are no rooms).
+    """
+    # Optional reset (overwrite current draft exams)
+    if reset:
+        db_session.query(Exam).delete()
+        db_session.commit()
+
+    start = start_date or next_monday()
+    slot_index = {slot: i for i, slot in enumerate(slots)}
+
+    courses = db_session.query(Course.id).order_by(Course.name.asc()).all()
+    rooms = ExamRooms(db_session.query(Classroom.id, Classroom.capacity).all(), pack=pack)
+
+    # Build course -> classes mapping and the conflict graph between courses sharing a class
+    class_courses = db_session.query(ClassCourseTeacher.class_id, ClassCourseTeacher.course_id).all()
+    graph, groups = course_conflicts(class_courses)
+    course_to_class_ids = collections.defaultdict(set)
+    for class_id, course_id in class_courses:
+        course_to_class_ids[course_id].add(class_id)
+    for (course_id,) in courses:
+        graph.setdefault(course_id, set())
+
+    # Students sitting each exam: everyone in the classes taking the course
+    class_sizes = dict(db_session.query(Class.id, Class.size).all())
+    sizes = {
+        course_id: sum(class_sizes.get(cid) or 0 for cid in class_ids)
+        for course_id, class_ids in course_to_class_ids.items()
+    }
+
+    # Existing draft exams keep their slot and seats: inside the window they
+    # pin their course's colour, elsewhere they don't constrain the new exams
+    fixed = {}
+    courses_already_scheduled = set()
+    if not reset:
+        existing = db_session.query(Exam.course_id, Exam.room_id, Exam.date, Exam.start_time, Exam.end_time).all()
+        for course_id, room_id, date, start_time, end_time in existing:
+            index = slot_index.get((start_time, end_time))
+            if date and date >= start and index is not None:
+                colour = (date - start).days * len(slots) + index
+                rooms.book(colour, room_id, sizes.get(course_id, 0))
+                if course_to_class_ids.get(course_id):
+                    fixed[course_id] = colour
+            courses_already_scheduled.add(course_id)
+    for course_id in courses_already_scheduled - set(fixed):
+        for other in graph.pop(course_id, ()):
+            graph[other].discard(course_id)
+    groups = [courses & graph.keys() for courses in groups.values()]
+
+    min_days = min_exam_days(graph, len(slots), rooms, fixed=fixed, groups=groups, sizes=sizes)
+    if min_days is None:
+        return 0, len(courses), None
+    colours, _, seated = colour_window(graph, num_days or min_days, len(slots), rooms, fixed=fixed, sizes=sizes)
+
+    by_colour = collections.defaultdict(list)
+    for (course_id,) in courses:
+        if course_id not in courses_already_scheduled and course_id in colours:
+            by_colour[colours[course_id]].append((sizes.get(course_id, 0), course_id))
+
+    # Re-seat each slot's exams biggest first, which packs better than colouring
+    # order; keep the colouring's seating for a slot if that leaves anyone out
+    planned = []
+    for colour, exams in sorted(by_colour.items()):
+        day = start + datetime.timedelta(days=colour // len(slots))
+        start_time, end_time = slots[colour % len(slots)]
+        resat = rooms.copy()
+        exams.sort(key=lambda e: -e[0])
+        room_ids = [resat.take(colour, course_id, students) for students, course_id in exams]
+        if None in room_ids:
+            room_ids = [seated.assigned.get(course_id) for _, course_id in exams]
+        for (_, course_id), room_id in zip(exams, room_ids):
+            if room_id is None:
+                continue
+            planned.append({
+                'course_id': course_id, 'room_id': room_id, 'date': day,
+                'start_time': start_time, 'end_time': end_time,
+            })
+
+    if planned:
+        db_session.execute(insert(Exam), planned)
+    db_session.commit()
+    return len(planned), len(courses) - len(planned), min_days
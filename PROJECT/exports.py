@@ -0,0 +1,170 @@
+"""
+Streamed CSV and XLSX exports of the draft timetable, an approved
+timetable, exams and events.
+
+Rows come from one joined query read in batches of YIELD_PER, and each
+format writes them out as they arrive, so memory use doesn't grow with the
+size of the export. XLSX is written with zipfile into a sink that is drained
+after every batch (no spreadsheet library needed).
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from sqlalchemy.orm import aliased
+
+from models import Event, Exam
+from scheduler import Class, Classroom, Course, Teacher, Timetable
+from timetable_edits import approved_sessions
+
+YIELD_PER = 1000
+DAY_ORDER = {day: i for i, day in enumerate(
+    ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"))}
+
+
+def draft_rows(session):
+    yield ('class', 'day', 'start_time', 'end_time', 'course', 'teacher', 'room')
+    yield from session.query(
+        Class.name, Timetable.day, Timetable.start_time, Timetable.end_time, Course.name, Teacher.name, Classroom.name
+    ).join(Class, Timetable.class_id == Class.id
+    ).join(Course, Timetable.course_id == Course.id
+    ).outerjoin(Teacher, Timetable.teacher_id == Teacher.id
+    ).outerjoin(Classroom, Timetable.classroom_id == Classroom.id
+    ).order_by(Class.name, Timetable.day, Timetable.start_time).yield_per(YIELD_PER)
+
+
+def approved_rows(session, approved):
+    """Sessions of an approved timetable's current grid (already in memory, see load_state)."""
+    yield ('class', 'day', 'start_time', 'end_time', 'course', 'teacher', 'room')
+    sessions = approved_sessions(session, approved, lambda class_name, entry: True)
+    sessions.sort(key=lambda s: (s[0], DAY_ORDER.get(s[1], 7), s[2]))
+    for class_name, day, slot, entry in sessions:
+        start, _, end = slot.partition('-')
+        yield (class_name, day, start, end, entry['course'], entry['teacher'], entry['classroom'])
+
+
+def exam_rows(session):
+    invigilator = aliased(Teacher)
+    yield ('date', 'start_time', 'end_time', 'course', 'room', 'invigilator')
+    yield from session.query(
+        Exam.date, Exam.start_time, Exam.end_time, Course.name, Classroom.name, invigilator.name
+    ).outerjoin(Course, Exam.course_id == Course.id
+    ).outerjoin(Classroom, Exam.room_id == Classroom.id
+    ).outerjoin(invigilator, Exam.invigilator_id == invigilator.id
+    ).order_by(Exam.date, Exam.start_time, Exam.id).yield_per(YIELD_PER)
+
+
+def event_rows(session):
+    yield ('title', 'room', 'recurrence', 'date', 'start_date', 'end_date', 'day_of_week', 'day_of_month',
+           'start_time', 'end_time', 'description')
+    yield from session.query(
+        Event.title, Classroom.name, Event.recurrence, Event.date, Event.start_date, Event.end_date,
+        Event.day_of_week, Event.day_of_month, Event.start_time, Event.end_time, Event.description
+    ).outerjoin(Classroom, Event.room_id == Classroom.id).order_by(Event.id).yield_per(YIELD_PER)
+
+
+class _Sink:
+    """Write-only file object whose contents are taken out in chunks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = ''.join(self._chunks) if self._chunks and isinstance(self._chunks[0], str) else b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def csv_stream(rows):
+    """Rows (header first) as CSV text, one chunk per YIELD_PER rows."""
+    sink = _Sink()
+    writer = csv.writer(sink)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % YIELD_PER == 0:
+            yield sink.drain()
+    yield sink.drain()
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+# Characters XML 1.0 can't carry
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _column(index):
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell(ref, value):
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = _ILLEGAL_XML.sub('', str(value))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def xlsx_stream(rows, sheet_name='Export'):
+    """Rows (header first) as a one-sheet XLSX workbook, in chunks of zipped bytes."""
+    sink = _Sink()
+    # An unseekable sink makes zipfile write data descriptors instead of seeking back
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in _XLSX_PARTS.items():
+            workbook.writestr(name, xml)
+        workbook.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name[:31])))
+        yield sink.drain()
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            columns = []
+            for r, row in enumerate(rows, 1):
+                while len(columns) < len(row):
+                    columns.append(_column(len(columns)))
+                cells = ''.join(_cell(f'{columns[c]}{r}', value) for c, value in enumerate(row))
+                sheet.write(f'<row r="{r}">{cells}</row>'.encode('utf-8'))
+                if r % YIELD_PER == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
@@ -0,0 +1,128 @@
+import collections
+
+from availability import slot_bits, teacher_masks
+from scheduler import Class, Classroom, ClassCourseTeacher, Teacher
+
+# What generate_timetable places per class-course mapping
+LECTURES_PER_COURSE = 3
+LAB_SLOTS = 2
+
+
+class InfeasibleTimetableError(ValueError):
+    """The configuration can't fit the week grid; `report` says why (see check_feasibility)."""
+
+    def __init__(self, report):
+        self.report = report
+        errors = [p['message'] for p in report['problems'] if p['severity'] == 'error']
+        super().__init__("Timetable can't be generated: " + '; '.join(errors))
+
+
+def check_feasibility(session, days, time_slots):
+    """
+    Counting lower bounds, checked before generating a timetable.
+
+    Every class-course mapping needs LECTURES_PER_COURSE single slots plus a
+    lab on LAB_SLOTS consecutive slots. Checks that each teacher and each class
+    fits the week grid (hours and lab blocks, net of a teacher's unavailable
+    periods), that all sessions fit the total room-slots, and that labs fit
+    room x consecutive-pair capacity. Labs fall back to ordinary rooms, so too
+    few lab rooms is only a warning.
+
+    Returns {'feasible', 'problems': [{severity, check, resource, required,
+    available, message}], 'totals': {...}}; feasible is False if any problem
+    has severity 'error'.
+    """
+    n_days = len(days)
+    n_slots = len(time_slots)
+    slots_per_week = n_days * n_slots
+    # Non-overlapping lab blocks that fit in one resource's week
+    labs_per_week = n_days * (n_slots // LAB_SLOTS)
+    hours_per_course = LECTURES_PER_COURSE + LAB_SLOTS
+
+    mappings = session.query(ClassCourseTeacher.class_id, ClassCourseTeacher.teacher_id).all()
+    rooms = session.query(Classroom.name).all()
+    n_rooms = len(rooms)
+    n_lab_rooms = sum(1 for (name,) in rooms if 'lab' in (name or '').lower())
+    per_teacher = collections.Counter(teacher_id for _, teacher_id in mappings)
+    per_class = collections.Counter(class_id for class_id, _ in mappings)
+
+    problems = []
+
+    def problem(severity, check, resource, required, available, message):
+        problems.append({
+            'severity': severity, 'check': check, 'resource': resource,
+            'required': required, 'available': available, 'message': message,
+        })
+
+    if n_slots < LAB_SLOTS and mappings:
+        problem('error', 'grid', None, LAB_SLOTS, n_slots,
+                f"Labs need {LAB_SLOTS} consecutive slots but the day has only {n_slots}")
+
+    # Teachers with unavailable periods have a smaller week of their own
+    masks = teacher_masks(session)
+    bits = slot_bits(days, time_slots)
+    grid_bits = [[bits[(day, start, end)] for start, end in time_slots] for day in days]
+
+    def week_of(unavailable):
+        """(slots, lab blocks) left in the week around an unavailable mask."""
+        if not unavailable:
+            return slots_per_week, labs_per_week
+        slots = blocks = 0
+        for day_bits in grid_bits:
+            run = 0
+            for bit in day_bits + [None]:
+                if bit is not None and not unavailable & bit:
+                    run += 1
+                    slots += 1
+                else:
+                    blocks += run // LAB_SLOTS
+                    run = 0
+        return slots, blocks
+
+    for check, model, counts, noun in (('teacher', Teacher, per_teacher, 'Teacher'),
+                                       ('class', Class, per_class, 'Class')):
+        over = {}
+        for rid, n in counts.items():
+            slots, blocks = week_of(masks.get(rid, (0, 0))[0] if check == 'teacher' else 0)
+            if n * hours_per_course > slots or n > blocks:
+                over[rid] = (n, slots, blocks)
+        if not over:
+            continue
+        names = dict(session.query(model.id, model.name).filter(model.id.in_(list(over))).all())
+        for rid, (n, slots, blocks) in sorted(over.items(), key=lambda item: -item[1][0]):
+            name = names.get(rid, rid)
+            if n * hours_per_course > slots:
+                problem('error', f'{check}_hours', name, n * hours_per_course, slots,
+                        f"{noun} {name} needs {n * hours_per_course} slots for {n} courses "
+                        f"but has {slots} available in the week")
+            if n > blocks:
+                problem('error', f'{check}_labs', name, n, blocks,
+                        f"{noun} {name} needs {n} lab blocks but the week fits {blocks}")
+
+    total_slots = len(mappings) * hours_per_course
+    room_slots = n_rooms * slots_per_week
+    if total_slots > room_slots:
+        problem('error', 'room_slots', None, total_slots, room_slots,
+                f"Sessions need {total_slots} room-slots but {n_rooms} rooms give {room_slots}")
+
+    n_labs = len(mappings)
+    if n_labs > n_rooms * labs_per_week:
+        problem('error', 'lab_blocks', None, n_labs, n_rooms * labs_per_week,
+                f"{n_labs} labs need consecutive slot pairs but {n_rooms} rooms fit {n_rooms * labs_per_week}")
+    elif n_labs > n_lab_rooms * labs_per_week:
+        problem('warning', 'lab_rooms', None, n_labs, n_lab_rooms * labs_per_week,
+                f"{n_labs} labs but {n_lab_rooms} lab rooms fit {n_lab_rooms * labs_per_week}; "
+                "the rest will use ordinary rooms")
+
+    return {
+        'feasible': not any(p['severity'] == 'error' for p in problems),
+        'problems': problems,
+        'totals': {
+            'mappings': len(mappings),
+            'required_slots': total_slots,
+            'room_slots': room_slots,
+            'labs': n_labs,
+            'lab_room_blocks': n_lab_rooms * labs_per_week,
+            'slots_per_week': slots_per_week,
+        },
+    }
@@ -0,0 +1,218 @@
+"""
+iCalendar feeds for one teacher, room or class: the weekly sessions of the
+active approved timetable as recurring events (cancelled dates excluded),
+plus the room's events and the exams they sit, hold or invigilate.
+
+A CalendarFeed only reads the small per-owner rows up front, enough for
+its ETag and Last-Modified. A class feed only reads the timetable grid
+when the feed has to be sent; teacher and room feeds read their sessions
+from the cached grid up front, to know which cancellations are theirs.
+"""
+import datetime
+import hashlib
+
+from sqlalchemy import func, tuple_
+
+from models import ApprovedTimetable, ApprovedTimetableEdit, ClassCancellation, Event, Exam
+from occurrences import occurrence_dates
+from scheduler import Class, ClassCourseTeacher, Classroom, Course
+from semester_calendar import current_semester
+from timetable_edits import approved_sessions
+
+PRODID = '-//College Timetable//Calendar Feeds//EN'
+RRULE_DAYS = {'Monday': 'MO', 'Tuesday': 'TU', 'Wednesday': 'WE', 'Thursday': 'TH',
+              'Friday': 'FR', 'Saturday': 'SA', 'Sunday': 'SU'}
+WEEKDAY_INDEX = {day: i for i, day in enumerate(RRULE_DAYS)}
+
+
+def _escape(text):
+    return (str(text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Content line split into 75-octet pieces as RFC 5545 requires, with CRLF."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    pieces, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not pieces else 74), len(data))
+        while end < len(data) and (data[end] & 0xC0) == 0x80:  # don't split a UTF-8 sequence
+            end -= 1
+        pieces.append(data[start:end].decode('utf-8'))
+        start = end
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def _stamp(day, hhmm):
+    return day.strftime('%Y%m%d') + 'T' + hhmm.replace(':', '') + '00'
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _uid(*parts):
+    return hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:20] + '@timetable'
+
+
+class CalendarFeed:
+    """The feed of one owner: kind is 'teacher', 'room' or 'class', owner the Teacher, Classroom or Class."""
+
+    def __init__(self, session, kind, owner):
+        self.kind, self.owner = kind, owner
+        # Column queries so versions are read from the database, not the identity map
+        self.timetable = session.query(
+            ApprovedTimetable.id, ApprovedTimetable.name, ApprovedTimetable.version, ApprovedTimetable.approved_at
+        ).filter(ApprovedTimetable.is_active.is_(True)).order_by(ApprovedTimetable.id.desc()).first()
+        self.semester = current_semester(session)
+        self.exams = self._exams(session)
+        self.events = self._events(session)
+        self._sessions = None
+        self.cancellations = self._cancellations(session)
+        self.edited_at = None
+        if self.timetable:
+            self.edited_at = session.query(func.max(ApprovedTimetableEdit.created_at)).filter(
+                ApprovedTimetableEdit.approved_timetable_id == self.timetable.id).scalar()
+
+    def _exams(self, session):
+        query = session.query(Exam.id, Exam.date, Exam.start_time, Exam.end_time, Course.name, Classroom.name
+                              ).join(Course, Exam.course_id == Course.id
+                              ).outerjoin(Classroom, Exam.room_id == Classroom.id).filter(Exam.date.isnot(None))
+        if self.kind == 'teacher':
+            query = query.filter(Exam.invigilator_id == self.owner.id)
+        elif self.kind == 'room':
+            query = query.filter(Exam.room_id == self.owner.id)
+        else:
+            query = query.filter(Exam.course_id.in_(
+                session.query(ClassCourseTeacher.course_id).filter(ClassCourseTeacher.class_id == self.owner.id)))
+        return query.order_by(Exam.date, Exam.start_time, Exam.id).all()
+
+    def _events(self, session):
+        if self.kind != 'room':
+            return []
+        return session.query(
+            Event.id, Event.title, Event.description, Event.recurrence, Event.date, Event.start_date,
+            Event.end_date, Event.day_of_week, Event.day_of_month, Event.start_time, Event.end_time, Event.created_at
+        ).filter(Event.room_id == self.owner.id).order_by(Event.id).all()
+
+    def _cancellations(self, session):
+        """{(class name, course name): [dates]} of cancelled sessions of the owner's classes and courses."""
+        query = session.query(Class.name, Course.name, ClassCancellation.date, ClassCancellation.cancelled_at
+                              ).join(Class, ClassCancellation.class_id == Class.id
+                              ).join(Course, ClassCancellation.course_id == Course.id)
+        if self.kind == 'class':
+            query = query.filter(ClassCancellation.class_id == self.owner.id)
+        else:
+            pairs = {(class_name, entry['course']) for class_name, _, _, entry in self._approved_sessions(session)}
+            query = query.filter(tuple_(Class.name, Course.name).in_(pairs)) if pairs else None
+        rows = query.order_by(ClassCancellation.date).all() if query is not None else []
+        self._cancelled_at = max((row[3] for row in rows if row[3]), default=None)
+        cancelled = {}
+        for class_name, course_name, date, _ in rows:
+            cancelled.setdefault((class_name, course_name), []).append(_as_date(date))
+        return cancelled
+
+    @property
+    def etag(self):
+        semester = self.semester and (self.semester.id, self.semester.start_date, self.semester.end_date)
+        timetable = self.timetable and (self.timetable.id, self.timetable.version)
+        key = repr((self.kind, self.owner.id, getattr(self.owner, 'name', None), timetable, semester,
+                    self.exams, self.events, sorted(self.cancellations.items())))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @property
+    def last_modified(self):
+        times = [self.timetable and self.timetable.approved_at, self.edited_at, self._cancelled_at]
+        times += [row.created_at for row in self.events]
+        times = [t for t in times if t]
+        return max(times) if times else None
+
+    def _anchor(self):
+        """First date of the weekly series: the semester start, else the Monday of the approval week."""
+        if self.semester:
+            return self.semester.start_date
+        approved = _as_date(self.timetable.approved_at) if self.timetable.approved_at else datetime.date(2000, 1, 3)
+        return approved - datetime.timedelta(days=approved.weekday())
+
+    def _keep(self, class_name, entry):
+        if self.kind == 'teacher':
+            return entry['teacher'] == self.owner.name
+        if self.kind == 'room':
+            return entry['classroom'] == self.owner.name
+        return class_name == self.owner.name
+
+    def _approved_sessions(self, session):
+        """The owner's sessions in the active approved timetable, read once from the cached grid."""
+        if self._sessions is None:
+            self._sessions = []
+            if self.timetable:
+                approved = session.query(ApprovedTimetable).get(self.timetable.id)
+                self._sessions = approved_sessions(session, approved, self._keep)
+                self._sessions.sort(key=lambda s: (WEEKDAY_INDEX.get(s[1], 7), s[2], s[0]))
+        return self._sessions
+
+    def lines(self, session):
+        """Iterator over the folded lines of the calendar; reads the timetable grid now, renders lazily."""
+        return self._render(self._approved_sessions(session))
+
+    def _render(self, sessions):
+        now = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        name = {'teacher': 'Teaching', 'room': 'Room', 'class': 'Class'}[self.kind]
+        yield from map(_fold, (
+            'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN',
+            f'X-WR-CALNAME:{_escape(f"{name} timetable - {self.owner.name}")}',
+        ))
+        if sessions:
+            anchor = self._anchor()
+            until = f";UNTIL={_stamp(self.semester.end_date, '23:59')}" if self.semester else ''
+            for class_name, day, slot, entry in sessions:
+                if day not in RRULE_DAYS or '-' not in slot:
+                    continue
+                start, end = slot.split('-', 1)
+                first = anchor + datetime.timedelta(days=(WEEKDAY_INDEX[day] - anchor.weekday()) % 7)
+                lines = [
+                    'BEGIN:VEVENT',
+                    f"UID:{_uid('session', self.timetable.id, class_name, day, slot, entry['course'], entry['teacher'])}",
+                    f'DTSTAMP:{now}',
+                    f'DTSTART:{_stamp(first, start)}',
+                    f'DTEND:{_stamp(first, end)}',
+                    f'RRULE:FREQ=WEEKLY;BYDAY={RRULE_DAYS[day]}{until}',
+                    f"SUMMARY:{_escape(entry['course'] + ' (' + class_name + ')')}",
+                    f"LOCATION:{_escape(entry['classroom'])}",
+                    f"DESCRIPTION:{_escape('Teacher: ' + (entry['teacher'] or 'N/A'))}",
+                ]
+                lines += [f'EXDATE:{_stamp(date, start)}'
+                          for date in self.cancellations.get((class_name, entry['course']), ())
+                          if date and date >= first and date.weekday() == WEEKDAY_INDEX[day]]
+                lines.append('END:VEVENT')
+                yield from map(_fold, lines)
+        for event in self.events:
+            yield from map(_fold, self._event_lines(event, now))
+        for exam_id, date, start, end, course_name, room_name in self.exams:
+            yield from map(_fold, (
+                'BEGIN:VEVENT', f"UID:{_uid('exam', exam_id)}", f'DTSTAMP:{now}',
+                f'DTSTART:{_stamp(date, start)}', f'DTEND:{_stamp(date, end)}',
+                f'SUMMARY:{_escape("Exam: " + course_name)}', f'LOCATION:{_escape(room_name)}',
+                'END:VEVENT',
+            ))
+        yield _fold('END:VCALENDAR')
+
+    @staticmethod
+    def _event_lines(event, now):
+        first = next(occurrence_dates(event), None)
+        if first is None:
+            return []
+        lines = ['BEGIN:VEVENT', f"UID:{_uid('event', event.id)}", f'DTSTAMP:{now}',
+                 f'DTSTART:{_stamp(first, event.start_time)}', f'DTEND:{_stamp(first, event.end_time)}']
+        until = f";UNTIL={_stamp(_as_date(event.end_date), '23:59')}" if event.end_date else ''
+        if event.recurrence == 'weekly':
+            lines.append(f'RRULE:FREQ=WEEKLY;BYDAY={RRULE_DAYS[event.day_of_week]}{until}')
+        elif event.recurrence == 'monthly':
+            lines.append(f'RRULE:FREQ=MONTHLY;BYMONTHDAY={event.day_of_month}{until}')
+        lines.append(f'SUMMARY:{_escape(event.title)}')
+        if event.description:
+            lines.append(f'DESCRIPTION:{_escape(event.description)}')
+        lines.append('END:VEVENT')
+        return lines
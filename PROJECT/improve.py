@@ -0,0 +1,359 @@
+import bisect
+import math
+import random
+import time
+
+from sqlalchemy import update, insert, delete
+
+from availability import slot_bits, teacher_masks
+from scheduler import Timetable, Class, Classroom, ClassCourseTeacher, _split_sessions
+
+# Score weights, per violation
+MISSED_WEIGHT = 100    # per slot of a lab or lecture that could not be placed
+REPEAT_WEIGHT = 5      # a course meeting more than once a day for a class
+LAB_ROOM_WEIGHT = 3    # a lab outside a lab room, or a lecture taking one
+GAP_WEIGHT = 1         # an idle slot between two busy slots of a teacher or class
+PREFERENCE_WEIGHT = 1  # a slot taught outside the teacher's preferred periods (if any)
+
+LECTURES_PER_COURSE = 3
+START_TEMPERATURE = 3.0
+
+
+class _Session:
+    __slots__ = ('class_id', 'course_id', 'teacher_id', 'length', 'refs', 'day', 'start', 'room_id', 'size')
+
+    def __init__(self, class_id, course_id, teacher_id, length, refs=(), day=None, start=None, room_id=None, size=0):
+        self.class_id = class_id
+        self.course_id = course_id
+        self.teacher_id = teacher_id
+        self.length = length
+        self.refs = list(refs)
+        self.day = day
+        self.start = start
+        self.room_id = room_id
+        self.size = size
+
+    @property
+    def position(self):
+        return (self.day, self.start, self.room_id)
+
+
+class _LocalSearch:
+    """
+    Simulated annealing over session placements. Every move keeps the
+    timetable clash-free; scores are updated from the few (teacher, day),
+    (class, day) and (class, course, day) groups a move touches.
+    """
+
+    def __init__(self, sessions, rooms, days, n_slots, rng, masks=None, cell_bits=None):
+        self.sessions = sessions
+        self.days = list(days)
+        self.n_slots = n_slots
+        self.rng = rng
+        # Teacher availability {teacher_id: (unavailable, preferred)}, tested against span masks
+        # built from {(day, slot index): availability bits} of the grid's cells
+        self.masks = masks or {}
+        self.cell_bits = cell_bits or {}
+        self.span_masks = {}
+        self.room_ids = [r.id for r in rooms]
+        self.lab_room_ids = {r.id for r in rooms if 'lab' in (r.name or '').lower()}
+        # Room ids of each kind sorted by capacity, with the capacities alongside for bisecting
+        by_capacity = sorted(((r.capacity or 0, r.id) for r in rooms))
+        self.lab_rooms = [rid for _, rid in by_capacity if rid in self.lab_room_ids]
+        self.lecture_rooms = [rid for _, rid in by_capacity if rid not in self.lab_room_ids]
+        capacity = {r.id: r.capacity or 0 for r in rooms}
+        self.lab_capacities = [capacity[rid] for rid in self.lab_rooms]
+        self.lecture_capacities = [capacity[rid] for rid in self.lecture_rooms]
+        self.at = {}      # (kind, resource, day, slot index) -> session
+        self.busy = {}    # ('t', teacher_id, day) / ('c', class_id, day) -> set of slot indices
+        self.meetings = {}  # (class_id, course_id, day) -> sessions that day
+        # Stand-in for rows the search may not move; it only ever sits in `at`
+        self.fixed = _Session(None, None, None, 1)
+        for s in sessions:
+            if s.day is not None:
+                self._book(s)
+        self.unplaced = [s for s in sessions if s.day is None]
+        self.placed = [s for s in sessions if s.day is not None]
+
+    # -- bookkeeping --
+
+    def _keys(self, s, day, start, room_id):
+        for idx in range(start, start + s.length):
+            yield ('r', room_id, day, idx)
+            yield ('t', s.teacher_id, day, idx)
+            yield ('c', s.class_id, day, idx)
+
+    def _book(self, s):
+        for key in self._keys(s, s.day, s.start, s.room_id):
+            self.at[key] = s
+        for busy_key in (('t', s.teacher_id, s.day), ('c', s.class_id, s.day)):
+            self.busy.setdefault(busy_key, set()).update(range(s.start, s.start + s.length))
+        meeting_key = (s.class_id, s.course_id, s.day)
+        self.meetings[meeting_key] = self.meetings.get(meeting_key, 0) + 1
+
+    def _unbook(self, s):
+        for key in self._keys(s, s.day, s.start, s.room_id):
+            del self.at[key]
+        for busy_key in (('t', s.teacher_id, s.day), ('c', s.class_id, s.day)):
+            self.busy[busy_key].difference_update(range(s.start, s.start + s.length))
+        self.meetings[(s.class_id, s.course_id, s.day)] -= 1
+
+    def _move(self, s, position):
+        """Move a session to (day, start, room_id), or out of the timetable with (None, None, None)."""
+        if s.day is not None:
+            self._unbook(s)
+            self.placed.remove(s)
+            self.unplaced.append(s)
+        s.day, s.start, s.room_id = position
+        if s.day is not None:
+            self._book(s)
+            self.unplaced.remove(s)
+            self.placed.append(s)
+
+    # -- scoring --
+
+    def _span_mask(self, day, start, length):
+        key = (day, start, length)
+        mask = self.span_masks.get(key)
+        if mask is None:
+            mask = 0
+            for i in range(start, start + length):
+                mask |= self.cell_bits.get((day, i), 0)
+            self.span_masks[key] = mask
+        return mask
+
+    def _session_cost(self, s):
+        if s.day is None:
+            return MISSED_WEIGHT * s.length
+        is_lab = s.length > 1
+        cost = LAB_ROOM_WEIGHT if is_lab != (s.room_id in self.lab_room_ids) else 0
+        preferred = self.masks.get(s.teacher_id, (0, 0))[1]
+        if preferred:
+            cost += PREFERENCE_WEIGHT * (self._span_mask(s.day, s.start, s.length) & ~preferred).bit_count()
+        return cost
+
+    def _groups(self, s, day):
+        """Score groups a session placed on `day` belongs to."""
+        if day is None:
+            return ()
+        return (('t', s.teacher_id, day), ('c', s.class_id, day), ('m', s.class_id, s.course_id, day))
+
+    def _group_cost(self, group):
+        if group[0] == 'm':
+            return REPEAT_WEIGHT * max(0, self.meetings.get(group[1:], 0) - 1)
+        busy = self.busy.get(group)
+        if not busy:
+            return 0
+        return GAP_WEIGHT * (max(busy) - min(busy) + 1 - len(busy))
+
+    def _local_cost(self, sessions, groups):
+        return sum(self._session_cost(s) for s in sessions) + sum(self._group_cost(g) for g in groups)
+
+    def score(self):
+        cost = sum(self._session_cost(s) for s in self.sessions)
+        for busy in self.busy.values():
+            if busy:
+                cost += GAP_WEIGHT * (max(busy) - min(busy) + 1 - len(busy))
+        cost += REPEAT_WEIGHT * sum(max(0, n - 1) for n in self.meetings.values())
+        return cost
+
+    # -- moves --
+
+    def _allowed(self, s, day, start):
+        """The teacher is not marked unavailable anywhere in the span."""
+        unavailable = self.masks.get(s.teacher_id, (0, 0))[0]
+        return not (unavailable and unavailable & self._span_mask(day, start, s.length))
+
+    def _free(self, s, day, start, room_id):
+        return all(key not in self.at or self.at[key] is s for key in self._keys(s, day, start, room_id))
+
+    def _candidate_rooms(self, s, tries=8):
+        """Random rooms to try, mostly of the preferred kind and big enough for the class."""
+        if s.length > 1:
+            preferred, capacities = self.lab_rooms, self.lab_capacities
+        else:
+            preferred, capacities = self.lecture_rooms, self.lecture_capacities
+        pool = preferred if preferred and self.rng.random() < 0.8 else self.room_ids
+        if pool is preferred:
+            seated = preferred[bisect.bisect_left(capacities, s.size):]
+            pool = seated or preferred
+        return [self.rng.choice(pool) for _ in range(tries)]
+
+    def _random_spot(self, s):
+        return self.rng.choice(self.days), self.rng.randrange(self.n_slots - s.length + 1)
+
+    def _propose_relocation(self):
+        """A placed or missed session to a random clash-free spot: [(session, new position)]."""
+        if self.unplaced and self.rng.random() < 0.3:
+            s = self.rng.choice(self.unplaced)
+        else:
+            s = self.rng.choice(self.placed)
+        day, start = self._random_spot(s)
+        if not self._allowed(s, day, start):
+            return None
+        for room_id in self._candidate_rooms(s):
+            if self._free(s, day, start, room_id):
+                return [(s, (day, start, room_id))]
+        return None
+
+    def _propose_ejection(self):
+        """A missed session into a spot held by exactly one other session, which is taken out."""
+        s = self.rng.choice(self.unplaced)
+        day, start = self._random_spot(s)
+        if not self._allowed(s, day, start):
+            return None
+        for room_id in self._candidate_rooms(s, tries=4):
+            holders = {self.at[key] for key in self._keys(s, day, start, room_id) if key in self.at}
+            if len(holders) == 1 and self.fixed not in holders:
+                holder = holders.pop()
+                return [(holder, (None, None, None)), (s, (day, start, room_id))]
+        return None
+
+    def _apply(self, proposal):
+        """Apply moves, returning the cost delta and the undo list."""
+        sessions = [s for s, _ in proposal]
+        groups = set()
+        for s, (day, _, _) in proposal:
+            groups.update(self._groups(s, s.day))
+            groups.update(self._groups(s, day))
+        before = self._local_cost(sessions, groups)
+        undo = [(s, s.position) for s, _ in reversed(proposal)]
+        for s, position in proposal:
+            self._move(s, position)
+        return self._local_cost(sessions, groups) - before, undo
+
+    def run(self, seconds):
+        deadline = time.monotonic() + seconds
+        started = time.monotonic()
+        current = best = self.score()
+        best_positions = {id(s): s.position for s in self.sessions}
+        iterations = 0
+        while current > 0 and self.placed:
+            if iterations % 256 == 0:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                temperature = START_TEMPERATURE * (1 - (now - started) / seconds) + 0.01
+            iterations += 1
+            if self.unplaced and self.rng.random() < 0.2:
+                proposal = self._propose_ejection()
+            else:
+                proposal = self._propose_relocation()
+            if proposal is None:
+                continue
+            delta, undo = self._apply(proposal)
+            if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+                current += delta
+                if current < best:
+                    best = current
+                    best_positions = {id(s): s.position for s in self.sessions}
+            else:
+                for s, position in undo:
+                    self._move(s, position)
+        for s in self.sessions:
+            s.day, s.start, s.room_id = best_positions[id(s)]
+        return best, iterations
+
+
+def _load_sessions(session, slot_index):
+    """Draft rows grouped into labs and lectures, plus an unplaced session for each one missing."""
+    mapping = {
+        (class_id, course_id): teacher_id
+        for class_id, course_id, teacher_id in session.query(
+            ClassCourseTeacher.class_id, ClassCourseTeacher.course_id, ClassCourseTeacher.teacher_id
+        ).order_by(ClassCourseTeacher.id)
+    }
+    class_sizes = dict(session.query(Class.id, Class.size).all())
+    placed = {}
+    fixed = []
+    for row in session.query(Timetable.id, Timetable.class_id, Timetable.course_id, Timetable.teacher_id,
+                             Timetable.classroom_id, Timetable.day, Timetable.start_time,
+                             Timetable.end_time).order_by(Timetable.id):
+        idx = slot_index.get((row.start_time, row.end_time))
+        key = (row.class_id, row.course_id)
+        if idx is None or mapping.get(key) != row.teacher_id:
+            fixed.append(row)  # not ours to move, but it still holds its resources
+            continue
+        placed.setdefault(key, []).append((row.day, row.classroom_id, idx, row.id))
+
+    sessions = []
+    for (class_id, course_id), teacher_id in mapping.items():
+        size = class_sizes.get(class_id) or 0
+        lab, lectures = _split_sessions(placed.get((class_id, course_id), []))
+        if lab is not None:
+            day, room_id, idx, _ = lab[0]
+            sessions.append(_Session(class_id, course_id, teacher_id, 2, [p[3] for p in lab], day, idx, room_id, size))
+        else:
+            sessions.append(_Session(class_id, course_id, teacher_id, 2, size=size))
+        for day, room_id, idx, ref in lectures:
+            sessions.append(_Session(class_id, course_id, teacher_id, 1, [ref], day, idx, room_id, size))
+        for _ in range(LECTURES_PER_COURSE - len(lectures)):
+            sessions.append(_Session(class_id, course_id, teacher_id, 1, size=size))
+    return sessions, fixed
+
+
+def improve_timetable(session, days, time_slots, seconds, rng=None):
+    """
+    Improve the draft timetable by simulated annealing for at most `seconds`
+    of wall-clock time, stopping early once the score reaches zero.
+
+    The score counts missed labs/lectures, idle gaps in teacher and class
+    days, a course meeting a class more than once a day, labs/lectures in the
+    wrong kind of room and teaching outside a teacher's preferred periods (see
+    the *_WEIGHT constants). Teachers' unavailable periods are never used.
+    Only changed rows are written back. Returns {'score_before',
+    'score_after', 'missed_before', 'missed_after', 'iterations'}.
+    """
+    rng = rng or random.Random()
+    slot_index = {(start, end): i for i, (start, end) in enumerate(time_slots)}
+    sessions, fixed = _load_sessions(session, slot_index)
+    rooms = session.query(Classroom).order_by(Classroom.id).all()
+    bits = slot_bits(days, time_slots)
+    cell_bits = {(day, i): bits[(day, start, end)] for day in days for i, (start, end) in enumerate(time_slots)}
+    search = _LocalSearch(sessions, rooms, days, len(time_slots), rng, teacher_masks(session), cell_bits)
+    # Rows we don't move still block their room, teacher and class
+    for row in fixed:
+        idx = slot_index.get((row.start_time, row.end_time))
+        if idx is not None:
+            for key in (('r', row.classroom_id, row.day, idx), ('t', row.teacher_id, row.day, idx),
+                        ('c', row.class_id, row.day, idx)):
+                search.at[key] = search.fixed
+    original = {id(s): s.position for s in sessions}
+    missed_before = len(search.unplaced)
+    score_before = search.score()
+    score_after, iterations = search.run(seconds) if seconds > 0 else (score_before, 0)
+
+    updates, inserts, deletes = [], [], []
+    for s in sessions:
+        if s.position == original[id(s)]:
+            continue
+        if s.day is None:
+            deletes.extend(s.refs)
+            continue
+        spans = [time_slots[s.start + i] for i in range(s.length)]
+        if s.refs:
+            for ref, (start, end) in zip(s.refs, spans):
+                updates.append({'id': ref, 'day': s.day, 'start_time': start, 'end_time': end,
+                                'classroom_id': s.room_id})
+        else:
+            for start, end in spans:
+                inserts.append({'class_id': s.class_id, 'course_id': s.course_id, 'teacher_id': s.teacher_id,
+                                'classroom_id': s.room_id, 'day': s.day, 'start_time': start, 'end_time': end})
+    try:
+        for values in updates:
+            session.execute(update(Timetable).where(Timetable.id == values.pop('id')).values(**values))
+        if deletes:
+            session.execute(delete(Timetable).where(Timetable.id.in_(deletes)))
+        if inserts:
+            session.execute(insert(Timetable), inserts)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return {
+        'score_before': score_before,
+        'score_after': score_after,
+        'missed_before': missed_before,
+        'missed_after': sum(1 for s in sessions if s.day is None),
+        'iterations': iterations,
+    }
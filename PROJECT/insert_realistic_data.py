@@ -1,4 +1,4 @@
-from scheduler import get_session, add_classroom, add_course, add_teacher, add_class, Course, Teacher, Class, Classroom, ClassCourseTeacher
+from scheduler import get_session, add_classroom, add_course, add_teacher, add_class, add_classes_bulk, Course, Teacher, Class, Classroom, ClassCourseTeacher
 
 session = get_session()
 
@@ -170,21 +170,15 @@ classes = [
 ]
 
 # Add classes with course-teacher mappings
-all_courses = session.query(Course).all()
-all_teachers = session.query(Teacher).all()
+# Teachers are matched to courses by subject name
+teacher_by_subject = {}
+for teacher in session.query(Teacher).all():
+    teacher_by_subject.setdefault(teacher.subject, teacher.name)
 
-# Dictionary mapping courses to teachers
-course_teacher_map = {}
-for teacher in all_teachers:
-    course = session.query(Course).filter_by(name=teacher.subject).first()
-    if course:
-        course_teacher_map[course.id] = teacher.id
-
-# Add classes with appropriate course-teacher mappings
+# Build the whole roster by name and write it in one transaction
+roster = {}
 for class_name in classes:
     # Select a subset of appropriate courses for each class based on the program
-    class_courses = {}
-    
     if "Civil" in class_name:
         relevant_subjects = ["Calculus I", "Engineering Physics I", "Structural Analysis", 
                              "Geotechnical Engineering", "Surveying"]
@@ -212,15 +206,14 @@ for class_name in classes:
                              "Engineering Economics", "Professional Ethics"]
     
     # Create course-teacher mapping for this class
-    for subject in relevant_subjects:
-        course = session.query(Course).filter_by(name=subject).first()
-        if course:
-            teacher = session.query(Teacher).filter_by(subject=subject).first()
-            if teacher:
-                class_courses[course.id] = teacher.id
-    
-    # Add the class with its course-teacher mappings
+    class_courses = {
+        subject: teacher_by_subject[subject]
+        for subject in relevant_subjects
+        if subject in courses and subject in teacher_by_subject
+    }
     if class_courses:
-        add_class(session, class_name, class_courses)
+        roster[class_name] = class_courses
+
+add_classes_bulk(session, roster)
 
 print("Realistic academic data inserted successfully.")
@@ -0,0 +1,127 @@
+import collections
+import heapq
+
+from sqlalchemy import func, update
+
+from availability import period_mask, teacher_masks
+from models import Exam
+from scheduler import Teacher, Timetable
+
+# Weekly teaching slots that weigh as much as one invigilation when balancing duties
+TEACHING_SLOTS_PER_DUTY = 10
+
+
+def _overlaps(start, end, other_start, other_end):
+    # HH:MM strings compare in time order
+    return start < other_end and other_start < end
+
+
+def _busy_masks(session, periods):
+    """
+    {teacher_id: bitmask over `periods`} of exam periods each teacher can't
+    invigilate because they teach then (draft timetable) or marked an
+    overlapping teaching period unavailable.
+    """
+    by_weekday = collections.defaultdict(list)
+    for p, (date, start, end) in enumerate(periods):
+        by_weekday[date.strftime('%A')].append((p, start, end))
+
+    busy = collections.defaultdict(int)
+    for teacher_id, day, start, end in session.query(
+            Timetable.teacher_id, Timetable.day, Timetable.start_time, Timetable.end_time).distinct():
+        for p, exam_start, exam_end in by_weekday.get(day, ()):
+            if _overlaps(start, end, exam_start, exam_end):
+                busy[teacher_id] |= 1 << p
+
+    masks = teacher_masks(session)
+    if masks:
+        # Availability bits each exam period overlaps, matched by time
+        period_bits = [period_mask(date.strftime('%A'), start, end) for date, start, end in periods]
+        for teacher_id, (unavailable, _) in masks.items():
+            for p, bits in enumerate(period_bits):
+                if unavailable & bits:
+                    busy[teacher_id] |= 1 << p
+    return busy
+
+
+def assign_invigilators(session, reassign=False, commit=True):
+    """
+    Give every draft exam room an invigilator: one teacher per (date, time,
+    room), shared by the exams seated together. A teacher is never put on an
+    exam period they teach in, overlapping a period they marked unavailable
+    or already invigilate elsewhere. Duties go greedily, period by
+    period, to the free teachers with the lowest load, counting one duty per
+    TEACHING_SLOTS_PER_DUTY weekly teaching slots.
+
+    Existing assignments are kept unless reassign. Returns {'assigned': rooms
+    newly covered, 'unassigned': [{date, start_time, end_time, room_id}],
+    'duties': {teacher_id: invigilations}}.
+    """
+    exams = session.query(
+        Exam.id, Exam.date, Exam.start_time, Exam.end_time, Exam.room_id, Exam.invigilator_id
+    ).filter(Exam.date.isnot(None)).order_by(Exam.date, Exam.start_time, Exam.room_id).all()
+
+    rooms = collections.OrderedDict()  # (date, start, end, room_id) -> [exam ids]
+    current = {}                       # same key -> invigilator kept from before
+    for exam_id, date, start, end, room_id, invigilator_id in exams:
+        key = (date, start, end, room_id)
+        rooms.setdefault(key, []).append(exam_id)
+        if invigilator_id is not None and not reassign:
+            current.setdefault(key, invigilator_id)
+
+    periods = list(dict.fromkeys(key[:3] for key in rooms))
+    period_index = {period: p for p, period in enumerate(periods)}
+    busy = _busy_masks(session, periods)
+    # Taking a duty at period p rules out every period overlapping it that day
+    same_date = collections.defaultdict(list)
+    for q, (date, start, end) in enumerate(periods):
+        same_date[date].append((q, start, end))
+    clashing = [
+        sum(1 << q for q, other_start, other_end in same_date[date] if _overlaps(start, end, other_start, other_end))
+        for date, start, end in periods
+    ]
+
+    teaching = collections.Counter(dict(
+        session.query(Timetable.teacher_id, func.count(Timetable.id)).group_by(Timetable.teacher_id).all()
+    ))
+    teacher_ids = [teacher_id for (teacher_id,) in session.query(Teacher.id).order_by(Teacher.id)]
+    duties = collections.Counter()
+    for key, teacher_id in current.items():
+        busy[teacher_id] |= clashing[period_index[key[:3]]]
+        duties[teacher_id] += 1
+
+    def load(teacher_id):
+        return duties[teacher_id] + teaching[teacher_id] / TEACHING_SLOTS_PER_DUTY
+
+    by_period = collections.defaultdict(list)
+    for key in rooms:
+        if key not in current:
+            by_period[period_index[key[:3]]].append(key)
+
+    chosen, unassigned = {}, []
+    for p, keys in sorted(by_period.items()):
+        bit = 1 << p
+        free = [teacher_id for teacher_id in teacher_ids if not busy[teacher_id] & bit]
+        picked = heapq.nsmallest(len(keys), free, key=lambda teacher_id: (load(teacher_id), teacher_id))
+        for key, teacher_id in zip(keys, picked):
+            chosen[key] = teacher_id
+            busy[teacher_id] |= clashing[p]
+            duties[teacher_id] += 1
+        for date, start, end, room_id in keys[len(picked):]:
+            unassigned.append({'date': date, 'start_time': start, 'end_time': end, 'room_id': room_id})
+
+    if commit:
+        # Exams seated together share the room's invigilator
+        updates = [
+            {'id': exam_id, 'invigilator_id': current.get(key, chosen.get(key))}
+            for key, exam_ids in rooms.items()
+            for exam_id in exam_ids
+        ]
+        try:
+            if updates:
+                session.execute(update(Exam), updates)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return {'assigned': len(chosen), 'unassigned': unassigned, 'duties': dict(duties)}
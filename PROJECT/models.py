@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Date, DateTime, Text, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from scheduler import Base
@@ -14,6 +14,8 @@ class ClassCancellation(Base):
     cancelled_by = Column(Integer, ForeignKey('users.id'))
     cancelled_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index('ix_class_cancellations_date_class_course', 'date', 'class_id', 'course_id'),)
+
     class_ = relationship('Class')
     course = relationship('Course')
     user = relationship('User')
@@ -41,10 +43,12 @@ class ApprovedTimetable(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(String)
-    timetable_data = Column(String)  # Stores the timetable data as JSON string
+    timetable_data = Column(String)  # Legacy JSON copy; new approvals store a compressed snapshot instead
     approved_by = Column(Integer, ForeignKey('users.id'))
     approved_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    # Bumped by every compare-and-swap write (edits, activation changes)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
     
     approver = relationship('User')
     
@@ -52,6 +56,38 @@ class ApprovedTimetable(Base):
         return f"<ApprovedTimetable(name={self.name}, approved_by={self.approved_by}, active={self.is_active})>"
 
 
+class ApprovedTimetableEdit(Base):
+    """Append-only log of edits applied on top of an approved timetable's base snapshot."""
+    __tablename__ = 'approved_timetable_edits'
+    id = Column(Integer, primary_key=True)
+    approved_timetable_id = Column(Integer, ForeignKey('approved_timetables.id'), nullable=False)
+    seq = Column(Integer, nullable=False)  # 1, 2, 3... per approved timetable
+    op = Column(String, nullable=False)  # move | room_change | cancellation
+    payload = Column(String, nullable=False)  # JSON describing the edit
+    created_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint('approved_timetable_id', 'seq', name='_approved_edit_seq_uc'),)
+
+    approved_timetable = relationship('ApprovedTimetable')
+
+    def __repr__(self):
+        return f"<ApprovedTimetableEdit(timetable={self.approved_timetable_id}, seq={self.seq}, op={self.op})>"
+
+
+class ApprovedTimetableSnapshot(Base):
+    """Compressed full grid of an approved timetable as of edit `seq` (0 = as approved)."""
+    __tablename__ = 'approved_timetable_snapshots'
+    id = Column(Integer, primary_key=True)
+    approved_timetable_id = Column(Integer, ForeignKey('approved_timetables.id'), nullable=False)
+    seq = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint('approved_timetable_id', 'seq', name='_approved_snapshot_seq_uc'),)
+
+    def __repr__(self):
+        return f"<ApprovedTimetableSnapshot(timetable={self.approved_timetable_id}, seq={self.seq}, bytes={len(self.data or b'')})>"
+
+
 class Event(Base):
     __tablename__ = 'events'
     id = Column(Integer, primary_key=True)
@@ -94,3 +130,75 @@ class Feedback(Base):
 
     def __repr__(self):
         return f"<Feedback(category={self.category}, title={self.title[:20]})>"
+
+
+class Exam(Base):
+    __tablename__ = 'exams'
+    id = Column(Integer, primary_key=True)
+    course_id = Column(Integer, ForeignKey('courses.id'))
+    room_id = Column(Integer, ForeignKey('classrooms.id'))
+    date = Column(Date)
+    start_time = Column(String)
+    end_time = Column(String)
+    invigilator_id = Column(Integer, ForeignKey('teachers.id'), nullable=True)
+    course = relationship('Course')
+    room = relationship('Classroom')
+    invigilator = relationship('Teacher')
+
+
+class ApprovedExamSchedule(Base):
+    __tablename__ = 'approved_exam_schedules'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, default='Approved Exam Schedule')
+    description = Column(String)
+    schedule_data = Column(Text)  # JSON string of approved exams
+    approved_at = Column(DateTime, default=datetime.utcnow)
+    approved_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    is_active = Column(Boolean, default=True)
+
+
+class Semester(Base):
+    """Date range the active approved timetable is materialized over (see semester_calendar.py)."""
+    __tablename__ = 'semesters'
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CalendarSession(Base):
+    """One approved timetable session on one date, with that date's cancellations and room changes applied."""
+    __tablename__ = 'calendar_sessions'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    day = Column(String, nullable=False)
+    approved_timetable_id = Column(Integer, ForeignKey('approved_timetables.id'), nullable=False)
+    class_id = Column(Integer, ForeignKey('classes.id'))
+    course_id = Column(Integer, ForeignKey('courses.id'))
+    teacher_id = Column(Integer, ForeignKey('teachers.id'))
+    room_id = Column(Integer, ForeignKey('classrooms.id'))
+    start_time = Column(String)
+    end_time = Column(String)
+    status = Column(String, nullable=False, default='scheduled')  # scheduled | cancelled
+    original_room_id = Column(Integer, ForeignKey('classrooms.id'), nullable=True)  # set when a room change applies
+    cancellation_id = Column(Integer, ForeignKey('class_cancellations.id'), nullable=True)
+    room_change_id = Column(Integer, ForeignKey('room_changes.id'), nullable=True)
+    __table_args__ = (
+        UniqueConstraint('approved_timetable_id', 'date', 'class_id', 'course_id', 'start_time',
+                         name='_calendar_session_uc'),
+        Index('ix_calendar_sessions_date_room', 'date', 'room_id'),
+        Index('ix_calendar_sessions_date_class', 'date', 'class_id'),
+    )
+
+    class_ = relationship('Class')
+    course = relationship('Course')
+    teacher = relationship('Teacher')
+    room = relationship('Classroom', foreign_keys=[room_id])
+
+
+class DataVersion(Base):
+    """Write counter of one table, bumped with every write to it (see data_versions.py)."""
+    __tablename__ = 'data_versions'
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
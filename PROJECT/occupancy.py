@@ -0,0 +1,189 @@
+import bisect
+import collections
+import itertools
+
+# Resource kinds tracked per (day, slot)
+RESOURCE_KINDS = ('room', 'teacher', 'class')
+
+
+class OccupancyIndex:
+    """
+    In-memory index of who is booked where, keyed by (day, slot).
+    For every slot it keeps, per resource kind (room, teacher, class), the set of
+    session refs holding that resource, so clash checks and updates are O(1).
+
+    Resources and refs are plain hashables: names when indexing approved
+    timetable JSON, ids when indexing Timetable rows.
+    """
+
+    def __init__(self):
+        self._slots = collections.defaultdict(lambda: {kind: collections.defaultdict(set) for kind in RESOURCE_KINDS})
+
+    def add(self, day, slot, ref, room=None, teacher=None, class_=None):
+        booked = self._slots[(day, slot)]
+        for kind, resource in zip(RESOURCE_KINDS, (room, teacher, class_)):
+            if resource is not None:
+                booked[kind][resource].add(ref)
+
+    def remove(self, day, slot, ref, room=None, teacher=None, class_=None):
+        booked = self._slots.get((day, slot))
+        if booked is None:
+            return
+        for kind, resource in zip(RESOURCE_KINDS, (room, teacher, class_)):
+            refs = booked[kind].get(resource)
+            if refs is not None:
+                refs.discard(ref)
+                if not refs:
+                    del booked[kind][resource]
+
+    def clashes(self, day, slot, room=None, teacher=None, class_=None, ignore=None):
+        """
+        Returns a list of (kind, resource, ref) for every booking that would clash
+        with placing a session using the given resources at (day, slot).
+        `ignore` is the ref of the session being moved, so it never clashes with itself.
+        """
+        booked = self._slots.get((day, slot))
+        if booked is None:
+            return []
+        found = []
+        for kind, resource in zip(RESOURCE_KINDS, (room, teacher, class_)):
+            if resource is None:
+                continue
+            for ref in booked[kind].get(resource, ()):
+                if ref != ignore:
+                    found.append((kind, resource, ref))
+        return found
+
+    def is_free(self, day, slot, room=None, teacher=None, class_=None, ignore=None):
+        return not self.clashes(day, slot, room=room, teacher=teacher, class_=class_, ignore=ignore)
+
+    def occupied(self, kind, day, slot):
+        """Set of resources of the given kind booked at (day, slot)."""
+        booked = self._slots.get((day, slot))
+        return set(booked[kind]) if booked is not None else set()
+
+    @classmethod
+    def from_timetable_rows(cls, rows):
+        """
+        Build an id-based index from Timetable rows (or row-like tuples with the
+        same attribute names). Slots are keyed as "start-end".
+        """
+        index = cls()
+        for t in rows:
+            index.add(t.day, f"{t.start_time}-{t.end_time}", t.id,
+                      room=t.classroom_id, teacher=t.teacher_id, class_=t.class_id)
+        return index
+
+
+class RoomBuckets:
+    """
+    Free rooms per time key, kept sorted by capacity so the smallest room that
+    still fits a group is found with a binary search. A key's list is only
+    materialized the first time that key is touched.
+    """
+
+    def __init__(self, rooms):
+        # rooms: iterable of (capacity, room_id)
+        self._all = sorted((capacity or 0, room_id) for capacity, room_id in rooms)
+        self._free = {}
+
+    def _rooms(self, key):
+        free = self._free.get(key)
+        if free is None:
+            free = self._free[key] = list(self._all)
+        return free
+
+    def take(self, key, room_id, capacity):
+        free = self._rooms(key)
+        i = bisect.bisect_left(free, (capacity or 0, room_id))
+        if i < len(free) and free[i] == (capacity or 0, room_id):
+            del free[i]
+
+    def is_free(self, key, room_id, capacity):
+        free = self._rooms(key)
+        i = bisect.bisect_left(free, (capacity or 0, room_id))
+        return i < len(free) and free[i] == (capacity or 0, room_id)
+
+    def smallest(self, keys, size=0, allow_smaller=False):
+        """
+        (capacity, room_id) of the smallest room with capacity >= size that is
+        free under every key in `keys`, or None. With allow_smaller, falls back
+        to the largest free room that is too small.
+        """
+        keys = list(keys)
+        free = self._rooms(keys[0])
+        rest = keys[1:]
+        start = bisect.bisect_left(free, (size or 0,))
+        order = range(start, len(free))
+        if allow_smaller:
+            order = itertools.chain(order, range(start - 1, -1, -1))
+        for i in order:
+            capacity, room_id = free[i]
+            if all(self.is_free(key, room_id, capacity) for key in rest):
+                return capacity, room_id
+        return None
+
+
+class IntervalSet:
+    """
+    Time intervals [start, end) with refs, kept sorted by start. A running
+    maximum of end times tells how far back an overlapping interval can sit,
+    so is_free is O(log n) and overlapping is O(log n + intervals walked).
+    add and remove find their place by bisection but shift the lists behind
+    it, so they are O(n) memory moves (plus the running maximums they change);
+    that suits sets of a room's bookings on one day.
+    Times are anything ordered, e.g. HH:MM strings.
+    """
+
+    __slots__ = ('items', 'starts', 'reach', 'spans')
+
+    def __init__(self, items=()):
+        self.items = sorted(items)
+        self.starts = [start for start, _, _ in self.items]
+        self.reach = list(itertools.accumulate((end for _, end, _ in self.items), max))
+        self.spans = collections.defaultdict(list)  # ref -> [(start, end)]
+        for start, end, ref in self.items:
+            self.spans[ref].append((start, end))
+
+    def _fix_reach(self, i):
+        """Recompute running maximums from i on, stopping where they no longer change."""
+        for j in range(i, len(self.items)):
+            value = self.items[j][1] if j == 0 else max(self.reach[j - 1], self.items[j][1])
+            if self.reach[j] == value and j > i:
+                break
+            self.reach[j] = value
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, start, end, ref):
+        i = bisect.bisect_right(self.items, (start, end, ref))
+        self.items.insert(i, (start, end, ref))
+        self.starts.insert(i, start)
+        self.reach.insert(i, end)
+        self.spans[ref].append((start, end))
+        self._fix_reach(i)
+
+    def remove(self, ref):
+        for start, end in self.spans.pop(ref, ()):
+            i = bisect.bisect_left(self.items, (start, end, ref))
+            del self.items[i], self.starts[i], self.reach[i]
+            if i < len(self.items):
+                self._fix_reach(i)
+
+    def overlapping(self, start, end):
+        """Refs of intervals overlapping [start, end)."""
+        found = []
+        i = bisect.bisect_left(self.starts, end) - 1
+        while i >= 0 and self.reach[i] > start:
+            if self.items[i][1] > start:
+                found.append(self.items[i][2])
+            i -= 1
+        return found
+
+    def is_free(self, start, end):
+        i = bisect.bisect_left(self.starts, end)
+        return i == 0 or self.reach[i - 1] <= start
@@ -0,0 +1,237 @@
+"""
+Dated occurrences of one-time, weekly and monthly Events.
+
+Events are expanded a calendar month at a time, on first use, into
+{date: {room_id: IntervalSet of (start_time, end_time, event_id)}} and
+memoized. Inserting, updating or deleting an Event through the ORM patches
+the months already expanded; bulk statements and rollbacks drop the memo.
+The memo is kept against the events write counter (see data_versions.py),
+so a write by another worker process drops it too.
+"""
+import calendar
+import collections
+import datetime
+import threading
+
+from sqlalchemy import and_, event as sa_event, or_
+from sqlalchemy.orm import Session
+
+from availability import WEEK_DAYS
+from data_versions import on_bump, versions
+from occupancy import IntervalSet
+from models import Event
+
+# Calendar months kept expanded
+MAX_CACHED_MONTHS = 24
+# How far ahead an open-ended recurring event is checked for clashes
+RECURRING_HORIZON_DAYS = 365
+
+
+def _month_bounds(year, month):
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def expand(ev, first, last):
+    """Dates in [first, last] on which the event takes place (ev: an Event or a row with its columns)."""
+    recurrence = ev.recurrence or 'one-time'
+    if recurrence == 'one-time':
+        day = _as_date(ev.date)
+        if day and first <= day <= last:
+            yield day
+        return
+    first = max(first, _as_date(ev.start_date) or first)
+    last = min(last, _as_date(ev.end_date) or last)
+    if first > last:
+        return
+    if recurrence == 'weekly':
+        if ev.day_of_week not in WEEK_DAYS:
+            return
+        day = first + datetime.timedelta(days=(WEEK_DAYS.index(ev.day_of_week) - first.weekday()) % 7)
+        while day <= last:
+            yield day
+            day += datetime.timedelta(days=7)
+    elif recurrence == 'monthly' and ev.day_of_month:
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            # Months without that day (e.g. the 31st) are skipped
+            if ev.day_of_month <= calendar.monthrange(year, month)[1]:
+                day = datetime.date(year, month, ev.day_of_month)
+                if first <= day <= last:
+                    yield day
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def occurrence_dates(ev, horizon_days=RECURRING_HORIZON_DAYS):
+    """All dates of an event; open-ended recurrences stop horizon_days after they start."""
+    one_time = (ev.recurrence or 'one-time') == 'one-time'
+    first = _as_date(ev.date if one_time else ev.start_date) or datetime.date.today()
+    last = (_as_date(ev.end_date) if not one_time else None) or first + datetime.timedelta(days=horizon_days)
+    return expand(ev, first, last)
+
+
+class OccurrenceIndex:
+    """Event occurrences per date and room, expanded lazily by month."""
+
+    def __init__(self, max_months=MAX_CACHED_MONTHS):
+        self.max_months = max_months
+        self._months = collections.OrderedDict()
+        self._placed = collections.defaultdict(set)  # event_id -> {(month, date, room_id)}
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Events write counter the memo is current with; None until checked
+        self._version = None
+
+    def invalidate(self):
+        with self._lock:
+            self._months.clear()
+            self._placed.clear()
+            self._generation += 1
+            self._version = None
+
+    def _sync(self, session):
+        """Drop the memo if events were written since it was last checked (by any process)."""
+        (version,) = versions(session, (Event.__tablename__,))
+        with self._lock:
+            if version != self._version:
+                self._months.clear()
+                self._placed.clear()
+                self._generation += 1
+                self._version = version
+
+    def bumped(self, new):
+        """Follow this process's own event writes, which the ORM hooks already patched in."""
+        version = new.get(Event.__tablename__)
+        if version is None:
+            return
+        with self._lock:
+            # Anything but the next counter means another process wrote in between
+            self._version = version if self._version == version - 1 else None
+
+    def _place(self, key, expanded, ev, first, last):
+        for day in expand(ev, first, last):
+            rooms = expanded.setdefault(day, {})
+            rooms.setdefault(ev.room_id, IntervalSet()).add(ev.start_time, ev.end_time, ev.id)
+            self._placed[ev.id].add((key, day, ev.room_id))
+
+    def remove_event(self, event_id):
+        """Take an event out of the expanded months."""
+        with self._lock:
+            self._generation += 1
+            for key, day, room_id in self._placed.pop(event_id, ()):
+                if key in self._months:
+                    self._months[key][day][room_id].remove(event_id)
+
+    def add_event(self, ev):
+        """Put a new or changed event into the expanded months."""
+        with self._lock:
+            self._generation += 1
+            for key, expanded in self._months.items():
+                first, last = _month_bounds(*key)
+                self._place(key, expanded, ev, first, last)
+
+    def _month(self, session, year, month):
+        key = (year, month)
+        with self._lock:
+            if key in self._months:
+                self._months.move_to_end(key)
+                return self._months[key]
+            generation = self._generation
+
+        first, last = _month_bounds(year, month)
+        # Event dates are DateTime columns
+        first_dt = datetime.datetime.combine(first, datetime.time())
+        after_last = datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time())
+        one_time = or_(Event.recurrence == 'one-time', Event.recurrence.is_(None))
+        rows = session.query(
+            Event.id, Event.room_id, Event.recurrence, Event.date, Event.start_date, Event.end_date,
+            Event.day_of_week, Event.day_of_month, Event.start_time, Event.end_time
+        ).filter(or_(
+            and_(one_time, Event.date >= first_dt, Event.date < after_last),
+            and_(~one_time,
+                 or_(Event.start_date.is_(None), Event.start_date < after_last),
+                 or_(Event.end_date.is_(None), Event.end_date >= first_dt)),
+        )).all()
+
+        by_date = collections.defaultdict(lambda: collections.defaultdict(list))
+        for row in rows:
+            for day in expand(row, first, last):
+                by_date[day][row.room_id].append((row.start_time, row.end_time, row.id))
+        expanded = {day: {room_id: IntervalSet(occ) for room_id, occ in rooms.items()} for day, rooms in by_date.items()}
+
+        with self._lock:
+            # An event write while expanding makes this result stale; use it but don't keep it
+            if generation == self._generation:
+                self._months[key] = expanded
+                for day, rooms in expanded.items():
+                    for room_id, occ in rooms.items():
+                        for _, _, event_id in occ:
+                            self._placed[event_id].add((key, day, room_id))
+                while len(self._months) > self.max_months:
+                    self._months.popitem(last=False)
+        return expanded
+
+    def on(self, session, day):
+        """{room_id: IntervalSet of (start_time, end_time, event_id)} of the events on a date."""
+        self._sync(session)
+        return self._month(session, day.year, day.month).get(day, {})
+
+    def occurrences(self, session, first, last, room_id=None):
+        """[(date, start_time, end_time, room_id, event_id)] in [first, last], by date and time."""
+        self._sync(session)
+        result = []
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            for day, rooms in sorted(self._month(session, year, month).items()):
+                if first <= day <= last:
+                    for rid, occ in rooms.items():
+                        if room_id is None or rid == room_id:
+                            result.extend((day, start, end, rid, event_id) for start, end, event_id in occ)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        result.sort()
+        return result
+
+    def clashes(self, session, room_id, day, start_time, end_time, exclude=None):
+        """Ids of events using the room on that date during start_time-end_time."""
+        occ = self.on(session, day).get(room_id)
+        if occ is None:
+            return []
+        return [event_id for event_id in occ.overlapping(start_time, end_time) if event_id != exclude]
+
+    def busy_rooms(self, session, day, start_time, end_time):
+        """Ids of rooms holding an event on that date during start_time-end_time."""
+        return {room_id for room_id, occ in self.on(session, day).items() if not occ.is_free(start_time, end_time)}
+
+
+occurrence_index = OccurrenceIndex()
+
+
+def _event_inserted(mapper, connection, target):
+    occurrence_index.add_event(target)
+
+
+def _event_updated(mapper, connection, target):
+    occurrence_index.remove_event(target.id)
+    occurrence_index.add_event(target)
+
+
+def _event_deleted(mapper, connection, target):
+    occurrence_index.remove_event(target.id)
+
+
+def _bulk_event_write(orm_execute_state):
+    if not orm_execute_state.is_select and any(
+            m.class_ is Event for m in orm_execute_state.all_mappers):
+        occurrence_index.invalidate()
+
+
+on_bump(occurrence_index.bumped)
+sa_event.listen(Event, 'after_insert', _event_inserted)
+sa_event.listen(Event, 'after_update', _event_updated)
+sa_event.listen(Event, 'after_delete', _event_deleted)
+sa_event.listen(Session, 'do_orm_execute', _bulk_event_write)
+# Patches made at flush time are undone with the transaction
+sa_event.listen(Session, 'after_soft_rollback', lambda session, previous_transaction: occurrence_index.invalidate())
@@ -0,0 +1,279 @@
+import collections
+
+from sqlalchemy import update
+
+from occupancy import OccupancyIndex
+from availability import slot_bits, teacher_masks
+from scheduler import Timetable, Classroom, Teacher, _resolve_ids
+
+# Candidate placements evaluated per session before giving up on it
+MAX_CANDIDATES = 400
+
+
+class _Unavailability:
+    """
+    Rooms and teachers that can no longer be used, either for the whole week
+    or only during given (day, "start-end") periods.
+    """
+
+    def __init__(self, room_ids=(), teacher_ids=(), periods=None, masks=None, bits=None):
+        self.room_ids = set(room_ids)
+        self.teacher_ids = set(teacher_ids)
+        self.periods = set(periods) if periods is not None else None
+        # Standing teacher availability: {teacher_id: (unavailable, preferred)} and {(day, slot): bit}
+        self.masks = masks or {}
+        self.bits = bits or {}
+
+    def _during(self, day, slot):
+        return self.periods is None or (day, slot) in self.periods
+
+    def room_blocked(self, room_id, day, slot):
+        return room_id in self.room_ids and self._during(day, slot)
+
+    def teacher_blocked(self, teacher_id, day, slot):
+        return teacher_id in self.teacher_ids and self._during(day, slot)
+
+    def teacher_masked(self, teacher_id, day, slot):
+        """The teacher's own availability rules out this period (new placements only)."""
+        return bool(self.masks.get(teacher_id, (0, 0))[0] & self.bits.get((day, slot), 0))
+
+
+def _blocks(rows, slot_index):
+    """
+    Group Timetable rows into movable sessions: runs of consecutive slots with
+    the same class, course, teacher, room and day (a lab is one block of two
+    rows). Rows whose slot is not on the grid become fixed single-row blocks.
+    """
+    by_run = collections.defaultdict(list)
+    for t in rows:
+        by_run[(t.class_id, t.course_id, t.teacher_id, t.classroom_id, t.day)].append(t)
+
+    blocks = []
+    for (class_id, course_id, teacher_id, room_id, day), group in by_run.items():
+        group.sort(key=lambda t: slot_index.get(f"{t.start_time}-{t.end_time}", -1))
+        current = None
+        for t in group:
+            idx = slot_index.get(f"{t.start_time}-{t.end_time}")
+            if current is not None and idx is not None and idx == current['start'] + len(current['ids']):
+                current['ids'].append(t.id)
+                continue
+            current = {
+                'ids': [t.id], 'class_id': class_id, 'course_id': course_id, 'teacher_id': teacher_id,
+                'room_id': room_id, 'day': day, 'start': idx,
+            }
+            blocks.append(current)
+    return blocks
+
+
+class _Repairer:
+    def __init__(self, rows, rooms, days, time_slots, unavailable, max_candidates=MAX_CANDIDATES):
+        self.days = list(days)
+        self.slots = [f"{start}-{end}" for start, end in time_slots]
+        self.slot_index = {slot: i for i, slot in enumerate(self.slots)}
+        self.unavailable = unavailable
+        self.max_candidates = max_candidates
+        self.index = OccupancyIndex.from_timetable_rows(rows)
+        self.rooms = rooms
+        self.lab_room_ids = {r.id for r in rooms if 'lab' in (r.name or '').lower()}
+        self.capacity = {r.id: r.capacity or 0 for r in rooms}
+        self.blocks = _blocks(rows, self.slot_index)
+        self.block_of = {ref: b for b in self.blocks for ref in b['ids']}
+        self.original = {id(b): (b['day'], b['start'], b['room_id']) for b in self.blocks}
+
+    def _span(self, start, length):
+        return self.slots[start:start + length]
+
+    def _book(self, block, book=True):
+        action = self.index.add if book else self.index.remove
+        for ref, slot in zip(block['ids'], self._span(block['start'], len(block['ids']))):
+            action(block['day'], slot, ref, room=block['room_id'], teacher=block['teacher_id'], class_=block['class_id'])
+
+    def _is_affected(self, b):
+        if b['start'] is None:
+            return False
+        return any(self.unavailable.room_blocked(b['room_id'], b['day'], slot) or
+                   self.unavailable.teacher_blocked(b['teacher_id'], b['day'], slot)
+                   for slot in self._span(b['start'], len(b['ids'])))
+
+    def affected(self):
+        """On-grid blocks that use an unavailable room or teacher in any of their slots."""
+        return [b for b in self.blocks if self._is_affected(b)]
+
+    def _room_order(self, block):
+        """Rooms to try for a block: same kind (lab or not) as before, closest capacity first."""
+        was_lab = block['room_id'] in self.lab_room_ids
+        old_capacity = self.capacity.get(block['room_id'], 0)
+        return sorted(
+            self.rooms,
+            key=lambda r: ((r.id in self.lab_room_ids) != was_lab,
+                           (r.capacity or 0) < old_capacity,
+                           abs((r.capacity or 0) - old_capacity))
+        )
+
+    def _positions(self, block):
+        """(day, start) candidates, nearest to the block's current position first."""
+        length = len(block['ids'])
+        day_rank = {day: (day != block['day'], i) for i, day in enumerate(self.days)}
+        positions = [
+            (day, start)
+            for day in self.days
+            for start in range(len(self.slots) - length + 1)
+        ]
+        positions.sort(key=lambda p: (day_rank[p[0]], abs(p[1] - block['start'])))
+        return positions
+
+    def _people_clashes(self, block, day, start):
+        """Refs of sessions clashing with the block's teacher or class at a position, or None if the teacher is unavailable."""
+        refs = set()
+        for slot in self._span(start, len(block['ids'])):
+            if (self.unavailable.teacher_blocked(block['teacher_id'], day, slot) or
+                    self.unavailable.teacher_masked(block['teacher_id'], day, slot)):
+                return None
+            for _, _, ref in self.index.clashes(day, slot, teacher=block['teacher_id'], class_=block['class_id']):
+                refs.add(ref)
+        return refs
+
+    def _free_room(self, block, day, start, room_order):
+        span = self._span(start, len(block['ids']))
+        for room in room_order:
+            if all(not self.unavailable.room_blocked(room.id, day, slot) and
+                   self.index.is_free(day, slot, room=room.id) for slot in span):
+                return room.id
+        return None
+
+    def _place_directly(self, block):
+        """Move an unbooked block to the nearest free position (room, teacher and class). Returns True if placed."""
+        room_order = self._room_order(block)
+        for n, (day, start) in enumerate(self._positions(block)):
+            if n >= self.max_candidates:
+                break
+            if self._people_clashes(block, day, start) != set():
+                continue
+            room_id = self._free_room(block, day, start, room_order)
+            if room_id is not None:
+                block.update(day=day, start=start, room_id=room_id)
+                self._book(block)
+                return True
+        return False
+
+    def _place_with_ejection(self, block):
+        """
+        Place a block where exactly one other session is in the way of its
+        teacher or class, moving that session to its own nearest free spot.
+        """
+        room_order = self._room_order(block)
+        for n, (day, start) in enumerate(self._positions(block)):
+            if n >= self.max_candidates:
+                break
+            refs = self._people_clashes(block, day, start)
+            if not refs:
+                continue
+            blockers = {id(self.block_of[ref]): self.block_of[ref] for ref in refs}
+            if len(blockers) != 1:
+                continue
+            blocker = next(iter(blockers.values()))
+            self._book(blocker, book=False)
+            room_id = self._free_room(block, day, start, room_order)
+            if room_id is not None and self._people_clashes(block, day, start) == set():
+                previous = dict(day=block['day'], start=block['start'], room_id=block['room_id'])
+                block.update(day=day, start=start, room_id=room_id)
+                self._book(block)
+                if self._place_directly(blocker):
+                    return blocker
+                self._book(block, book=False)
+                block.update(previous)
+            self._book(blocker)
+        return None
+
+    def repair(self):
+        """Re-place every affected block; returns (changed blocks, unplaced blocks)."""
+        affected = self.affected()
+        # Hardest first: labs, then sessions of teachers who are out
+        affected.sort(key=lambda b: (-len(b['ids']), b['teacher_id'] not in self.unavailable.teacher_ids))
+
+        changed, unplaced = {}, []
+        for b in affected:
+            # Already moved out of the way while repairing another block
+            if not self._is_affected(b):
+                continue
+            self._book(b, book=False)
+            # Cheapest repair first: same time, another room
+            room_id = None
+            if self._people_clashes(b, b['day'], b['start']) == set():
+                room_id = self._free_room(b, b['day'], b['start'], self._room_order(b))
+            if room_id is not None:
+                b['room_id'] = room_id
+                self._book(b)
+                changed[id(b)] = b
+            elif self._place_directly(b):
+                changed[id(b)] = b
+            else:
+                blocker = self._place_with_ejection(b)
+                if blocker is not None:
+                    changed[id(b)] = b
+                    changed[id(blocker)] = blocker
+                else:
+                    # Stays where it is until someone fixes it by hand
+                    self._book(b)
+                    unplaced.append(b)
+        return list(changed.values()), [b for b in unplaced if id(b) not in changed]
+
+
+def repair_timetable(session, days, time_slots, rooms=(), teachers=(), periods=None,
+                     max_candidates=MAX_CANDIDATES, commit=True):
+    """
+    Minimal-perturbation repair of the draft timetable after rooms or teachers
+    become unavailable (for the whole week, or only during `periods`, an
+    iterable of (day, "start-end")); rooms and teachers are ids or names.
+    Only sessions using an unavailable resource are re-placed, preferring in
+    order: another room at the same time, the nearest free slot, or the
+    nearest slot freed by moving one other session. Everything else stays
+    where it is.
+
+    Returns {'changes': [...], 'unplaced': [...]} with one entry per timetable row.
+    """
+    room_ids = _resolve_ids(session, Classroom, rooms).values()
+    teacher_ids = _resolve_ids(session, Teacher, teachers).values()
+    rows = session.query(
+        Timetable.id, Timetable.class_id, Timetable.course_id, Timetable.teacher_id,
+        Timetable.classroom_id, Timetable.day, Timetable.start_time, Timetable.end_time
+    ).all()
+    rooms = session.query(Classroom).all()
+    bits = {(day, f"{start}-{end}"): bit for (day, start, end), bit in slot_bits(days, time_slots).items()}
+    unavailable = _Unavailability(room_ids, teacher_ids, periods, teacher_masks(session), bits)
+    repairer = _Repairer(rows, rooms, days, time_slots, unavailable, max_candidates)
+    changed, unplaced = repairer.repair()
+
+    changes = []
+    for b in changed:
+        old_day, old_start, old_room = repairer.original[id(b)]
+        for offset, ref in enumerate(b['ids']):
+            start, end = repairer.slots[b['start'] + offset].split('-')
+            changes.append({
+                'timetable_id': ref, 'class_id': b['class_id'], 'course_id': b['course_id'],
+                'teacher_id': b['teacher_id'],
+                'from_day': old_day, 'from_slot': repairer.slots[old_start + offset], 'old_room_id': old_room,
+                'day': b['day'], 'time_slot': f"{start}-{end}", 'room_id': b['room_id'],
+                'start_time': start, 'end_time': end,
+            })
+    unplaced_rows = [
+        {'timetable_id': ref, 'class_id': b['class_id'], 'course_id': b['course_id'], 'teacher_id': b['teacher_id'],
+         'day': b['day'], 'time_slot': repairer.slots[b['start'] + offset], 'room_id': b['room_id']}
+        for b in unplaced for offset, ref in enumerate(b['ids'])
+    ]
+
+    if commit:
+        try:
+            for c in changes:
+                session.execute(
+                    update(Timetable).where(Timetable.id == c['timetable_id']).values(
+                        day=c['day'], start_time=c['start_time'], end_time=c['end_time'], classroom_id=c['room_id']
+                    )
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    for c in changes:
+        del c['start_time'], c['end_time']
+    return {'changes': changes, 'unplaced': unplaced_rows}
@@ -0,0 +1,156 @@
+"""
+What holds a room on a given date and time: weekly timetable sessions,
+event occurrences and exams, each kept as per-room IntervalSets so a
+booking check is a few O(log n) lookups however many rows there are.
+Timetable sessions cancelled for a date don't hold their room that day.
+"""
+import collections
+import datetime
+import threading
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+from data_versions import versions
+from models import ClassCancellation, Exam
+from occupancy import IntervalSet
+from occurrences import occurrence_dates, occurrence_index
+from scheduler import Timetable
+
+
+class RoomIntervalIndex:
+    """
+    Timetable rows are indexed per (room, weekday) and exams per (room,
+    date), each loaded in one query on first use and dropped when their
+    table's write counter moves (a write by any process, see
+    data_versions.py); events come from the occurrence index. The timetable
+    rows cancelled on a date are looked up per date and kept until
+    Timetable or ClassCancellation is written.
+    Clashes are (kind, id) pairs with kind 'timetable', 'event' or 'exam'.
+    """
+
+    TABLES = (Timetable.__tablename__, Exam.__tablename__, ClassCancellation.__tablename__)
+
+    def __init__(self):
+        self._weekly = None
+        self._exams = None
+        self._cancelled = {}
+        self._lock = threading.Lock()
+        # Write counters of TABLES the parts above were loaded at
+        self._versions = None
+
+    def invalidate(self, timetable=True, exams=True, cancellations=True):
+        with self._lock:
+            if timetable:
+                self._weekly = None
+            if exams:
+                self._exams = None
+            if timetable or cancellations:
+                self._cancelled = {}
+            self._versions = None
+
+    def _sync(self, session):
+        """Drop the parts whose tables were written since they were loaded."""
+        now = versions(session, self.TABLES)
+        with self._lock:
+            seen = self._versions
+        if seen == now:
+            return
+        if seen is None:
+            self.invalidate()
+        else:
+            timetable, exams, cancellations = (a != b for a, b in zip(seen, now))
+            self.invalidate(timetable=timetable, exams=exams, cancellations=cancellations)
+        with self._lock:
+            self._versions = now
+
+    def _load(self, session):
+        with self._lock:
+            weekly, exams = self._weekly, self._exams
+        if weekly is None:
+            by_room_day = collections.defaultdict(list)
+            for tid, room_id, day, start, end in session.query(
+                    Timetable.id, Timetable.classroom_id, Timetable.day, Timetable.start_time, Timetable.end_time):
+                by_room_day[(room_id, day)].append((start, end, tid))
+            weekly = {key: IntervalSet(items) for key, items in by_room_day.items()}
+        if exams is None:
+            by_room_date = collections.defaultdict(list)
+            for exam_id, room_id, date, start, end in session.query(
+                    Exam.id, Exam.room_id, Exam.date, Exam.start_time, Exam.end_time).filter(Exam.date.isnot(None)):
+                by_room_date[(room_id, date)].append((start, end, exam_id))
+            exams = {key: IntervalSet(items) for key, items in by_room_date.items()}
+        with self._lock:
+            self._weekly, self._exams = weekly, exams
+        return weekly, exams
+
+    def cancelled_on(self, session, day):
+        """Ids of the timetable rows whose class is cancelled on that date."""
+        with self._lock:
+            cancelled = self._cancelled.get(day)
+        if cancelled is not None:
+            return cancelled
+        # Cancellation dates are DateTime columns
+        lower = datetime.datetime.combine(day, datetime.time())
+        upper = lower + datetime.timedelta(days=1)
+        cancelled = frozenset(tid for (tid,) in session.query(Timetable.id).join(
+            ClassCancellation,
+            (ClassCancellation.class_id == Timetable.class_id) & (ClassCancellation.course_id == Timetable.course_id)
+        ).filter(ClassCancellation.date >= lower, ClassCancellation.date < upper,
+                 Timetable.day == day.strftime('%A')))
+        with self._lock:
+            self._cancelled[day] = cancelled
+        return cancelled
+
+    def _sources(self, session, day):
+        self._sync(session)
+        weekly, exams = self._load(session)
+        weekday = day.strftime('%A')
+        events = occurrence_index.on(session, day)
+        return (
+            ('timetable', lambda room_id: weekly.get((room_id, weekday)), self.cancelled_on(session, day)),
+            ('event', events.get, ()),
+            ('exam', lambda room_id: exams.get((room_id, day)), ()),
+        )
+
+    def clashes(self, session, room_id, day, start_time, end_time, exclude=None):
+        """[(kind, id)] of everything holding the room on that date during start_time-end_time."""
+        found = []
+        for kind, intervals_of, released in self._sources(session, day):
+            intervals = intervals_of(room_id)
+            if intervals is not None:
+                found.extend((kind, ref) for ref in intervals.overlapping(start_time, end_time)
+                             if (kind, ref) != exclude and ref not in released)
+        return found
+
+    @staticmethod
+    def _held(sources, room_id, start_time, end_time):
+        for _, intervals_of, released in sources:
+            intervals = intervals_of(room_id)
+            if intervals is None or intervals.is_free(start_time, end_time):
+                continue
+            if not released or any(ref not in released for ref in intervals.overlapping(start_time, end_time)):
+                return True
+        return False
+
+    def is_free(self, session, room_id, day, start_time, end_time):
+        return not self._held(self._sources(session, day), room_id, start_time, end_time)
+
+    def busy_rooms(self, session, room_ids, day, start_time, end_time):
+        """The ids among room_ids that are held on that date during start_time-end_time."""
+        sources = self._sources(session, day)
+        return {room_id for room_id in room_ids if self._held(sources, room_id, start_time, end_time)}
+
+    def booking_clashes(self, session, ev):
+        """[(date, kind, id)] for every date of an (unsaved) Event whose room and time are taken."""
+        exclude = ('event', ev.id) if ev.id is not None else None
+        return [
+            (day, kind, ref)
+            for day in occurrence_dates(ev)
+            for kind, ref in self.clashes(session, ev.room_id, day, ev.start_time, ev.end_time, exclude=exclude)
+        ]
+
+
+room_index = RoomIntervalIndex()
+
+
+sa_event.listen(Session, 'after_soft_rollback', lambda session, previous_transaction: room_index.invalidate())
@@ -1,9 +1,16 @@
+import collections
 import datetime
+import hashlib
+import json
+import random
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Table, Boolean
 from sqlalchemy.orm import relationship, sessionmaker, declarative_base
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, insert, update, delete, inspect, text
+
+from occupancy import RoomBuckets
 
 Base = declarative_base()
 
@@ -63,6 +70,9 @@ class Teacher(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
     subject = Column(String)
+    # Availability bitmasks over the week grid as hex strings (see availability.py)
+    unavailable_mask = Column(String)
+    preferred_mask = Column(String)
     
     def __repr__(self):
         return f"<Teacher(name={self.name}, subject={self.subject})>"
@@ -71,6 +81,7 @@ class Class(Base):
     __tablename__ = 'classes'
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
+    size = Column(Integer)  # number of students; None when unknown
     course_teachers = relationship('ClassCourseTeacher', back_populates='class_')
 
     def __repr__(self):
@@ -101,11 +112,37 @@ def get_session(db_url=None):
         # Use a relative path for the database file
         db_path = 'scheduler.db'
         db_url = f'sqlite:///{db_path}'
+    # Every process that writes must bump the counters the in-memory caches check
+    import data_versions  # noqa: F401
     engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
+    ensure_schema(engine)
     Session = sessionmaker(bind=engine)
     return Session()
 
+def ensure_schema(engine):
+    """
+    Create missing tables, then add columns and indexes introduced since an
+    existing database file was created (create_all never alters existing tables).
+    New columns must be nullable or carry a server_default.
+    """
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+            # Likewise for indexes added to an existing table
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
 # Add functions
 def add_classroom(session, name, capacity):
     classroom = Classroom(name=name, capacity=capacity)
@@ -126,22 +163,224 @@ def add_teacher(session, name, subject):
     return teacher
 
 # Add a class and assign one teacher per course
-def add_class(session, name, course_teacher_map):
+def add_class(session, name, course_teacher_map, size=None):
     """
     course_teacher_map: dict of {course_id: teacher_id}
+    size: number of students, used to pick rooms that seat the class
     """
-    class_ = Class(name=name)
+    class_ = Class(name=name, size=size)
     session.add(class_)
-    session.commit()
-    for course_id, teacher_id in course_teacher_map.items():
-        cct = ClassCourseTeacher(class_id=class_.id, course_id=course_id, teacher_id=teacher_id)
-        session.add(cct)
+    session.flush()
+    _insert_course_teachers(session, {class_.id: course_teacher_map})
     session.commit()
     return class_
 
+def set_class_course_teachers(session, class_id, course_teacher_map):
+    """
+    Replace all course-teacher mappings of one class with a single delete and a
+    single multi-row insert, committed in one transaction.
+    course_teacher_map: dict of {course_id: teacher_id}
+    """
+    class_id = int(class_id)
+    try:
+        session.execute(delete(ClassCourseTeacher).where(ClassCourseTeacher.class_id == class_id))
+        _insert_course_teachers(session, {class_id: course_teacher_map})
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+def add_classes_bulk(session, roster, sizes=None):
+    """
+    Bulk class-roster setup for a whole semester.
+    roster: dict of {class_name: {course: teacher}} where course and teacher are
+    either ids or names. Names are resolved with one query per table, missing
+    classes are created and the mappings of every class listed with courses
+    are replaced, all with set-based statements in a single transaction.
+    Classes listed with an empty mapping keep the courses they already have.
+    sizes: optional dict of {class_name: number of students}.
+    Returns a dict of {class_name: class_id}.
+    """
+    sizes = sizes or {}
+    course_ids = _resolve_ids(session, Course, (c for m in roster.values() for c in m))
+    teacher_ids = _resolve_ids(session, Teacher, (t for m in roster.values() for t in m.values()))
+
+    try:
+        class_ids = dict(session.query(Class.name, Class.id).all())
+        new_names = [name for name in roster if name not in class_ids]
+        if new_names:
+            session.execute(insert(Class), [{'name': name, 'size': sizes.get(name)} for name in new_names])
+            class_ids = dict(session.query(Class.name, Class.id).all())
+        resized = [
+            {'id': class_ids[name], 'size': size}
+            for name, size in sizes.items() if name in class_ids and name not in new_names
+        ]
+        if resized:
+            # ORM bulk update by primary key: one executemany statement
+            session.execute(update(Class), resized)
+
+        mappings = {
+            class_ids[name]: {course_ids[c]: teacher_ids[t] for c, t in course_teacher_map.items()}
+            for name, course_teacher_map in roster.items() if course_teacher_map
+        }
+        if mappings:
+            session.execute(delete(ClassCourseTeacher).where(ClassCourseTeacher.class_id.in_(list(mappings))))
+            _insert_course_teachers(session, mappings)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return {name: class_ids[name] for name in roster}
+
+def _resolve_ids(session, model, keys):
+    """Map ids or names of `model` rows to ids using one query; raises ValueError for unknown keys."""
+    keys = set(keys)
+    if not keys:
+        return {}
+    rows = session.query(model.id, model.name).all()
+    by_name = {name: id_ for id_, name in rows}
+    known_ids = {id_ for id_, _ in rows}
+    resolved = {}
+    missing = []
+    for key in keys:
+        if key in by_name:
+            resolved[key] = by_name[key]
+        elif str(key).isdigit() and int(key) in known_ids:
+            resolved[key] = int(key)
+        else:
+            missing.append(str(key))
+    if missing:
+        raise ValueError(f"Unknown {model.__tablename__}: {', '.join(sorted(missing))}")
+    return resolved
+
+def _insert_course_teachers(session, mappings):
+    """Insert {class_id: {course_id: teacher_id}} mappings as one executemany statement."""
+    rows = [
+        {'class_id': int(class_id), 'course_id': int(course_id), 'teacher_id': int(teacher_id)}
+        for class_id, course_teacher_map in mappings.items()
+        for course_id, teacher_id in course_teacher_map.items()
+    ]
+    if rows:
+        session.execute(insert(ClassCourseTeacher), rows)
+
+
+def _split_sessions(placements):
+    """
+    Split one class-course's placements [(day, room_id, slot_index, ref)] into
+    (lab, lectures). The lab is the first pair of consecutive slots in the same
+    room on the same day (a tuple of two placements, or None); every other
+    placement is a lecture.
+    """
+    by_day_room = {}
+    for p in placements:
+        by_day_room.setdefault((p[0], p[1]), []).append(p)
+    lab = None
+    lectures = []
+    for group in by_day_room.values():
+        group.sort(key=lambda p: p[2])
+        i = 0
+        while i < len(group):
+            if lab is None and i + 1 < len(group) and group[i + 1][2] == group[i][2] + 1:
+                lab = (group[i], group[i + 1])
+                i += 2
+                continue
+            lectures.append(group[i])
+            i += 1
+    return lab, lectures
+
+def _sync_draft_with_active_approved(session):
+    """
+    Make the draft Timetable rows match the active approved timetable, if there
+    is one. Rows already matching keep their ids; only the difference is
+    deleted/inserted. Cells naming unknown classes, courses, teachers or rooms
+    are skipped (they get rescheduled as missing).
+    """
+    from models import ApprovedTimetable
+    from timetable_edits import load_timetable_data, cell_entries
+
+    approved = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+    if approved is None:
+        return
+    names = {
+        model: dict(session.query(model.name, model.id).all())
+        for model in (Class, Course, Teacher, Classroom)
+    }
+    wanted = {}
+    for class_name, slots in load_timetable_data(session, approved).items():
+        for slot, days in slots.items():
+            start, _, end = slot.partition('-')
+            for day, cell in days.items():
+                for e in cell_entries(cell):
+                    key = (names[Class].get(class_name), names[Course].get(e['course']),
+                           names[Teacher].get(e['teacher']), names[Classroom].get(e['classroom']), day, start, end)
+                    if None not in key:
+                        wanted[key] = wanted.get(key, 0) + 1
+
+    stale = []
+    for row in session.query(Timetable.id, Timetable.class_id, Timetable.course_id, Timetable.teacher_id,
+                             Timetable.classroom_id, Timetable.day, Timetable.start_time, Timetable.end_time):
+        key = tuple(row[1:])
+        if wanted.get(key):
+            wanted[key] -= 1
+        else:
+            stale.append(row.id)
+    try:
+        if stale:
+            session.execute(delete(Timetable).where(Timetable.id.in_(stale)))
+        missing = [
+            dict(zip(('class_id', 'course_id', 'teacher_id', 'classroom_id', 'day', 'start_time', 'end_time'), key))
+            for key, count in wanted.items() for _ in range(count)
+        ]
+        if missing:
+            session.execute(insert(Timetable), missing)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+def _warm_start_needs(session, time_slots):
+    """
+    Prepare the draft for a warm start and work out what is left to schedule.
+    Drops rows whose class-course-teacher mapping changed or whose slot is not
+    on the grid, then returns {class_course_teacher_id: (need_lab, lectures_needed)}
+    for every mapping still short of 1 lab + 3 lectures.
+    """
+    _sync_draft_with_active_approved(session)
+
+    slot_index = {(start, end): i for i, (start, end) in enumerate(time_slots)}
+    mapping = {
+        (class_id, course_id): (cct_id, teacher_id)
+        for cct_id, class_id, course_id, teacher_id in session.query(
+            ClassCourseTeacher.id, ClassCourseTeacher.class_id,
+            ClassCourseTeacher.course_id, ClassCourseTeacher.teacher_id)
+    }
+    stale = []
+    placed = {}  # (class_id, course_id) -> [(day, room_id, slot index, row id)]
+    for row in session.query(Timetable.id, Timetable.class_id, Timetable.course_id, Timetable.teacher_id,
+                             Timetable.classroom_id, Timetable.day, Timetable.start_time, Timetable.end_time):
+        mapped = mapping.get((row.class_id, row.course_id))
+        idx = slot_index.get((row.start_time, row.end_time))
+        if mapped is None or mapped[1] != row.teacher_id or idx is None:
+            stale.append(row.id)
+            continue
+        placed.setdefault((row.class_id, row.course_id), []).append((row.day, row.classroom_id, idx, row.id))
+    if stale:
+        try:
+            session.execute(delete(Timetable).where(Timetable.id.in_(stale)))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    needed = {}
+    for key, (cct_id, _) in mapping.items():
+        lab, lectures = _split_sessions(placed.get(key, []))
+        if lab is None or len(lectures) < 3:
+            needed[cct_id] = (lab is None, max(0, 3 - len(lectures)))
+    return needed
 
 # Enhanced timetable generation function with improved distribution
-def generate_timetable(session, days, time_slots):
+def generate_timetable(session, days, time_slots, warm_start=False, improve_seconds=0, precheck=False, seed=None):
     """
     Generate a weekly timetable with hard minimums per course per class:
     - 3 one-hour lecture sessions
@@ -149,35 +388,126 @@ def generate_timetable(session, days, time_slots):
     Avoids conflicts across rooms, teachers, and classes. Labs prefer rooms
     whose name contains 'lab' (case-insensitive); falls back to any room.
 
-    Returns a human-readable summary list.
-    """
-    from random import shuffle
+    With warm_start=True the current timetable (the active approved one, else
+    the draft) is kept: sessions whose class-course-teacher mapping no longer
+    exists are dropped and only missing labs/lectures are scheduled.
 
-    # Fresh start for draft timetable
-    session.query(Timetable).delete()
-    session.commit()
+    With improve_seconds > 0 the greedy result is then improved by a local
+    search (see improve.improve_timetable) for at most that many seconds.
 
-    classes = session.query(Class).all()
-    classrooms = session.query(Classroom).all()
+    With precheck=True the configuration is first checked against counting
+    bounds (see feasibility.check_feasibility) and InfeasibleTimetableError is
+    raised, before anything is touched, if it can't fit.
+
+    A seed makes the greedy placement reproducible: the same inputs and seed
+    give the same timetable. Seeded cold runs are cached by input fingerprint
+    (see generation_fingerprint), so repeating one over unchanged data just
+    restores the cached rows. The improvement pass is time-boxed, so with
+    improve_seconds > 0 only the cached result is guaranteed to repeat.
+
+    Returns a human-readable summary list, ending with the improvement pass's
+    score change when it ran.
+    """
+    from availability import slot_bits, teacher_masks
+
+    rng = random.Random(seed)
+    shuffle = rng.shuffle
+
+    if precheck:
+        from feasibility import check_feasibility, InfeasibleTimetableError
+        report = check_feasibility(session, days, time_slots)
+        if not report['feasible']:
+            raise InfeasibleTimetableError(report)
+
+    fingerprint = None
+    if seed is not None and not warm_start:
+        fingerprint = generation_fingerprint(session, days, time_slots, seed, improve_seconds)
+        cached = _generation_cache_get(fingerprint)
+        if cached is not None:
+            rows, summary = cached
+            try:
+                session.query(Timetable).delete()
+                if rows:
+                    session.execute(insert(Timetable), [dict(row) for row in rows])
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            return list(summary)
+
+    classrooms = session.query(Classroom).order_by(Classroom.id).all()
     summary = []
 
-    # Separate lab-friendly rooms
+    # Separate lab-friendly rooms, each kind bucketed by capacity per (day, start, end)
     lab_rooms = [r for r in classrooms if 'lab' in (r.name or '').lower()]
     non_lab_rooms = [r for r in classrooms if r not in lab_rooms]
+    room_by_id = {r.id: r for r in classrooms}
+    lab_buckets = RoomBuckets((r.capacity, r.id) for r in lab_rooms)
+    lecture_buckets = RoomBuckets((r.capacity, r.id) for r in non_lab_rooms)
+    buckets_of = {r.id: (lab_buckets if r in lab_rooms else lecture_buckets) for r in classrooms}
 
     # Resources usage sets
-    used_classroom_slots = set()  # (day, start, end, room_id)
     used_teacher_slots = set()    # (day, start, end, teacher_id)
     used_class_slots = set()      # (day, start, end, class_id)
 
-    # Helper: check if slot is free for all resources
-    def free_for_all(day, start, end, room_id, teacher_id, class_id):
+    if warm_start:
+        # Keep what is already placed; only schedule what is missing
+        needed = _warm_start_needs(session, time_slots)
+        for day, start, end, room_id, teacher_id, class_id in session.query(
+                Timetable.day, Timetable.start_time, Timetable.end_time,
+                Timetable.classroom_id, Timetable.teacher_id, Timetable.class_id):
+            if room_id in buckets_of:
+                buckets_of[room_id].take((day, start, end), room_id, room_by_id[room_id].capacity)
+            used_teacher_slots.add((day, start, end, teacher_id))
+            used_class_slots.add((day, start, end, class_id))
+        ccts = session.query(ClassCourseTeacher).filter(
+            ClassCourseTeacher.id.in_(list(needed))
+        ).order_by(ClassCourseTeacher.id).all() if needed else []
+        by_class = {}
+        for cct in ccts:
+            by_class.setdefault(cct.class_, []).append(cct)
+        classes = list(by_class)
+    else:
+        # Fresh start for draft timetable
+        session.query(Timetable).delete()
+        session.commit()
+        classes = session.query(Class).order_by(Class.id).all()
+        needed = {}
+        by_class = None
+
+    # Teacher availability: one AND per test against the teacher's masks
+    bits = slot_bits(days, time_slots)
+    day_bits = collections.defaultdict(int)
+    for (day, start, end), bit in bits.items():
+        day_bits[day] |= bit
+    masks = teacher_masks(session)
+
+    # Helper: check if slot is free (and allowed) for the teacher and the class
+    def people_free(day, start, end, teacher_id, class_id):
         return (
-            (day, start, end, room_id) not in used_classroom_slots and
             (day, start, end, teacher_id) not in used_teacher_slots and
-            (day, start, end, class_id) not in used_class_slots
+            (day, start, end, class_id) not in used_class_slots and
+            not (masks.get(teacher_id, (0, 0))[0] & bits[(day, start, end)])
         )
 
+    # Helper: order candidate days so the teacher's preferred ones come first
+    # (a stable sort, so the shuffled order is kept within each group)
+    def preferred_first(candidates, teacher_id, key):
+        preferred = masks.get(teacher_id, (0, 0))[1]
+        if preferred:
+            candidates.sort(key=lambda c: not (preferred & key(c)))
+
+    # Helper: smallest room of the preferred kinds that seats the class and is
+    # free for all spans; too-small rooms only if nothing adequate is free
+    def pick_room(day, spans, size, kinds):
+        keys = [(day, start, end) for start, end in spans]
+        for allow_smaller in (False, True):
+            for buckets in kinds:
+                found = buckets.smallest(keys, size, allow_smaller=allow_smaller)
+                if found is not None:
+                    return room_by_id[found[1]]
+        return None
+
     # Helper: book a slot
     def book_slot(day, start, end, room, class_, course, teacher):
         tt = Timetable(
@@ -190,7 +520,7 @@ def generate_timetable(session, days, time_slots):
             end_time=end,
         )
         session.add(tt)
-        used_classroom_slots.add((day, start, end, room.id))
+        buckets_of[room.id].take((day, start, end), room.id, room.capacity)
         used_teacher_slots.add((day, start, end, teacher.id))
         used_class_slots.add((day, start, end, class_.id))
         summary.append(f"{class_.name} - {course.name} in {room.name} by {teacher.name} on {day} {start}-{end}")
@@ -211,52 +541,56 @@ def generate_timetable(session, days, time_slots):
     shuffle(classes_list)
 
     for class_ in classes_list:
+        class_size = class_.size or 0
         # For each course assigned to the class
-        ccts = list(class_.course_teachers)
+        ccts = list(by_class[class_] if by_class is not None else class_.course_teachers)
+        ccts.sort(key=lambda cct: cct.id)
         shuffle(ccts)
         for cct in ccts:
             course = cct.course
             teacher = cct.teacher
+            need_lab, lectures_needed = needed.get(cct.id, (True, 3))
 
             # 1) Schedule LAB (2 consecutive slots) - shuffle days for even spread
-            lab_scheduled = False
-            lab_days = week_days[:]
+            lab_scheduled = not need_lab
+            lab_days = week_days[:] if not lab_scheduled else []
             shuffle(lab_days)
+            preferred_first(lab_days, teacher.id, lambda day: day_bits[day])
             for day in lab_days:
                 for i, j, (s1, e1), (s2, e2) in consecutive_pairs:
+                    if not (people_free(day, s1, e1, teacher.id, class_.id) and
+                            people_free(day, s2, e2, teacher.id, class_.id)):
+                        continue
                     # Try lab-preferred rooms first, then others
-                    for room in (lab_rooms + non_lab_rooms):
-                        if (
-                            free_for_all(day, s1, e1, room.id, teacher.id, class_.id) and
-                            free_for_all(day, s2, e2, room.id, teacher.id, class_.id)
-                        ):
-                            # Book both consecutive slots
-                            book_slot(day, s1, e1, room, class_, course, teacher)
-                            book_slot(day, s2, e2, room, class_, course, teacher)
-                            lab_scheduled = True
-                            break
-                    if lab_scheduled:
+                    room = pick_room(day, [(s1, e1), (s2, e2)], class_size, (lab_buckets, lecture_buckets))
+                    if room is not None:
+                        # Book both consecutive slots
+                        book_slot(day, s1, e1, room, class_, course, teacher)
+                        book_slot(day, s2, e2, room, class_, course, teacher)
+                        lab_scheduled = True
                         break
                 if lab_scheduled:
                     break
 
             # 2) Schedule 3 LECTURES (single slots), shuffle days for even spread
-            lectures_needed = 3
             lecture_days = week_days[:]
             shuffle(lecture_days)
+            preferred_first(lecture_days, teacher.id, lambda day: day_bits[day])
             slot_indices = list(range(len(time_slots)))
             for day in lecture_days:
                 if lectures_needed == 0:
                     break
                 shuffle(slot_indices)
+                preferred_first(slot_indices, teacher.id, lambda idx: bits[(day,) + tuple(time_slots[idx])])
                 for idx in slot_indices:
                     start, end = time_slots[idx]
+                    if not people_free(day, start, end, teacher.id, class_.id):
+                        continue
                     # Prefer non-lab rooms for lectures, but allow labs if needed
-                    for room in (non_lab_rooms + lab_rooms):
-                        if free_for_all(day, start, end, room.id, teacher.id, class_.id):
-                            book_slot(day, start, end, room, class_, course, teacher)
-                            lectures_needed -= 1
-                            break
+                    room = pick_room(day, [(start, end)], class_size, (lecture_buckets, lab_buckets))
+                    if room is not None:
+                        book_slot(day, start, end, room, class_, course, teacher)
+                        lectures_needed -= 1
                     if lectures_needed == 0:
                         break
 
@@ -268,17 +602,67 @@ def generate_timetable(session, days, time_slots):
                     for start, end in time_slots:
                         if lectures_needed == 0:
                             break
-                        for room in (non_lab_rooms + lab_rooms):
-                            if free_for_all(day, start, end, room.id, teacher.id, class_.id):
-                                book_slot(day, start, end, room, class_, course, teacher)
-                                lectures_needed -= 1
-                                if lectures_needed == 0:
-                                    break
+                        if not people_free(day, start, end, teacher.id, class_.id):
+                            continue
+                        room = pick_room(day, [(start, end)], class_size, (lecture_buckets, lab_buckets))
+                        if room is not None:
+                            book_slot(day, start, end, room, class_, course, teacher)
+                            lectures_needed -= 1
 
     session.commit()
     print("Timetable generation complete with 3 lectures + 1 lab per course.")
+
+    if improve_seconds > 0:
+        from improve import improve_timetable
+        result = improve_timetable(session, week_days, time_slots, improve_seconds, rng=rng)
+        summary.append(f"Improvement pass: score {result['score_before']} -> {result['score_after']}, "
+                       f"missed sessions {result['missed_before']} -> {result['missed_after']}")
+
+    if fingerprint is not None:
+        rows = session.query(
+            Timetable.class_id, Timetable.classroom_id, Timetable.course_id, Timetable.teacher_id,
+            Timetable.day, Timetable.start_time, Timetable.end_time
+        ).order_by(Timetable.id).all()
+        _generation_cache_put(fingerprint, (tuple(tuple(row._mapping.items()) for row in rows), tuple(summary)))
     return summary
 
+# Generated draft timetables by input fingerprint, least recently used first
+GENERATION_CACHE_SIZE = 16
+_generation_cache = collections.OrderedDict()
+_generation_cache_lock = threading.Lock()
+
+def generation_fingerprint(session, days, time_slots, seed, improve_seconds=0):
+    """
+    Stable hash of everything a seeded generation depends on: rooms, courses,
+    teachers, classes, class-course-teacher mappings, days, slots, seed and
+    improvement budget.
+    """
+    digest = hashlib.sha256()
+    for model, columns in ((Classroom, (Classroom.id, Classroom.name, Classroom.capacity)),
+                           (Course, (Course.id, Course.name)),
+                           (Teacher, (Teacher.id, Teacher.name, Teacher.unavailable_mask, Teacher.preferred_mask)),
+                           (Class, (Class.id, Class.name, Class.size)),
+                           (ClassCourseTeacher, (ClassCourseTeacher.id, ClassCourseTeacher.class_id,
+                                                 ClassCourseTeacher.course_id, ClassCourseTeacher.teacher_id))):
+        rows = session.query(*columns).order_by(model.id).all()
+        digest.update(json.dumps([model.__tablename__, [list(row) for row in rows]]).encode('utf-8'))
+    digest.update(json.dumps([list(days), [list(slot) for slot in time_slots], seed, improve_seconds]).encode('utf-8'))
+    return digest.hexdigest()
+
+def _generation_cache_get(fingerprint):
+    with _generation_cache_lock:
+        cached = _generation_cache.get(fingerprint)
+        if cached is not None:
+            _generation_cache.move_to_end(fingerprint)
+        return cached
+
+def _generation_cache_put(fingerprint, result):
+    with _generation_cache_lock:
+        _generation_cache[fingerprint] = result
+        _generation_cache.move_to_end(fingerprint)
+        while len(_generation_cache) > GENERATION_CACHE_SIZE:
+            _generation_cache.popitem(last=False)
+
 def reschedule_class(session, timetable_id, new_day, new_start, new_end, new_classroom_id=None):
     timetable = session.query(Timetable).get(timetable_id)
     if not timetable:
@@ -312,10 +696,14 @@ def find_available_rooms(session, day, start_time, end_time):
 
 def suggest_reschedule_options(session, class_id, course_id, exclude_timetable_id=None):
     """
-    Suggests alternative slots and rooms for a class/course, avoiding conflicts.
-    Optionally exclude a specific timetable entry (for rescheduling that entry).
+    Suggests alternative slots and rooms for a class/course, avoiding conflicts
+    and the teacher's unavailable periods; the teacher's preferred periods are
+    listed first. Optionally exclude a specific timetable entry (for
+    rescheduling that entry).
     Returns a list of (day, start_time, end_time, classroom) tuples.
     """
+    from availability import slot_bits, parse_mask
+
     days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
     time_slots = [("09:00", "10:00"), ("10:00", "11:00"), ("11:00", "12:00")]
     class_ = session.query(Class).get(class_id)
@@ -323,10 +711,15 @@ def suggest_reschedule_options(session, class_id, course_id, exclude_timetable_i
     if not cct:
         return []
     teacher = cct.teacher
+    bits = slot_bits(days, time_slots)
+    unavailable = parse_mask(teacher.unavailable_mask)
+    preferred = parse_mask(teacher.preferred_mask)
     classrooms = session.query(Classroom).all()
     suggestions = []
     for day in days:
         for slot in time_slots:
+            if unavailable & bits[(day,) + slot]:
+                continue
             for classroom in classrooms:
                 # Check if classroom is free
                 q = session.query(Timetable).filter_by(day=day, start_time=slot[0], end_time=slot[1], classroom_id=classroom.id)
@@ -341,6 +734,8 @@ def suggest_reschedule_options(session, class_id, course_id, exclude_timetable_i
                 if q2.first():
                     continue
                 suggestions.append((day, slot[0], slot[1], classroom.name))
+    if preferred:
+        suggestions.sort(key=lambda option: not (preferred & bits[option[:3]]))
     return suggestions
 
 def print_timetable(session):
@@ -348,42 +743,59 @@ def print_timetable(session):
     for t in timetables:
         print(t)
         
-def get_current_timetable_data(session):
+# The teaching week: saved with an approved timetable unless the caller passes its own,
+# and the grid availability masks, feasibility, repair and the class fragments work on
+TIMETABLE_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+TIMETABLE_SLOTS = [
+    ("08:30", "09:30"),
+    ("09:45", "10:45"),
+    ("11:00", "12:00"),
+    ("12:15", "13:15"),
+    ("14:00", "15:00"),  # After lunch break
+    ("15:15", "16:15"),
+    ("16:30", "17:30")
+]
+
+def get_current_timetable_data(session, days=None, time_slots=None):
     """
     Formats the current timetable data into a structured format that can be saved
-    for later retrieval.
+    for later retrieval: {class: {"start-end": {day: [entries]}}} over the given
+    days and time slots (TIMETABLE_DAYS/TIMETABLE_SLOTS by default). Sessions
+    outside the grid are left out. Reads everything in one joined query.
     """
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-    time_slots = [
-        ("08:30", "09:30"),
-        ("09:45", "10:45"),
-        ("11:00", "12:00"),
-        ("12:15", "13:15"),
-        ("14:00", "15:00"),  # After lunch break
-        ("15:15", "16:15"),
-        ("16:30", "17:30")
-    ]
-    
-    # Build timetable grid for all classes
-    classes = session.query(Class).all()
+    days = days or TIMETABLE_DAYS
+    time_slots = time_slots or TIMETABLE_SLOTS
+
+    def empty_grid():
+        return {slot[0] + "-" + slot[1]: {day: [] for day in days} for slot in time_slots}
+
+    # Classes outer-joined so those without sessions still get an (empty) grid
+    rows = session.query(
+        Class.name, Timetable.id, Timetable.day, Timetable.start_time, Timetable.end_time,
+        Course.name, Teacher.name, Classroom.name
+    ).outerjoin(Timetable, Timetable.class_id == Class.id
+    ).outerjoin(Course, Timetable.course_id == Course.id
+    ).outerjoin(Teacher, Timetable.teacher_id == Teacher.id
+    ).outerjoin(Classroom, Timetable.classroom_id == Classroom.id
+    ).order_by(Class.id, Timetable.id)
+
     timetable_data = {}
-    
-    for class_ in classes:
-        grid = {slot[0] + "-" + slot[1]: {day: [] for day in days} for slot in time_slots}
-        entries = session.query(Timetable).filter_by(class_id=class_.id).all()
-        
-        for entry in entries:
-            slot_key = entry.start_time + "-" + entry.end_time
-            if slot_key in grid:
-                grid[slot_key][entry.day].append({
-                    "course": entry.course.name,
-                    "teacher": entry.teacher.name,
-                    "classroom": entry.classroom.name,
-                    "timetable_id": entry.id
-                })
-        
-        timetable_data[class_.name] = grid
-    
+    for class_name, timetable_id, day, start_time, end_time, course_name, teacher_name, room_name in rows:
+        grid = timetable_data.get(class_name)
+        if grid is None:
+            grid = timetable_data[class_name] = empty_grid()
+        if timetable_id is None:
+            continue
+        cells = grid.get(start_time + "-" + end_time)
+        if cells is None or day not in cells:
+            continue
+        cells[day].append({
+            "course": course_name,
+            "teacher": teacher_name,
+            "classroom": room_name,
+            "timetable_id": timetable_id
+        })
+
     return timetable_data
 
 if __name__ == "__main__":
@@ -0,0 +1,267 @@
+"""
+The active approved timetable expanded into dated sessions over the semester.
+
+CalendarSession holds one row per (approved session, date) in the current
+Semester's range, with that date's ClassCancellation and RoomChange rows
+applied. The draft Timetable is never read: it changes with every
+regeneration, while cancellations and room changes apply to what was
+approved. Writes to approved timetables, their edits, the names the grid
+refers to or the Semester mark the whole calendar stale; writes to
+ClassCancellation or RoomChange only their dates. Writes by another worker
+process are noticed through the tables' write counters (see
+data_versions.py) and refresh the whole calendar. dated_sessions() brings
+the rows up to date before reading, writing only the rows that actually
+changed.
+"""
+import collections
+import datetime
+import threading
+
+from sqlalchemy import delete, event as sa_event, insert, or_, update
+from sqlalchemy.orm import Session
+
+from data_versions import on_bump, versions
+from models import (ApprovedTimetable, ApprovedTimetableEdit, ApprovedTimetableSnapshot, CalendarSession,
+                    ClassCancellation, RoomChange, Semester)
+from scheduler import Class, Classroom, Course, Teacher
+from timetable_edits import approved_sessions
+
+# Columns compared when deciding whether a materialized row changed
+FIELDS = ('day', 'class_id', 'course_id', 'teacher_id', 'room_id', 'start_time', 'end_time',
+          'status', 'original_room_id', 'cancellation_id', 'room_change_id')
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _day_bounds(first, last):
+    """[first, last] dates as DateTime bounds for ClassCancellation/RoomChange.date."""
+    return (datetime.datetime.combine(first, datetime.time()),
+            datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time()))
+
+
+def current_semester(session):
+    return session.query(Semester).order_by(Semester.id.desc()).first()
+
+
+def _overrides(session, first, last):
+    """Cancellations {(date, class_id, course_id): id} and room changes {same key: (old, new, id)}, latest wins."""
+    lower, upper = _day_bounds(first, last)
+    cancellations = {}
+    for cid, class_id, course_id, date in session.query(
+            ClassCancellation.id, ClassCancellation.class_id, ClassCancellation.course_id, ClassCancellation.date
+    ).filter(ClassCancellation.date >= lower, ClassCancellation.date < upper).order_by(ClassCancellation.id):
+        cancellations[(_as_date(date), class_id, course_id)] = cid
+    changes = {}
+    for rid, class_id, course_id, old, new, date in session.query(
+            RoomChange.id, RoomChange.class_id, RoomChange.course_id, RoomChange.old_room_id,
+            RoomChange.new_room_id, RoomChange.date
+    ).filter(RoomChange.date >= lower, RoomChange.date < upper).order_by(RoomChange.changed_at, RoomChange.id):
+        changes[(_as_date(date), class_id, course_id)] = (old, new, rid)
+    return cancellations, changes
+
+
+def _weekly_sessions(session):
+    """
+    (approved timetable id, rows) of the active approved timetable, its grid
+    names resolved to ids. Sessions whose class or course no longer exists
+    under the approved name are left out.
+    """
+    approved = session.query(ApprovedTimetable).filter(
+        ApprovedTimetable.is_active.is_(True)).order_by(ApprovedTimetable.id.desc()).first()
+    if approved is None:
+        return None, []
+    ids = {model: dict(session.query(model.name, model.id)) for model in (Class, Course, Teacher, Classroom)}
+    rows = []
+    for class_name, day, slot, entry in approved_sessions(session, approved, lambda class_name, entry: True):
+        class_id, course_id = ids[Class].get(class_name), ids[Course].get(entry.get('course'))
+        if class_id is None or course_id is None or '-' not in slot:
+            continue
+        start, end = slot.split('-', 1)
+        rows.append({
+            'day': day, 'class_id': class_id, 'course_id': course_id,
+            'teacher_id': ids[Teacher].get(entry.get('teacher')), 'room_id': ids[Classroom].get(entry.get('classroom')),
+            'start_time': start, 'end_time': end,
+        })
+    return approved.id, rows
+
+
+def refresh_calendar(session, semester=None, dates=None, commit=True):
+    """
+    Bring CalendarSession in line with the active approved timetable and its
+    overrides. With dates only those days are recomputed; without, the whole
+    semester is (and rows outside it, or of another timetable, are dropped).
+    Returns counts of {'inserted', 'updated', 'deleted'} rows.
+    """
+    semester = semester or current_semester(session)
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0}
+    if semester is None:
+        return counts
+    first, last = semester.start_date, semester.end_date
+
+    by_weekday = collections.defaultdict(list)
+    day = first
+    while day <= last:
+        if dates is None or day in dates:
+            by_weekday[day.strftime('%A')].append(day)
+        day += datetime.timedelta(days=1)
+    cancellations, changes = _overrides(session, first, last)
+
+    approved_id, weekly = _weekly_sessions(session)
+    wanted = {}
+    for t in weekly:
+        for date in by_weekday.get(t['day'], ()):
+            row = dict(t, status='scheduled', original_room_id=None, cancellation_id=None, room_change_id=None)
+            key = (date, t['class_id'], t['course_id'])
+            change = changes.get(key)
+            if change is not None and change[0] in (None, t['room_id']) and change[1] != t['room_id']:
+                row.update(room_id=change[1], original_room_id=t['room_id'], room_change_id=change[2])
+            if key in cancellations:
+                row.update(status='cancelled', cancellation_id=cancellations[key])
+            wanted[(approved_id, date, t['class_id'], t['course_id'], t['start_time'])] = row
+
+    existing = session.query(CalendarSession.id, CalendarSession.approved_timetable_id, CalendarSession.date,
+                             *(getattr(CalendarSession, f) for f in FIELDS))
+    if dates is not None:
+        existing = existing.filter(CalendarSession.date.in_(list(dates)))
+    stale, changed = [], []
+    for row in existing:
+        row_id, values = row[0], row[3:]
+        target = wanted.pop((row[1], row[2], row.class_id, row.course_id, row.start_time), None)
+        if target is None:
+            stale.append(row_id)
+        elif tuple(target[f] for f in FIELDS) != tuple(values):
+            changed.append(dict(target, id=row_id))
+    missing = [dict(row, approved_timetable_id=key[0], date=key[1]) for key, row in wanted.items()]
+
+    try:
+        if stale:
+            session.execute(delete(CalendarSession).where(CalendarSession.id.in_(stale)))
+        if changed:
+            session.execute(update(CalendarSession), changed)
+        if missing:
+            session.execute(insert(CalendarSession), missing)
+        if commit:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    counts.update(inserted=len(missing), updated=len(changed), deleted=len(stale))
+    return counts
+
+
+def materialize_calendar(session, start_date, end_date, name=None):
+    """Start a semester over [start_date, end_date] and expand the active approved timetable over it."""
+    if end_date < start_date:
+        raise ValueError("Semester end date is before its start date")
+    semester = Semester(name=name, start_date=start_date, end_date=end_date)
+    session.add(semester)
+    session.flush()
+    _pending.take(versions(session, _SOURCE_TABLES))  # the full refresh below covers anything pending
+    return refresh_calendar(session, semester)
+
+
+class _Pending:
+    """
+    What changed since the calendar was last refreshed, collected from session
+    events, and the source tables' write counters as of that refresh plus this
+    process's own writes since.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.full = True  # first use in a process checks everything
+        self.dates = set()
+        self.versions = None
+
+    def mark(self, full=False, dates=()):
+        with self._lock:
+            self.full = self.full or full
+            self.dates.update(dates)
+
+    def bumped(self, new):
+        """Follow this process's own writes; their changes are marked by the session hooks."""
+        with self._lock:
+            if self.versions is None:
+                return
+            seen = dict(zip(_SOURCE_TABLES, self.versions))
+            for table, version in new.items():
+                if table in seen:
+                    if seen[table] != version - 1:
+                        # Another process wrote in between
+                        self.versions = None
+                        return
+                    seen[table] = version
+            self.versions = tuple(seen[table] for table in _SOURCE_TABLES)
+
+    def take(self, now):
+        """(full, dates) to refresh; anything written by another process since the last take means full."""
+        with self._lock:
+            taken = (self.full or self.versions != now, self.dates)
+            self.full, self.dates, self.versions = False, set(), now
+        return taken
+
+
+_pending = _Pending()
+
+
+def ensure_calendar(session):
+    """Apply pending changes to the materialized calendar."""
+    full, dates = _pending.take(versions(session, _SOURCE_TABLES))
+    try:
+        if full:
+            refresh_calendar(session)
+        elif dates:
+            refresh_calendar(session, dates=dates)
+    except Exception:
+        _pending.mark(full=full, dates=dates)
+        raise
+
+
+def dated_sessions(session, first, last, room_id=None, class_id=None, include_cancelled=True):
+    """CalendarSession rows in [first, last], by date and time, refreshed first."""
+    ensure_calendar(session)
+    query = session.query(CalendarSession).filter(CalendarSession.date >= first, CalendarSession.date <= last)
+    if room_id is not None:
+        query = query.filter(or_(CalendarSession.room_id == room_id, CalendarSession.original_room_id == room_id))
+    if class_id is not None:
+        query = query.filter(CalendarSession.class_id == class_id)
+    if not include_cancelled:
+        query = query.filter(CalendarSession.status != 'cancelled')
+    return query.order_by(CalendarSession.date, CalendarSession.start_time, CalendarSession.id).all()
+
+
+# Writes to these can change any session of the approved grid
+_GRID_MODELS = (ApprovedTimetable, ApprovedTimetableEdit, ApprovedTimetableSnapshot, Semester,
+                Class, Course, Teacher, Classroom)
+_SOURCE_TABLES = tuple(model.__tablename__ for model in _GRID_MODELS + (ClassCancellation, RoomChange))
+
+
+def _after_flush(session, flush_context):
+    dates, full = set(), False
+    for state, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if isinstance(obj, _GRID_MODELS):
+                full = True
+            elif isinstance(obj, (ClassCancellation, RoomChange)):
+                # An edited override may have moved from another date
+                if state == 'dirty' or obj.date is None:
+                    full = True
+                else:
+                    dates.add(_as_date(obj.date))
+    if full or dates:
+        _pending.mark(full=full, dates=dates)
+
+
+def _bulk_write(orm_execute_state):
+    if not orm_execute_state.is_select and any(
+            m.class_ in _GRID_MODELS + (ClassCancellation, RoomChange) for m in orm_execute_state.all_mappers):
+        _pending.mark(full=True)
+
+
+on_bump(_pending.bumped)
+sa_event.listen(Session, 'after_flush', _after_flush)
+sa_event.listen(Session, 'do_orm_execute', _bulk_write)
+# A rolled-back write may already have been followed in _pending.versions
+sa_event.listen(Session, 'after_soft_rollback', lambda session, previous_transaction: _pending.mark(full=True))
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+# The web app opens its database at import; keep it off scheduler.db
+os.environ.setdefault('SCHEDULER_DB_URL', 'sqlite://')
+
+from scheduler import Base, Class, ClassCourseTeacher, Classroom, Course, Teacher, Timetable, get_session  # noqa: E402
+import models  # noqa: E402,F401  (registers the tables)
+
+
+def reset_caches():
+    """Drop the per-process caches, which would otherwise carry ids over from the previous test's database."""
+    import timetable_edits
+    from occurrences import occurrence_index
+    from room_index import room_index
+    from semester_calendar import _pending
+    from timetable_fragments import fragment_cache
+
+    with timetable_edits._states_lock:
+        timetable_edits._states.clear()
+    occurrence_index.invalidate()
+    room_index.invalidate()
+    _pending.mark(full=True)
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def session():
+    reset_caches()
+    s = get_session('sqlite://')
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def app_client():
+    """Test client of the web app on an emptied in-memory database."""
+    sys.path.insert(0, os.path.join(PROJECT_DIR, 'webapp'))
+    import app as webapp
+    engine = webapp.session.get_bind()
+    webapp.session.rollback()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    reset_caches()
+    webapp.app.config['TESTING'] = True
+    yield webapp.app.test_client(), webapp.session
+    webapp.session.rollback()
+
+
+def add_school(session):
+    """
+    Two classes in two rooms: A has Math (T1), Physics (T2) and Chemistry (T3),
+    B has Math (T1). Returns {name: id} of everything added.
+    """
+    rooms = [Classroom(name='R1', capacity=40), Classroom(name='R2', capacity=40)]
+    teachers = [Teacher(name=f'T{i}', subject='x') for i in (1, 2, 3)]
+    courses = [Course(name=name) for name in ('Math', 'Physics', 'Chemistry')]
+    classes = [Class(name='A', size=30), Class(name='B', size=30)]
+    session.add_all(rooms + teachers + courses + classes)
+    session.flush()
+    ids = {obj.name: obj.id for obj in rooms + teachers + courses + classes}
+    session.add_all([
+        ClassCourseTeacher(class_id=ids['A'], course_id=ids['Math'], teacher_id=ids['T1']),
+        ClassCourseTeacher(class_id=ids['A'], course_id=ids['Physics'], teacher_id=ids['T2']),
+        ClassCourseTeacher(class_id=ids['A'], course_id=ids['Chemistry'], teacher_id=ids['T3']),
+        ClassCourseTeacher(class_id=ids['B'], course_id=ids['Math'], teacher_id=ids['T1']),
+    ])
+    session.commit()
+    return ids
+
+
+def add_session(session, ids, class_name, course, teacher, room, day, start, end):
+    row = Timetable(class_id=ids[class_name], course_id=ids[course], teacher_id=ids[teacher],
+                    classroom_id=ids[room], day=day, start_time=start, end_time=end)
+    session.add(row)
+    session.commit()
+    return row
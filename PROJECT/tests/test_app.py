@@ -0,0 +1,25 @@
+import pytest
+
+from conftest import add_school
+
+
+@pytest.fixture
+def generate_calls(app_client, monkeypatch):
+    import app as webapp
+    calls = []
+    monkeypatch.setattr(webapp, 'generate_timetable', lambda *args, **kwargs: calls.append(kwargs))
+    add_school(app_client[1])
+    return calls
+
+
+def test_page_load_skips_the_improvement_pass(app_client, generate_calls):
+    client, _ = app_client
+    assert client.get('/generate_timetable?regenerate=true').status_code == 200
+    assert generate_calls[0]['improve_seconds'] == 0
+
+
+def test_improvement_pass_on_request(app_client, generate_calls):
+    client, _ = app_client
+    client.get('/generate_timetable?regenerate=true&improve=2')
+    client.get('/generate_timetable?regenerate=true&improve=3600')
+    assert [call['improve_seconds'] for call in generate_calls] == [2, 30]
@@ -0,0 +1,97 @@
+import datetime
+import subprocess
+import sys
+import textwrap
+
+from conftest import PROJECT_DIR, add_school, add_session, reset_caches
+from models import ClassCancellation, Event
+from occurrences import occurrence_index
+from room_index import room_index
+from scheduler import get_session
+from semester_calendar import dated_sessions, materialize_calendar
+from timetable_edits import create_approved_timetable
+from timetable_fragments import fragment_cache
+
+MONDAY = datetime.date(2026, 10, 19)
+
+
+def write_in_another_process(db_url, code):
+    """Run code with a session `s` on db_url in a separate interpreter, as another worker would."""
+    script = f"import sys; sys.path.insert(0, {PROJECT_DIR!r})\n" \
+             f"from scheduler import *; from models import *; import datetime\n" \
+             f"s = get_session({db_url!r})\n" + textwrap.dedent(code) + "\ns.commit()\n"
+    subprocess.run([sys.executable, '-c', script], check=True)
+
+
+def test_cancellation_frees_the_room(session):
+    ids = add_school(session)
+    row = add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    assert room_index.busy_rooms(session, [ids['R1'], ids['R2']], MONDAY, '09:00', '10:00') == {ids['R1']}
+
+    session.add(ClassCancellation(class_id=ids['A'], course_id=ids['Math'],
+                                  date=datetime.datetime.combine(MONDAY, datetime.time(8, 30))))
+    session.commit()
+    assert room_index.busy_rooms(session, [ids['R1'], ids['R2']], MONDAY, '09:00', '10:00') == set()
+    assert room_index.cancelled_on(session, MONDAY) == {row.id}
+    # Only that date is freed
+    assert room_index.busy_rooms(session, [ids['R1']], MONDAY + datetime.timedelta(days=7), '09:00', '10:00') \
+        == {ids['R1']}
+
+
+def test_caches_see_writes_of_another_process(tmp_path):
+    reset_caches()
+    db_url = f"sqlite:///{tmp_path / 'shared.db'}"
+    session = get_session(db_url)
+    ids = add_school(session)
+    add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    assert room_index.is_free(session, ids['R2'], MONDAY, '08:30', '09:30')
+    assert occurrence_index.on(session, MONDAY) == {}
+    draft_key = fragment_cache.version(session)
+    session.commit()
+
+    write_in_another_process(db_url, f"""
+        s.add(ClassCancellation(class_id={ids['A']}, course_id={ids['Math']}, date=datetime.datetime(2026, 10, 19)))
+        s.add(Event(title='Talk', room_id={ids['R2']}, date=datetime.datetime(2026, 10, 19),
+                    start_time='08:00', end_time='09:00'))
+        s.add(Timetable(class_id={ids['B']}, course_id={ids['Math']}, teacher_id={ids['T1']},
+                        classroom_id={ids['R2']}, day='Tuesday', start_time='08:30', end_time='09:30'))
+    """)
+
+    assert room_index.is_free(session, ids['R1'], MONDAY, '08:30', '09:30')
+    assert room_index.clashes(session, ids['R2'], MONDAY, '08:30', '09:30')[0][0] == 'event'
+    assert set(occurrence_index.on(session, MONDAY)) == {ids['R2']}
+    assert fragment_cache.version(session) != draft_key
+    session.close()
+
+
+def test_own_writes_keep_the_occurrence_memo(session):
+    ids = add_school(session)
+    occurrence_index.on(session, MONDAY)
+    session.add(Event(title='Talk', room_id=ids['R1'], date=datetime.datetime(2026, 10, 19),
+                      start_time='08:00', end_time='09:00'))
+    session.commit()
+    generation = occurrence_index._generation
+    # Patched in by the ORM hooks, so reading doesn't expand the month again
+    assert set(occurrence_index.on(session, MONDAY)) == {ids['R1']}
+    assert occurrence_index._generation == generation
+
+
+def test_calendar_sees_a_cancellation_by_another_process(tmp_path):
+    reset_caches()
+    db_url = f"sqlite:///{tmp_path / 'shared.db'}"
+    session = get_session(db_url)
+    ids = add_school(session)
+    create_approved_timetable(session, 'Term', None, {'A': {'08:30-09:30': {'Monday': 'Math<br>T1<br>R1'}}})
+    session.commit()
+    materialize_calendar(session, MONDAY, MONDAY + datetime.timedelta(days=13))
+    assert [s.status for s in dated_sessions(session, MONDAY, MONDAY + datetime.timedelta(days=13))] \
+        == ['scheduled', 'scheduled']
+    session.commit()
+
+    write_in_another_process(db_url, f"""
+        s.add(ClassCancellation(class_id={ids['A']}, course_id={ids['Math']}, date=datetime.datetime(2026, 10, 26)))
+    """)
+
+    assert [(s.date, s.status) for s in dated_sessions(session, MONDAY, MONDAY + datetime.timedelta(days=13))] \
+        == [(MONDAY, 'scheduled'), (MONDAY + datetime.timedelta(days=7), 'cancelled')]
+    session.close()
@@ -0,0 +1,54 @@
+import datetime
+
+from conftest import add_school, add_session
+from exams import ExamRooms, dsatur, generate_exam_schedule, min_exam_days
+from invigilation import assign_invigilators
+from models import Exam
+
+MONDAY = datetime.date(2026, 10, 19)
+
+
+def test_dsatur_gives_neighbours_different_colours():
+    graph = {1: {2, 3}, 2: {1, 3}, 3: {1, 2, 4}, 4: {3}, 5: set()}
+    colours, uncoloured = dsatur(graph)
+    assert not uncoloured
+    assert all(colours[u] != colours[v] for u in graph for v in graph[u])
+    assert len(set(colours.values())) == 3
+
+
+def test_min_exam_days_counts_rooms():
+    # No conflicts, but one room seats one exam per slot
+    graph = {course: set() for course in range(4)}
+    assert min_exam_days(graph, 3, ExamRooms([(1, 40)]), sizes={course: 30 for course in graph}) == 2
+    assert min_exam_days(graph, 3, ExamRooms([(1, 40), (2, 40)]), sizes={course: 30 for course in graph}) == 1
+    assert min_exam_days(graph, 3, ExamRooms([])) is None
+
+
+def test_schedule_uses_the_minimum_days(session):
+    add_school(session)
+    # Class A sits Math, Physics and Chemistry, so they need three slots
+    assert generate_exam_schedule(session, start_date=MONDAY) == (3, 0, 1)
+    exams = session.query(Exam.date, Exam.start_time).all()
+    assert {date for date, _ in exams} == {MONDAY}
+    assert len({start for _, start in exams}) == 3
+
+
+def test_schedule_with_two_slots_a_day_takes_two_days(session):
+    add_school(session)
+    slots = [("09:00", "11:00"), ("14:00", "16:00")]
+    assert generate_exam_schedule(session, start_date=MONDAY, slots=slots) == (3, 0, 2)
+    dates = [date for (date,) in session.query(Exam.date)]
+    assert sorted(set(dates)) == [MONDAY, MONDAY + datetime.timedelta(days=1)]
+
+
+def test_invigilators_skip_teachers_teaching_then(session):
+    ids = add_school(session)
+    # T1 teaches on Mondays during the morning exam slot
+    add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '09:30', '10:30')
+    generate_exam_schedule(session, start_date=MONDAY)
+    result = assign_invigilators(session)
+    assert result['assigned'] == 3 and result['unassigned'] == []
+    morning = session.query(Exam.invigilator_id).filter(Exam.start_time == '09:00').scalar()
+    assert morning not in (None, ids['T1'])
+    # One duty each
+    assert sorted(result['duties'].values()) == [1, 1, 1]
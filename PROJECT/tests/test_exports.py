@@ -0,0 +1,27 @@
+import io
+import zipfile
+
+from conftest import add_school
+from timetable_edits import create_approved_timetable
+
+
+def test_csv_and_xlsx_exports(app_client):
+    client, session = app_client
+    add_school(session)
+    create_approved_timetable(session, 'Term', None, {
+        'A': {'08:30-09:30': {'Monday': 'Math<br>T1<br>R1', 'Tuesday': 'Physics<br>T2<br>R2'}},
+    })
+    session.commit()
+    csv = client.get('/export/approved.csv')
+    assert csv.status_code == 200
+    assert csv.get_data(as_text=True).splitlines() == [
+        'class,day,start_time,end_time,course,teacher,room',
+        'A,Monday,08:30,09:30,Math,T1,R1',
+        'A,Tuesday,08:30,09:30,Physics,T2,R2',
+    ]
+    xlsx = client.get('/export/approved.xlsx')
+    with zipfile.ZipFile(io.BytesIO(xlsx.get_data())) as book:
+        sheet = book.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        workbook = book.read('xl/workbook.xml').decode('utf-8')
+    assert 'Physics' in sheet and 'name="Approved"' in workbook
+    assert client.get('/export/nothing.csv').status_code == 404
@@ -0,0 +1,48 @@
+import collections
+import random
+
+from conftest import add_school
+from improve import improve_timetable
+from scheduler import Timetable, generate_timetable
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+SLOTS = [('08:30', '09:30'), ('09:45', '10:45'), ('11:00', '12:00'), ('12:15', '13:15'), ('14:00', '15:00')]
+
+
+def rows(session):
+    return sorted(session.query(Timetable.class_id, Timetable.course_id, Timetable.teacher_id, Timetable.classroom_id,
+                                Timetable.day, Timetable.start_time).all())
+
+
+def assert_no_clashes(session):
+    for column in (Timetable.class_id, Timetable.teacher_id, Timetable.classroom_id):
+        booked = collections.Counter(session.query(column, Timetable.day, Timetable.start_time).all())
+        assert max(booked.values()) == 1
+
+
+def test_seeded_generation_repeats(session):
+    add_school(session)
+    generate_timetable(session, DAYS, SLOTS, seed=3)
+    first = rows(session)
+    generate_timetable(session, DAYS, SLOTS, seed=3)
+    assert rows(session) == first
+    # 3 lectures and a two-slot lab for each of the four class courses
+    assert len(first) == 4 * 5
+    assert_no_clashes(session)
+
+
+def test_warm_start_keeps_the_current_timetable(session):
+    add_school(session)
+    generate_timetable(session, DAYS, SLOTS, seed=3)
+    before = rows(session)
+    generate_timetable(session, DAYS, SLOTS, warm_start=True)
+    assert rows(session) == before
+
+
+def test_improvement_never_makes_the_score_worse(session):
+    add_school(session)
+    generate_timetable(session, DAYS, SLOTS, seed=5)
+    result = improve_timetable(session, DAYS, SLOTS, 0.2, rng=random.Random(5))
+    assert result['score_after'] <= result['score_before']
+    assert result['missed_after'] <= result['missed_before']
+    assert_no_clashes(session)
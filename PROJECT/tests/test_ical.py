@@ -0,0 +1,45 @@
+import datetime
+
+from conftest import add_school
+from models import ClassCancellation
+from timetable_edits import create_approved_timetable
+
+S1 = '08:30-09:30'
+
+
+def approved(session):
+    ids = add_school(session)
+    create_approved_timetable(session, 'Term', None, {
+        'A': {S1: {'Monday': 'Math<br>T1<br>R1', 'Tuesday': 'Physics<br>T2<br>R2'}},
+    })
+    session.commit()
+    return ids
+
+
+def test_class_feed_with_cancellation_and_etag(app_client):
+    client, session = app_client
+    ids = approved(session)
+    feed = client.get(f"/calendar/class/{ids['A']}.ics")
+    assert feed.status_code == 200 and feed.mimetype == 'text/calendar'
+    body = feed.get_data(as_text=True)
+    assert body.startswith('BEGIN:VCALENDAR') and body.rstrip().endswith('END:VCALENDAR')
+    assert body.count('BEGIN:VEVENT') == 2
+    assert 'RRULE:FREQ=WEEKLY;BYDAY=MO' in body and 'EXDATE' not in body
+    assert client.get(f"/calendar/class/{ids['A']}.ics", headers={'If-None-Match': feed.headers['ETag']}
+                      ).status_code == 304
+
+    session.add(ClassCancellation(class_id=ids['A'], course_id=ids['Math'], date=datetime.datetime(2026, 10, 19)))
+    session.commit()
+    changed = client.get(f"/calendar/class/{ids['A']}.ics", headers={'If-None-Match': feed.headers['ETag']})
+    assert changed.status_code == 200
+    assert 'EXDATE:20261019T083000' in changed.get_data(as_text=True)
+
+
+def test_teacher_and_room_feeds_keep_their_own_sessions(app_client):
+    client, session = app_client
+    ids = approved(session)
+    teacher = client.get(f"/calendar/teacher/{ids['T2']}.ics").get_data(as_text=True)
+    assert teacher.count('BEGIN:VEVENT') == 1 and 'BYDAY=TU' in teacher
+    room = client.get(f"/calendar/room/{ids['R1']}.ics").get_data(as_text=True)
+    assert room.count('BEGIN:VEVENT') == 1 and 'BYDAY=MO' in room
+    assert client.get('/calendar/room/999.ics').status_code == 404
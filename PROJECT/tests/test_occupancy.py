@@ -0,0 +1,31 @@
+import random
+
+from occupancy import IntervalSet
+
+
+def test_interval_set_matches_a_linear_scan():
+    rng = random.Random(7)
+    intervals = IntervalSet()
+    held = {}
+    for ref in range(400):
+        if held and rng.random() < 0.4:
+            gone = rng.choice(sorted(held))
+            intervals.remove(gone)
+            del held[gone]
+        else:
+            start = rng.randrange(0, 100)
+            held[ref] = (start, start + rng.randrange(1, 30))
+            intervals.add(*held[ref], ref)
+        start = rng.randrange(0, 120)
+        end = start + rng.randrange(1, 20)
+        expected = {r for r, (s, e) in held.items() if s < end and e > start}
+        assert set(intervals.overlapping(start, end)) == expected
+        assert intervals.is_free(start, end) == (not expected)
+    assert sorted(intervals) == sorted((s, e, r) for r, (s, e) in held.items())
+
+
+def test_remove_unknown_ref_is_a_no_op():
+    intervals = IntervalSet([('08:00', '09:00', 1)])
+    intervals.remove(2)
+    assert list(intervals) == [('08:00', '09:00', 1)]
+    assert not intervals.is_free('08:30', '08:45')
@@ -0,0 +1,36 @@
+import datetime
+
+from conftest import add_school
+from models import Event
+from occurrences import expand, occurrence_index
+
+OCTOBER = (datetime.date(2026, 10, 1), datetime.date(2026, 10, 31))
+
+
+def test_expand_weekly_and_monthly():
+    weekly = Event(recurrence='weekly', day_of_week='Wednesday', start_date=datetime.datetime(2026, 10, 10),
+                   end_date=datetime.datetime(2026, 10, 28))
+    assert list(expand(weekly, *OCTOBER)) == [datetime.date(2026, 10, 14), datetime.date(2026, 10, 21),
+                                              datetime.date(2026, 10, 28)]
+    # Months without the 31st are skipped
+    monthly = Event(recurrence='monthly', day_of_month=31, start_date=datetime.datetime(2026, 10, 1))
+    assert list(expand(monthly, datetime.date(2026, 10, 1), datetime.date(2027, 1, 31))) == [
+        datetime.date(2026, 10, 31), datetime.date(2026, 12, 31), datetime.date(2027, 1, 31)]
+
+
+def test_index_follows_event_writes(session):
+    ids = add_school(session)
+    talk = Event(title='Talk', room_id=ids['R1'], recurrence='weekly', day_of_week='Monday',
+                 start_date=datetime.datetime(2026, 10, 1), start_time='08:00', end_time='09:00')
+    session.add(talk)
+    session.commit()
+    assert [(day.day, room) for day, _, _, room, _ in occurrence_index.occurrences(session, *OCTOBER)] \
+        == [(5, ids['R1']), (12, ids['R1']), (19, ids['R1']), (26, ids['R1'])]
+    assert occurrence_index.clashes(session, ids['R1'], datetime.date(2026, 10, 19), '08:30', '10:00') == [talk.id]
+
+    talk.room_id = ids['R2']
+    session.commit()
+    assert occurrence_index.busy_rooms(session, datetime.date(2026, 10, 19), '08:30', '10:00') == {ids['R2']}
+    session.delete(talk)
+    session.commit()
+    assert occurrence_index.occurrences(session, *OCTOBER) == []
@@ -0,0 +1,32 @@
+from conftest import add_school, add_session
+from repair import repair_timetable
+from scheduler import Timetable
+
+DAYS = ['Monday', 'Tuesday']
+SLOTS = [('08:30', '09:30'), ('09:45', '10:45')]
+
+
+def test_unavailable_room_moves_sessions_to_another_room_in_place(session):
+    ids = add_school(session)
+    math = add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    physics = add_session(session, ids, 'A', 'Physics', 'T2', 'R2', 'Monday', '09:45', '10:45')
+    result = repair_timetable(session, DAYS, SLOTS, rooms=['R1'])
+    assert result['unplaced'] == []
+    assert [(c['timetable_id'], c['day'], c['time_slot'], c['room_id']) for c in result['changes']] == [
+        (math.id, 'Monday', '08:30-09:30', ids['R2'])]
+    # Untouched sessions stay where they were
+    assert session.get(Timetable, physics.id).classroom_id == ids['R2']
+    assert session.get(Timetable, math.id).classroom_id == ids['R2']
+
+
+def test_unavailable_teacher_period_moves_the_session(session):
+    ids = add_school(session)
+    math = add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    result = repair_timetable(session, DAYS, SLOTS, teachers=['T1'], periods=[('Monday', '08:30-09:30')],
+                              commit=False)
+    assert result['unplaced'] == []
+    (change,) = result['changes']
+    assert change['timetable_id'] == math.id
+    assert (change['day'], change['time_slot']) != ('Monday', '08:30-09:30')
+    # Nothing written without commit
+    assert session.get(Timetable, math.id).start_time == '08:30'
@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import add_school
+from scheduler import Class, ClassCourseTeacher, add_classes_bulk
+
+
+def mappings(session, class_id):
+    return set(session.query(ClassCourseTeacher.course_id, ClassCourseTeacher.teacher_id).filter_by(class_id=class_id))
+
+
+def test_bulk_roster_creates_classes_and_replaces_mappings(session):
+    ids = add_school(session)
+    result = add_classes_bulk(session, {'A': {'Math': 'T3'}, 'C': {ids['Physics']: 'T2'}, 'B': {}},
+                              sizes={'C': 25, 'B': 12})
+    assert result['A'] == ids['A'] and result['B'] == ids['B']
+    assert mappings(session, ids['A']) == {(ids['Math'], ids['T3'])}
+    assert mappings(session, result['C']) == {(ids['Physics'], ids['T2'])}
+    # An empty mapping keeps the class's courses
+    assert mappings(session, ids['B']) == {(ids['Math'], ids['T1'])}
+    assert dict(session.query(Class.name, Class.size)) == {'A': 30, 'B': 12, 'C': 25}
+
+
+def test_bulk_roster_with_unknown_names_changes_nothing(session):
+    ids = add_school(session)
+    with pytest.raises(ValueError):
+        add_classes_bulk(session, {'C': {'Math': 'T1'}, 'A': {'Biology': 'T1'}})
+    assert session.query(Class).count() == 2
+    assert len(mappings(session, ids['A'])) == 3
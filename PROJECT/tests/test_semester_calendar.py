@@ -0,0 +1,40 @@
+import datetime
+
+from conftest import add_school
+from models import CalendarSession, RoomChange
+from semester_calendar import dated_sessions, materialize_calendar
+from timetable_edits import create_approved_timetable
+
+MONDAY = datetime.date(2026, 10, 19)
+
+
+def test_materialize_and_follow_room_changes(session):
+    ids = add_school(session)
+    create_approved_timetable(session, 'Term', None, {'A': {'08:30-09:30': {'Monday': 'Math<br>T1<br>R1',
+                                                                              'Wednesday': 'Physics<br>T2<br>R2'}}})
+    session.commit()
+    counts = materialize_calendar(session, MONDAY, MONDAY + datetime.timedelta(days=13))
+    assert counts == {'inserted': 4, 'updated': 0, 'deleted': 0}
+
+    session.add(RoomChange(class_id=ids['A'], course_id=ids['Math'], old_room_id=ids['R1'], new_room_id=ids['R2'],
+                           date=datetime.datetime(2026, 10, 26)))
+    session.commit()
+    rows = dated_sessions(session, MONDAY, MONDAY + datetime.timedelta(days=13), room_id=ids['R2'])
+    assert [(row.date, row.course_id, row.original_room_id) for row in rows] == [
+        (MONDAY + datetime.timedelta(days=2), ids['Physics'], None),
+        (MONDAY + datetime.timedelta(days=7), ids['Math'], ids['R1']),
+        (MONDAY + datetime.timedelta(days=9), ids['Physics'], None),
+    ]
+
+
+def test_new_active_timetable_replaces_the_calendar(session):
+    add_school(session)
+    first = create_approved_timetable(session, 'Term', None, {'A': {'08:30-09:30': {'Monday': 'Math<br>T1<br>R1'}}})
+    session.commit()
+    materialize_calendar(session, MONDAY, MONDAY + datetime.timedelta(days=6))
+    first.is_active = False
+    second = create_approved_timetable(session, 'Term 2', None, {'A': {'09:45-10:45': {'Friday': 'Math<br>T1<br>R1'}}})
+    session.commit()
+    rows = dated_sessions(session, MONDAY, MONDAY + datetime.timedelta(days=6))
+    assert [(row.date.weekday(), row.start_time, row.approved_timetable_id) for row in rows] == [(4, '09:45', second.id)]
+    assert session.query(CalendarSession).count() == 1
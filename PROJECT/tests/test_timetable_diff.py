@@ -0,0 +1,30 @@
+from timetable_diff import diff_timetables
+
+S1, S2 = '08:30-09:30', '09:45-10:45'
+
+
+def test_diff_classifies_changes():
+    old = {
+        'A': {S1: {'Monday': 'Math<br>T1<br>R1', 'Tuesday': 'Physics<br>T2<br>R1'},
+              S2: {'Monday': 'Chemistry<br>T3<br>R2'}},
+    }
+    new = {
+        'A': {S1: {'Monday': 'Math<br>T1<br>R2'},
+              S2: {'Wednesday': 'Physics<br>T2<br>R1', 'Friday': ['Biology<br>T4<br>R1']}},
+    }
+    diff = diff_timetables(old, new)
+    assert diff['summary'] == {'moved': 1, 'room_changed': 1, 'added': 1, 'removed': 1, 'unchanged': 0}
+    assert diff['changes']['moved'] == [{
+        'class_group': 'A', 'course': 'Physics', 'teacher': 'T2', 'from_day': 'Tuesday', 'from_slot': S1,
+        'old_room': 'R1', 'day': 'Wednesday', 'time_slot': S2, 'room': 'R1',
+    }]
+    assert diff['changes']['room_changed'][0]['old_room'] == 'R1'
+    assert diff['changes']['removed'][0]['course'] == 'Chemistry'
+    assert diff['affected'] == {'teachers': ['T1', 'T2', 'T3', 'T4'], 'rooms': ['R1', 'R2'], 'classes': ['A']}
+
+
+def test_identical_grids_have_no_changes():
+    grid = {'A': {S1: {'Monday': ['Math<br>T1<br>R1'], 'Tuesday': '-'}}}
+    diff = diff_timetables(grid, grid)
+    assert diff['summary']['unchanged'] == 1
+    assert not any(diff['changes'].values())
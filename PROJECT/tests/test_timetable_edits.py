@@ -0,0 +1,205 @@
+import pytest
+from sqlalchemy import event
+
+from conftest import add_school, add_session
+from models import ApprovedTimetable, ApprovedTimetableSnapshot
+from scheduler import Timetable
+import timetable_edits
+from timetable_edits import (StaleTimetableError, bump_version, create_approved_timetable, edit_history, forget_state,
+                             load_timetable_data, log_edit, patch_approved_timetable, patch_draft_timetable,
+                             timetable_at)
+
+S1, S2, S3 = '08:30-09:30', '09:45-10:45', '11:00-12:00'
+
+
+def move(class_group, subject, original_time, time_slot, day='Monday', original_day='Monday', **extra):
+    return dict(class_group=class_group, subject=subject, original_day=original_day,
+                original_time=original_time, day=day, time_slot=time_slot, **extra)
+
+
+def draft_school(session):
+    ids = add_school(session)
+    add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    add_session(session, ids, 'A', 'Physics', 'T2', 'R1', 'Monday', '09:45', '10:45')
+    return ids
+
+
+def slots_of(session, ids, class_name):
+    return {
+        course_id: f"{start}-{end}"
+        for course_id, start, end in session.query(Timetable.course_id, Timetable.start_time, Timetable.end_time
+                                                   ).filter(Timetable.class_id == ids[class_name])
+    }
+
+
+def approved_school(session):
+    data = {
+        'A': {
+            S1: {'Monday': 'Math<br>T1<br>R1'},
+            S2: {'Monday': 'Physics<br>T2<br>R1'},
+        },
+        'B': {S3: {'Monday': 'Math<br>T1<br>R2'}},
+    }
+    approved = create_approved_timetable(session, 'Term', None, data)
+    session.commit()
+    return approved
+
+
+def test_draft_swap_in_one_batch(session):
+    ids = draft_school(session)
+    result = patch_draft_timetable(session, [move('A', 'Math', S1, S2), move('A', 'Physics', S2, S1)])
+    assert [r['status'] for r in result['results']] == ['applied', 'applied']
+    assert slots_of(session, ids, 'A') == {ids['Math']: S2, ids['Physics']: S1}
+
+
+def test_draft_chain_in_dependent_order(session):
+    ids = draft_school(session)
+    # Math goes where Physics is, and Physics only leaves in the second move
+    result = patch_draft_timetable(session, [move('A', 'Math', S1, S2), move('A', 'Physics', S2, S3)])
+    assert result['success']
+    assert slots_of(session, ids, 'A') == {ids['Math']: S2, ids['Physics']: S3}
+
+
+def test_swap_rejected_as_a_whole_when_one_side_clashes(session):
+    ids = draft_school(session)
+    # T2 teaches B in the first slot, so Physics can't go there, and Math can't take Physics' place
+    add_session(session, ids, 'B', 'Math', 'T2', 'R2', 'Monday', '08:30', '09:30')
+    result = patch_draft_timetable(session, [move('A', 'Math', S1, S2), move('A', 'Physics', S2, S1)])
+    assert [r['status'] for r in result['results']] == ['conflict', 'conflict']
+    assert {c['type'] for c in result['results'][1]['conflicts']} == {'teacher'}
+    assert slots_of(session, ids, 'A') == {ids['Math']: S1, ids['Physics']: S2}
+
+
+def test_two_moves_into_one_slot_first_wins(session):
+    ids = draft_school(session)
+    add_session(session, ids, 'A', 'Chemistry', 'T3', 'R2', 'Monday', '11:00', '12:00')
+    result = patch_draft_timetable(session, [move('A', 'Physics', S2, '12:15-13:15'),
+                                             move('A', 'Chemistry', S3, '12:15-13:15')])
+    assert [r['status'] for r in result['results']] == ['applied', 'conflict']
+
+
+def test_session_moved_twice_in_a_batch_is_an_error(session):
+    draft_school(session)
+    result = patch_draft_timetable(session, [move('A', 'Math', S1, S3), move('A', 'Math', S1, '12:15-13:15')])
+    assert [r['status'] for r in result['results']] == ['applied', 'error']
+
+
+def test_unknown_session_and_bad_slot_are_errors(session):
+    draft_school(session)
+    result = patch_draft_timetable(session, [move('A', 'Biology', S1, S3), move('A', 'Math', S1, 'noon'),
+                                             move('Z', 'Math', S1, S3)])
+    assert [r['status'] for r in result['results']] == ['error', 'error', 'error']
+
+
+def test_approved_swap_and_chain(session):
+    add_school(session)
+    approved = approved_school(session)
+    swap = patch_approved_timetable(session, approved, [move('A', 'Math', S1, S2), move('A', 'Physics', S2, S1)])
+    assert swap['success'] and swap['version'] == 1
+    # Physics takes Math's slot as Math moves on to Tuesday
+    chain = patch_approved_timetable(session, approved, [move('A', 'Physics', S1, S2), move('A', 'Math', S2, S3,
+                                                                                           day='Tuesday')],
+                                     expected_version=1)
+    assert chain['success'] and chain['version'] == 2
+
+    data = load_timetable_data(session, approved)
+    assert data['A'][S2]['Monday'] == ['Physics<br>T2<br>R1']
+    assert data['A'][S3]['Tuesday'] == ['Math<br>T1<br>R1']
+    assert data['A'][S1]['Monday'] == []
+    # The edit log replays to the same grid
+    assert timetable_at(session, approved, 4) == data
+
+
+def test_approved_conflict_with_other_class(session):
+    add_school(session)
+    approved = approved_school(session)
+    # T1 already teaches B in the third slot
+    result = patch_approved_timetable(session, approved, [move('A', 'Math', S1, S3)])
+    assert result['results'][0]['status'] == 'conflict'
+    assert result['results'][0]['conflicts'] == [{'type': 'teacher', 'resource': 'T1', 'class_group': 'B',
+                                                  'course': 'Math'}]
+    assert session.query(ApprovedTimetable.version).scalar() == 0
+
+
+def test_stale_expected_version(session):
+    add_school(session)
+    approved = approved_school(session)
+    patch_approved_timetable(session, approved, [move('A', 'Math', S1, S3, room='R1', day='Tuesday')])
+    with pytest.raises(StaleTimetableError) as error:
+        patch_approved_timetable(session, approved, [move('A', 'Physics', S2, S1)], expected_version=0)
+    assert error.value.current_version == 1
+
+
+def test_patch_route_returns_409_on_stale_version(app_client):
+    client, session = app_client
+    add_school(session)
+    approved_school(session)
+    stale = client.post('/api/timetable/patch', json={'moves': [move('A', 'Math', S1, S2, day='Tuesday')],
+                                                      'version': 5})
+    assert stale.status_code == 409
+    assert stale.get_json()['version'] == 0
+    ok = client.post('/api/timetable/patch', json={'moves': [move('A', 'Math', S1, S2), move('A', 'Physics', S2, S1)],
+                                                   'version': 0})
+    assert ok.status_code == 200
+    assert ok.get_json()['version'] == 1
+    assert [r['status'] for r in ok.get_json()['results']] == ['applied', 'applied']
+
+
+def test_timetable_page_carries_the_version_to_send(app_client):
+    client, session = app_client
+    add_school(session)
+    approved_school(session)
+    page = client.get('/generate_timetable?regenerate=true').get_data(as_text=True)
+    assert 'data-version="0"' in page
+
+
+def test_draft_batch_loads_only_the_cells_it_touches(session):
+    ids = draft_school(session)
+    add_session(session, ids, 'B', 'Math', 'T1', 'R2', 'Tuesday', '08:30', '09:30')
+    grid_queries = []
+
+    def record(conn, cursor, statement, params, context, executemany):
+        if 'JOIN classrooms' in statement:
+            grid_queries.append(set(zip(params[::3], params[1::3], params[2::3])))
+
+    event.listen(session.get_bind(), 'after_cursor_execute', record)
+    try:
+        result = patch_draft_timetable(session, [move('A', 'Math', S1, S3)])
+    finally:
+        event.remove(session.get_bind(), 'after_cursor_execute', record)
+    assert result['success']
+    assert grid_queries == [{('Monday', '08:30', '09:30'), ('Monday', '11:00', '12:00')}]
+    assert slots_of(session, ids, 'A') == {ids['Math']: S3, ids['Physics']: S2}
+
+
+def test_compare_and_swap_version(session):
+    add_school(session)
+    approved = approved_school(session)
+    assert bump_version(session, approved.id, 0) == 1
+    with pytest.raises(StaleTimetableError) as error:
+        bump_version(session, approved.id, 0)
+    assert error.value.current_version == 1
+
+
+def test_edit_log_snapshots_and_history(session, monkeypatch):
+    monkeypatch.setattr(timetable_edits, 'SNAPSHOT_EVERY', 2)
+    add_school(session)
+    approved = approved_school(session)
+    original = load_timetable_data(session, approved)
+    patch_approved_timetable(session, approved, [move('A', 'Math', S1, S3, day='Tuesday')])
+    patch_approved_timetable(session, approved, [move('A', 'Math', S3, S3, original_day='Tuesday', day='Wednesday')])
+    version = log_edit(session, approved, 'cancel', {'class_group': 'A', 'date': '2026-10-21'})
+    assert version == 3
+
+    # Two grid edits make a snapshot; the history-only edit leaves the grid alone
+    assert [seq for (seq,) in session.query(ApprovedTimetableSnapshot.seq).order_by(ApprovedTimetableSnapshot.seq)] \
+        == [0, 2]
+    assert [(e['seq'], e['op']) for e in edit_history(session, approved.id)] == [(1, 'move'), (2, 'move'),
+                                                                                 (3, 'cancel')]
+    assert timetable_at(session, approved, 0) == original
+    assert timetable_at(session, approved, 1)['A'][S3]['Tuesday'] == ['Math<br>T1<br>R1']
+    current = load_timetable_data(session, approved)
+    assert current['A'][S3]['Wednesday'] == ['Math<br>T1<br>R1']
+    # Another worker rebuilding from the database gets the same grid
+    forget_state(approved.id)
+    assert load_timetable_data(session, approved) == current
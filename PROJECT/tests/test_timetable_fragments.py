@@ -0,0 +1,27 @@
+from conftest import add_school, add_session
+from timetable_fragments import fragment_cache
+
+
+def fragment(client, class_name):
+    response = client.get(f'/timetable/fragment?class={class_name}&view=week')
+    assert response.status_code == 200
+    return response.get_json()['html']
+
+
+def test_fragment_is_cached_until_the_draft_changes(app_client):
+    client, session = app_client
+    ids = add_school(session)
+    add_session(session, ids, 'A', 'Math', 'T1', 'R1', 'Monday', '08:30', '09:30')
+    html = fragment(client, 'A')
+    assert 'Math' in html and 'Physics' not in html
+    version = fragment_cache.version(session)
+    assert fragment_cache.get((version, 'A', ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'))) == html
+
+    add_session(session, ids, 'A', 'Physics', 'T2', 'R2', 'Tuesday', '08:30', '09:30')
+    assert fragment_cache.version(session) != version
+    assert 'Physics' in fragment(client, 'A')
+
+
+def test_unknown_class_fragment(app_client):
+    client, _ = app_client
+    assert client.get('/timetable/fragment?class=Nope').status_code == 404
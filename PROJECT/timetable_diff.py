@@ -0,0 +1,140 @@
+import argparse
+import collections
+import json
+
+from timetable_edits import cell_entries, load_timetable_data, timetable_at
+from models import ApprovedTimetable
+
+CHANGE_KINDS = ('moved', 'room_changed', 'added', 'removed')
+
+
+def iter_sessions(data):
+    """Yield (class, day, slot, entry) for every session in a {class: {slot: {day: cell}}} grid."""
+    for class_name, slots in data.items():
+        for slot, days in slots.items():
+            for day, cell in days.items():
+                for entry in cell_entries(cell):
+                    yield class_name, day, slot, entry
+
+
+def diff_timetables(old, new):
+    """
+    Structural diff of two timetable grids.
+
+    Sessions are matched by (class, day, slot, course, teacher): a match in a
+    different room is room_changed. Whatever is left unmatched is paired up per
+    (class, course, teacher) as moved; the remainder is added or removed.
+    One pass over each grid; only the unmatched sessions are kept around.
+    """
+    # (class, day, slot, course, teacher) -> rooms of old sessions not yet matched
+    pending = collections.defaultdict(list)
+    for class_name, day, slot, e in iter_sessions(old):
+        pending[(class_name, day, slot, e['course'], e['teacher'])].append(e['classroom'])
+
+    changes = {kind: [] for kind in CHANGE_KINDS}
+    unmatched_new = collections.defaultdict(list)
+    unchanged = 0
+    for class_name, day, slot, e in iter_sessions(new):
+        key = (class_name, day, slot, e['course'], e['teacher'])
+        rooms = pending.get(key)
+        if not rooms:
+            unmatched_new[(class_name, e['course'], e['teacher'])].append((day, slot, e['classroom']))
+            continue
+        room = e['classroom'] if e['classroom'] in rooms else rooms[0]
+        rooms.remove(room)
+        if not rooms:
+            del pending[key]
+        if room == e['classroom']:
+            unchanged += 1
+        else:
+            changes['room_changed'].append({
+                'class_group': class_name, 'course': e['course'], 'teacher': e['teacher'],
+                'day': day, 'time_slot': slot, 'old_room': room, 'room': e['classroom'],
+            })
+
+    unmatched_old = collections.defaultdict(list)
+    for (class_name, day, slot, course, teacher), rooms in pending.items():
+        for room in rooms:
+            unmatched_old[(class_name, course, teacher)].append((day, slot, room))
+
+    for key, placed in unmatched_new.items():
+        class_name, course, teacher = key
+        previous = unmatched_old.pop(key, [])
+        for (day, slot, room), (old_day, old_slot, old_room) in zip(placed, previous):
+            changes['moved'].append({
+                'class_group': class_name, 'course': course, 'teacher': teacher,
+                'from_day': old_day, 'from_slot': old_slot, 'old_room': old_room,
+                'day': day, 'time_slot': slot, 'room': room,
+            })
+        for day, slot, room in placed[len(previous):]:
+            changes['added'].append({
+                'class_group': class_name, 'course': course, 'teacher': teacher,
+                'day': day, 'time_slot': slot, 'room': room,
+            })
+        for day, slot, room in previous[len(placed):]:
+            changes['removed'].append({
+                'class_group': class_name, 'course': course, 'teacher': teacher,
+                'day': day, 'time_slot': slot, 'room': room,
+            })
+    for (class_name, course, teacher), previous in unmatched_old.items():
+        for day, slot, room in previous:
+            changes['removed'].append({
+                'class_group': class_name, 'course': course, 'teacher': teacher,
+                'day': day, 'time_slot': slot, 'room': room,
+            })
+
+    affected = {'teachers': set(), 'rooms': set(), 'classes': set()}
+    for kind in CHANGE_KINDS:
+        for change in changes[kind]:
+            affected['classes'].add(change['class_group'])
+            affected['teachers'].add(change['teacher'])
+            affected['rooms'].update((change['room'], change.get('old_room')))
+    for names in affected.values():
+        names.discard(None)
+        names.discard('')
+
+    return {
+        'summary': dict({kind: len(changes[kind]) for kind in CHANGE_KINDS}, unchanged=unchanged),
+        'changes': changes,
+        'affected': {kind: sorted(names) for kind, names in affected.items()},
+    }
+
+
+def parse_ref(ref):
+    """Parse "ID" or "ID@SEQ" into (id, seq or None)."""
+    approved_id, _, seq = str(ref).partition('@')
+    return int(approved_id), (int(seq) if seq else None)
+
+
+def load_ref(session, ref):
+    """Grid of an approved timetable reference ("ID" = current, "ID@SEQ" = right after edit SEQ)."""
+    approved_id, seq = parse_ref(ref)
+    approved = session.query(ApprovedTimetable).get(approved_id)
+    if approved is None:
+        raise LookupError(f"Approved timetable {approved_id} not found")
+    if seq is None:
+        return load_timetable_data(session, approved)
+    return timetable_at(session, approved, seq)
+
+
+def diff_approved(session, old_ref, new_ref):
+    return diff_timetables(load_ref(session, old_ref), load_ref(session, new_ref))
+
+
+if __name__ == "__main__":
+    from scheduler import get_session
+
+    parser = argparse.ArgumentParser(description="Diff two approved timetables (ID or ID@SEQ).")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--db', help="database URL (default: sqlite:///scheduler.db)")
+    parser.add_argument('--summary', action='store_true', help="only print counts and affected resources")
+    args = parser.parse_args()
+
+    try:
+        result = diff_approved(get_session(args.db), args.old, args.new)
+    except (ValueError, LookupError) as e:
+        parser.error(str(e))
+    if args.summary:
+        result.pop('changes')
+    print(json.dumps(result, indent=2))
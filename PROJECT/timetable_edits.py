@@ -0,0 +1,572 @@
+import copy
+import json
+import re
+import threading
+import zlib
+
+from sqlalchemy import tuple_, update
+from sqlalchemy.exc import IntegrityError
+
+from occupancy import OccupancyIndex
+from scheduler import Timetable, Class, Course, Teacher, Classroom
+from models import ApprovedTimetable, ApprovedTimetableEdit, ApprovedTimetableSnapshot
+
+# Cell values that mean "no session here" in stored timetable JSON
+EMPTY_CELL_VALUES = (None, '', '-')
+WEEK_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SLOT_KEY_RE = re.compile(r'^\d{2}:\d{2}-\d{2}:\d{2}$')
+MOVE_FIELDS = ('class_group', 'subject', 'original_day', 'original_time', 'day', 'time_slot')
+# Edit-log ops that relocate a session in the grid; other ops (cancellation) are history only
+GRID_OPS = ('move', 'room_change')
+# Write a compressed snapshot after this many logged edits, bounding replay cost
+SNAPSHOT_EVERY = 50
+
+# Materialized approved timetables per id, kept in step with the edit log
+_states = {}
+_states_lock = threading.RLock()
+
+
+class StaleTimetableError(Exception):
+    """An approved timetable changed since the caller read it (compare-and-swap failed)."""
+
+    def __init__(self, approved_id, current_version):
+        self.approved_id = approved_id
+        self.current_version = current_version
+        super().__init__(
+            f"Timetable {approved_id} was changed by someone else (now at version {current_version}). "
+            "Reload and try again."
+        )
+
+
+def current_version(session, approved_id):
+    """Version of an approved timetable as stored right now (bypasses the identity map)."""
+    return session.query(ApprovedTimetable.version).filter(ApprovedTimetable.id == approved_id).scalar()
+
+
+def bump_version(session, approved_id, expected_version, **values):
+    """
+    Compare-and-swap write on an approved timetable row: sets `values` and
+    version = expected_version + 1 only if the row is still at expected_version.
+    Raises StaleTimetableError otherwise. The caller commits.
+    """
+    result = session.execute(
+        update(ApprovedTimetable)
+        .where(ApprovedTimetable.id == approved_id, ApprovedTimetable.version == expected_version)
+        .values(version=expected_version + 1, **values)
+    )
+    if result.rowcount != 1:
+        raise StaleTimetableError(approved_id, current_version(session, approved_id))
+    return expected_version + 1
+
+
+def parse_cell_item(item):
+    """
+    Normalize one stored cell item to {'course', 'teacher', 'classroom'}.
+    Items are either "Course<br>Teacher<br>Room" strings or dicts; empty
+    markers return None.
+    """
+    if isinstance(item, dict):
+        return {
+            'course': item.get('course'),
+            'teacher': item.get('teacher'),
+            'classroom': item.get('classroom', item.get('room')),
+        }
+    if isinstance(item, str) and item not in EMPTY_CELL_VALUES:
+        parts = item.split('<br>')
+        return {
+            'course': parts[0],
+            'teacher': parts[1] if len(parts) > 1 else None,
+            'classroom': parts[2] if len(parts) > 2 else None,
+        }
+    return None
+
+
+def cell_items(cell):
+    """Raw items of a cell as a list; cells may be a list, a single string/dict, '-' or None."""
+    items = cell if isinstance(cell, list) else [cell]
+    return [item for item in items if parse_cell_item(item)]
+
+
+def cell_entries(cell):
+    """Normalized entries of a cell (see parse_cell_item)."""
+    return [parse_cell_item(item) for item in cell_items(cell)]
+
+
+def _with_room(item, room):
+    """Copy of a raw cell item placed in another room, keeping its format."""
+    if isinstance(item, dict):
+        item = dict(item)
+        item['classroom'] = room
+        return item
+    parts = item.split('<br>')
+    parts += [''] * (3 - len(parts))
+    parts[2] = room
+    return '<br>'.join(parts)
+
+
+class TimetableState:
+    """
+    A timetable grid ({class: {slot: {day: cell}}}) together with its occupancy
+    index, so moves can be validated and applied without rescanning the grid.
+    `seq` is the last edit from the log folded into `data`; `snapshot_seq` the
+    last edit covered by a stored snapshot.
+    """
+
+    def __init__(self, data, seq=0):
+        self.data = data
+        self.seq = seq
+        self.snapshot_seq = seq
+        self.index = OccupancyIndex()
+        for class_name, grid in data.items():
+            for slot, days in grid.items():
+                for day, cell in days.items():
+                    for entry in cell_entries(cell):
+                        self._book(class_name, day, slot, entry)
+
+    def _book(self, class_name, day, slot, entry):
+        self.index.add(day, slot, (class_name, day, slot, entry['course']),
+                       room=entry['classroom'], teacher=entry['teacher'], class_=class_name)
+
+    def _unbook(self, class_name, day, slot, entry):
+        self.index.remove(day, slot, (class_name, day, slot, entry['course']),
+                          room=entry['classroom'], teacher=entry['teacher'], class_=class_name)
+
+    def find(self, class_name, day, slot, course):
+        """Raw item for `course` in a class's cell, or None."""
+        cell = self.data.get(class_name, {}).get(slot, {}).get(day)
+        for item in cell_items(cell):
+            if parse_cell_item(item)['course'] == course:
+                return item
+        return None
+
+    def prepare(self, move, known_rooms=None):
+        """
+        Check a move's fields and find its session, without looking for clashes.
+        A room change must name one of `known_rooms` when given.
+        Returns (op, error); op is None when the move can't be applied.
+        """
+        missing = [field for field in MOVE_FIELDS if not move.get(field)]
+        if missing:
+            return None, f"Missing required fields: {', '.join(missing)}"
+        class_name = move['class_group']
+        if class_name not in self.data:
+            return None, f"Class group {class_name} not found in timetable"
+        if move['day'] not in WEEK_DAYS or not SLOT_KEY_RE.match(move['time_slot']):
+            return None, f"Invalid target slot {move['day']} {move['time_slot']}"
+        item = self.find(class_name, move['original_day'], move['original_time'], move['subject'])
+        if item is None:
+            return None, f"No {move['subject']} session for {class_name} on {move['original_day']} at {move['original_time']}"
+
+        entry = parse_cell_item(item)
+        room = (move.get('room') or '').strip() or entry['classroom']
+        if room != entry['classroom'] and known_rooms is not None and room not in known_rooms:
+            return None, f"Unknown room {room}"
+        return {
+            'class_group': class_name,
+            'course': entry['course'],
+            'teacher': entry['teacher'],
+            'from_day': move['original_day'],
+            'from_slot': move['original_time'],
+            'to_day': move['day'],
+            'to_slot': move['time_slot'],
+            'old_room': entry['classroom'],
+            'room': room,
+        }, None
+
+    def conflicts(self, op, ignore=None):
+        """Bookings clashing with op's session at its target, as JSON-ready dicts."""
+        return [
+            {'type': kind, 'resource': resource, 'class_group': other[0], 'course': other[3]}
+            for kind, resource, other in self.index.clashes(
+                op['to_day'], op['to_slot'], room=op['room'], teacher=op['teacher'], class_=op['class_group'],
+                ignore=ignore)
+        ]
+
+    def _book_op(self, op, end):
+        """Book op's session at its source (end='from') or target (end='to') in the index."""
+        room = op['old_room'] if end == 'from' else op['room']
+        self._book(op['class_group'], op[end + '_day'], op[end + '_slot'],
+                   {'course': op['course'], 'teacher': op['teacher'], 'classroom': room})
+
+    def _unbook_op(self, op, end):
+        room = op['old_room'] if end == 'from' else op['room']
+        self._unbook(op['class_group'], op[end + '_day'], op[end + '_slot'],
+                     {'course': op['course'], 'teacher': op['teacher'], 'classroom': room})
+
+    def apply(self, op):
+        """Apply a validated (or logged) move op. Returns False if its session is gone."""
+        item = self.find(op['class_group'], op['from_day'], op['from_slot'], op['course'])
+        if item is None:
+            return False
+        self._unbook(op['class_group'], op['from_day'], op['from_slot'], parse_cell_item(item))
+        item = self._move(op, item)
+        self._book(op['class_group'], op['to_day'], op['to_slot'], parse_cell_item(item))
+        return True
+
+    def _move(self, op, item):
+        """Move a raw item as op says in the grid only (the index is the caller's). Returns the moved item."""
+        grid = self.data[op['class_group']]
+        source = grid[op['from_slot']]
+        source[op['from_day']] = [i for i in cell_items(source[op['from_day']]) if i is not item]
+        if op['room'] != op['old_room']:
+            item = _with_room(item, op['room'])
+        target = grid.setdefault(op['to_slot'], {})
+        target[op['to_day']] = cell_items(target.get(op['to_day'])) + [item]
+        return item
+
+    def cells_for(self, ops):
+        """The source and target cells touched by ops, as JSON-ready dicts."""
+        keys = []
+        for op in ops:
+            for key in ((op['class_group'], op['from_day'], op['from_slot']),
+                        (op['class_group'], op['to_day'], op['to_slot'])):
+                if key not in keys:
+                    keys.append(key)
+        return [
+            {
+                'class_group': class_name,
+                'day': day,
+                'time_slot': slot,
+                'entries': cell_entries(self.data[class_name].get(slot, {}).get(day)),
+            }
+            for class_name, day, slot in keys
+        ]
+
+
+def _requested_room_ids(session, moves):
+    """{name: id} for the rooms that moves ask to switch to."""
+    names = {m['room'].strip() for m in moves if isinstance(m, dict) and isinstance(m.get('room'), str) and m['room'].strip()}
+    if not names:
+        return {}
+    return dict(session.query(Classroom.name, Classroom.id).filter(Classroom.name.in_(names)).all())
+
+
+def _plan_and_apply(state, moves, known_rooms=None):
+    """
+    Validate and apply a batch of moves as one step. Every session the batch
+    moves leaves its cell before any target is checked, so swaps and chains
+    (A into B's cell while B moves on) go through whatever their order. A move
+    whose target still clashes is rejected and its session stays put; the
+    others are then checked again against it, earlier moves winning ties.
+    A session can only be moved once per batch. Returns (results, ops).
+    """
+    results = [None] * len(moves)
+    planned = []
+    sources = set()
+    for i, move in enumerate(moves):
+        op, error = state.prepare(move if isinstance(move, dict) else {}, known_rooms)
+        if op is not None:
+            source = (op['class_group'], op['from_day'], op['from_slot'], op['course'])
+            if source in sources:
+                op, error = None, f"{op['course']} for {op['class_group']} is moved twice in one batch"
+            sources.add(source)
+        if op is None:
+            results[i] = {'index': i, 'status': 'error', 'error': error}
+        else:
+            planned.append((i, op))
+
+    for _, op in planned:
+        state._unbook_op(op, 'from')
+    while True:
+        booked, rejected = [], []
+        for i, op in planned:
+            conflicts = state.conflicts(op)
+            if conflicts:
+                rejected.append((i, op, conflicts))
+            else:
+                state._book_op(op, 'to')
+                booked.append(op)
+        if not rejected:
+            break
+        # Put the rejected sessions back and check the rest again around them
+        for op in booked:
+            state._unbook_op(op, 'to')
+        for i, op, conflicts in rejected:
+            state._book_op(op, 'from')
+            results[i] = {'index': i, 'status': 'conflict', 'conflicts': conflicts}
+        planned = [(i, op) for i, op in planned if results[i] is None]
+
+    # Items are looked up again in batch order, the way the edit log replays them
+    ops = []
+    for i, op in planned:
+        state._move(op, state.find(op['class_group'], op['from_day'], op['from_slot'], op['course']))
+        ops.append(op)
+        results[i] = {'index': i, 'status': 'applied'}
+    return results, ops
+
+
+def compress_timetable(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def decompress_timetable(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def create_approved_timetable(session, name, description, data, approved_by=None, is_active=True):
+    """
+    Add an approved timetable whose grid is stored as a compressed seq-0
+    snapshot rather than a plain JSON copy. The caller commits.
+    """
+    approved = ApprovedTimetable(
+        name=name,
+        description=description,
+        approved_by=approved_by,
+        is_active=is_active,
+    )
+    session.add(approved)
+    session.flush()
+    session.add(ApprovedTimetableSnapshot(approved_timetable_id=approved.id, seq=0, data=compress_timetable(data)))
+    return approved
+
+
+def _base_snapshot(session, approved, upto_seq=None):
+    """(data, seq) of the latest snapshot at or before `upto_seq`, falling back to the legacy JSON column."""
+    q = session.query(ApprovedTimetableSnapshot).filter(ApprovedTimetableSnapshot.approved_timetable_id == approved.id)
+    if upto_seq is not None:
+        q = q.filter(ApprovedTimetableSnapshot.seq <= upto_seq)
+    snapshot = q.order_by(ApprovedTimetableSnapshot.seq.desc()).first()
+    if snapshot is not None:
+        return decompress_timetable(snapshot.data), snapshot.seq
+    return json.loads(approved.timetable_data or '{}'), 0
+
+
+def _replay(session, approved_id, state, upto_seq=None):
+    """Fold logged edits after state.seq (up to `upto_seq`) into state."""
+    q = session.query(ApprovedTimetableEdit).filter(
+        ApprovedTimetableEdit.approved_timetable_id == approved_id,
+        ApprovedTimetableEdit.seq > state.seq
+    )
+    if upto_seq is not None:
+        q = q.filter(ApprovedTimetableEdit.seq <= upto_seq)
+    for edit in q.order_by(ApprovedTimetableEdit.seq.asc()).all():
+        if edit.op in GRID_OPS:
+            state.apply(json.loads(edit.payload))
+        state.seq = edit.seq
+
+
+def load_state(session, approved):
+    """
+    Materialized state of an approved timetable: its latest snapshot plus the
+    edits logged after it. Cached per process; each call only replays edits
+    logged since the cached sequence number (by any worker).
+    """
+    with _states_lock:
+        state = _states.get(approved.id)
+        if state is None:
+            data, seq = _base_snapshot(session, approved)
+            state = TimetableState(data, seq)
+            _states[approved.id] = state
+        _replay(session, approved.id, state)
+        return state
+
+
+def load_timetable_data(session, approved):
+    """Current grid of an approved timetable (latest snapshot plus logged edits)."""
+    return copy.deepcopy(load_state(session, approved).data)
+
+
+def approved_sessions(session, approved, keep):
+    """
+    [(class, day, slot, entry)] of an approved timetable's current grid for
+    which keep(class, entry) holds, read from the cached state without copying it.
+    """
+    with _states_lock:
+        data = load_state(session, approved).data
+        return [
+            (class_name, day, slot, entry)
+            for class_name, slots in data.items()
+            for slot, days in slots.items()
+            for day, cell in days.items()
+            for entry in cell_entries(cell)
+            if keep(class_name, entry)
+        ]
+
+
+def timetable_at(session, approved, seq):
+    """
+    Grid of an approved timetable as it was right after edit `seq`.
+    Costs one snapshot decompression plus the edits logged since that snapshot.
+    """
+    data, snapshot_seq = _base_snapshot(session, approved, upto_seq=seq)
+    state = TimetableState(data, snapshot_seq)
+    _replay(session, approved.id, state, upto_seq=seq)
+    return state.data
+
+
+def edit_history(session, approved_id, since_seq=0, limit=200):
+    """Logged edits of an approved timetable after `since_seq`, oldest first, as JSON-ready dicts."""
+    edits = session.query(ApprovedTimetableEdit).filter(
+        ApprovedTimetableEdit.approved_timetable_id == approved_id,
+        ApprovedTimetableEdit.seq > since_seq
+    ).order_by(ApprovedTimetableEdit.seq.asc()).limit(limit).all()
+    return [
+        {
+            'seq': e.seq,
+            'op': e.op,
+            'payload': json.loads(e.payload),
+            'created_by': e.created_by,
+            'created_at': e.created_at.isoformat() if e.created_at else None,
+        }
+        for e in edits
+    ]
+
+
+def forget_state(approved_id):
+    """Drop the cached state of an approved timetable."""
+    with _states_lock:
+        _states.pop(approved_id, None)
+
+
+def _append_edits(session, approved_id, state, base_seq, version, op, payloads, user_id):
+    """
+    Compare-and-swap the version, append payloads as edits after base_seq and,
+    every SNAPSHOT_EVERY edits, a compressed snapshot of the state (which must
+    already include them). Commits; returns the new version.
+    """
+    version = bump_version(session, approved_id, version)
+    session.add_all([
+        ApprovedTimetableEdit(
+            approved_timetable_id=approved_id,
+            seq=base_seq + i + 1,
+            op=op,
+            payload=json.dumps(payload),
+            created_by=user_id,
+        )
+        for i, payload in enumerate(payloads)
+    ])
+    seq = base_seq + len(payloads)
+    take_snapshot = seq - state.snapshot_seq >= SNAPSHOT_EVERY
+    if take_snapshot:
+        session.add(ApprovedTimetableSnapshot(approved_timetable_id=approved_id, seq=seq, data=compress_timetable(state.data)))
+    session.commit()
+    state.seq = seq
+    if take_snapshot:
+        state.snapshot_seq = seq
+    return version
+
+
+def patch_approved_timetable(session, approved, moves, user_id=None, expected_version=None, op='move', retries=3):
+    """
+    Apply a batch of moves to an approved timetable as appended edit-log rows
+    (logged as `op`, e.g. 'room_change' for moves that only switch rooms).
+    Each move is checked against the occupancy index (room, teacher and class
+    clashes); rejected moves are reported and skipped. The batch is committed
+    with a compare-and-swap on the timetable's version: if another worker wrote
+    in between, the batch is re-validated against the fresh state and retried.
+    With `expected_version`, a timetable that moved past it raises
+    StaleTimetableError instead.
+    Returns {'success', 'results', 'cells', 'version'}.
+    """
+    known_rooms = set(_requested_room_ids(session, moves))
+    for attempt in range(retries):
+        with _states_lock:
+            version = current_version(session, approved.id)
+            if expected_version is not None and int(expected_version) != version:
+                raise StaleTimetableError(approved.id, version)
+            state = load_state(session, approved)
+            base_seq = state.seq
+            results, ops = _plan_and_apply(state, moves, known_rooms)
+            try:
+                if ops:
+                    version = _append_edits(session, approved.id, state, base_seq, version, op, ops, user_id)
+            except (StaleTimetableError, IntegrityError):
+                # Someone else wrote first: rebuild from the log and retry
+                session.rollback()
+                forget_state(approved.id)
+                continue
+            except Exception:
+                session.rollback()
+                forget_state(approved.id)
+                raise
+            return {
+                'success': all(r['status'] == 'applied' for r in results),
+                'results': results,
+                'cells': state.cells_for(ops),
+                'version': version,
+            }
+    raise StaleTimetableError(approved.id, current_version(session, approved.id))
+
+
+def log_edit(session, approved, op, payload, user_id=None, retries=3):
+    """
+    Append a history-only edit (e.g. a cancellation) that doesn't change the
+    weekly grid. Commits; returns the new version.
+    """
+    for attempt in range(retries):
+        with _states_lock:
+            version = current_version(session, approved.id)
+            state = load_state(session, approved)
+            try:
+                return _append_edits(session, approved.id, state, state.seq, version, op, [payload], user_id)
+            except (StaleTimetableError, IntegrityError):
+                session.rollback()
+                forget_state(approved.id)
+    raise StaleTimetableError(approved.id, current_version(session, approved.id))
+
+
+def patch_draft_timetable(session, moves):
+    """
+    Apply a batch of moves to the draft Timetable rows with row-level updates.
+    Validation is the same as for approved timetables. Only the cells the
+    batch moves from or to are loaded, for every class: clashes are per
+    (day, slot), so no other row can matter.
+    Returns {'success', 'results', 'cells', 'version'}.
+    """
+    moved_classes, cells = set(), set()
+    for move in moves:
+        if not isinstance(move, dict):
+            continue
+        if isinstance(move.get('class_group'), str):
+            moved_classes.add(move['class_group'])
+        for day, slot in ((move.get('original_day'), move.get('original_time')), (move.get('day'), move.get('time_slot'))):
+            if isinstance(day, str) and isinstance(slot, str) and SLOT_KEY_RE.match(slot):
+                cells.add((day, *slot.split('-')))
+
+    data = {name: {} for (name,) in session.query(Class.name).filter(Class.name.in_(moved_classes))}
+    if cells:
+        rows = session.query(
+            Timetable.id, Timetable.day, Timetable.start_time, Timetable.end_time,
+            Class.name, Course.name, Teacher.name, Classroom.name
+        ).join(Class, Timetable.class_id == Class.id
+        ).join(Course, Timetable.course_id == Course.id
+        ).join(Teacher, Timetable.teacher_id == Teacher.id
+        ).join(Classroom, Timetable.classroom_id == Classroom.id
+        ).filter(tuple_(Timetable.day, Timetable.start_time, Timetable.end_time).in_(list(cells))).all()
+        for tid, day, start, end, class_name, course, teacher, room in rows:
+            data.setdefault(class_name, {}).setdefault(f"{start}-{end}", {}).setdefault(day, []).append({
+                'course': course, 'teacher': teacher, 'classroom': room, 'timetable_id': tid
+            })
+
+    state = TimetableState(data)
+    # Remember row ids before items move around
+    row_ids = {
+        (class_name, day, slot, entry['course']): entry['timetable_id']
+        for class_name, grid in data.items()
+        for slot, days in grid.items()
+        for day, cell in days.items()
+        for entry in cell
+    }
+    room_ids = _requested_room_ids(session, moves)
+    results, ops = _plan_and_apply(state, moves, set(room_ids))
+
+    try:
+        for op in ops:
+            tid = row_ids.pop((op['class_group'], op['from_day'], op['from_slot'], op['course']))
+            row_ids[(op['class_group'], op['to_day'], op['to_slot'], op['course'])] = tid
+            start, end = op['to_slot'].split('-')
+            values = {'day': op['to_day'], 'start_time': start, 'end_time': end}
+            if op['room'] != op['old_room']:
+                values['classroom_id'] = room_ids[op['room']]
+            session.execute(update(Timetable).where(Timetable.id == tid).values(**values))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    return {
+        'success': all(r['status'] == 'applied' for r in results),
+        'results': results,
+        'cells': state.cells_for(ops),
+        'version': None,
+    }
@@ -0,0 +1,109 @@
+"""
+Per-class grids for the timetable page. Grids are built only for the
+classes being shown, and their rendered HTML is cached per (timetable
+version, class, days) so scrolling back and forth or reloading the page
+doesn't render them again. The draft's version is the write counters of
+the tables its grids are read from (see data_versions.py), so a write by
+any worker process is seen.
+"""
+import collections
+import threading
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+from data_versions import versions
+from scheduler import Class, Classroom, Course, Teacher, Timetable
+from timetable_edits import approved_sessions, current_version
+
+# Classes rendered with the page; the others are fetched as they scroll into view
+CLASSES_PER_PAGE = 10
+FRAGMENT_CACHE_SIZE = 2048
+
+
+def class_names(session):
+    return [name for (name,) in session.query(Class.name).order_by(Class.id)]
+
+
+def _finish(grids, days, time_slots):
+    """Cells as the template expects them: None, one "Course<br>Teacher<br>Room" string or a list of them."""
+    for grid in grids.values():
+        for slot in time_slots:
+            for day in days:
+                cell = grid[slot][day]
+                grid[slot][day] = None if not cell else cell[0] if len(cell) == 1 else cell
+    return grids
+
+
+def draft_grids(session, names, days, time_slots):
+    """{class: {(start, end): {day: cell}}} of the draft timetable for the named classes, in one query."""
+    grids = {name: {slot: {day: [] for day in days} for slot in time_slots} for name in names}
+    rows = session.query(
+        Class.name, Timetable.day, Timetable.start_time, Timetable.end_time, Course.name, Teacher.name, Classroom.name
+    ).join(Class, Timetable.class_id == Class.id
+    ).join(Course, Timetable.course_id == Course.id
+    ).join(Teacher, Timetable.teacher_id == Teacher.id
+    ).join(Classroom, Timetable.classroom_id == Classroom.id
+    ).filter(Class.name.in_(names)).order_by(Timetable.id)
+    for class_name, day, start, end, course, teacher, room in rows:
+        cells = grids[class_name].get((start, end))
+        if cells is not None and day in cells:
+            cells[day].append(f"{course}<br>{teacher}<br>{room}")
+    return _finish(grids, days, time_slots)
+
+
+def approved_grids(session, approved, names, days, time_slots):
+    """Same as draft_grids, read from an approved timetable's current grid."""
+    grids = {name: {slot: {day: [] for day in days} for slot in time_slots} for name in names}
+    wanted = set(names)
+    for class_name, day, slot, entry in approved_sessions(session, approved, lambda c, entry: c in wanted):
+        start, _, end = slot.partition('-')
+        cells = grids[class_name].get((start, end))
+        if cells is not None and day in cells:
+            cells[day].append(f"{entry['course']}<br>{entry['teacher']}<br>{entry['classroom']}")
+    return _finish(grids, days, time_slots)
+
+
+class FragmentCache:
+    """LRU of rendered class grids keyed by (timetable version, class, days)."""
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self._html = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on rollbacks, whose writes may have been rendered before being undone
+        self.draft_generation = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._html.get(key)
+            if html is not None:
+                self._html.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._html[key] = html
+            while len(self._html) > self.size:
+                self._html.popitem(last=False)
+
+    def draft_changed(self):
+        with self._lock:
+            self.draft_generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._html.clear()
+
+    def version(self, session, approved=None):
+        """Key part identifying what a grid was rendered from."""
+        if approved is not None:
+            return ('approved', approved.id, current_version(session, approved.id))
+        return ('draft', self.draft_generation, versions(session, _DRAFT_TABLES))
+
+
+fragment_cache = FragmentCache()
+
+_DRAFT_TABLES = tuple(model.__tablename__ for model in (Timetable, Class, Course, Teacher, Classroom))
+
+sa_event.listen(Session, 'after_soft_rollback', lambda session, previous_transaction: fragment_cache.draft_changed())
@@ -1,14 +1,26 @@
 import os
 import secrets
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, abort
 from markupsafe import Markup
 import sys
 import json
 import datetime
 import collections
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
-from scheduler import get_session, add_classroom, add_course, add_teacher, add_class, generate_timetable, find_available_rooms, suggest_reschedule_options, get_current_timetable_data, Course, Teacher, Class, Classroom, Timetable, User, ClassCourseTeacher, Base
-from models import ApprovedTimetable, RoomChange, ClassCancellation, Event, Feedback
+from scheduler import get_session, add_classroom, add_course, add_teacher, add_class, add_classes_bulk, set_class_course_teachers, generate_timetable, find_available_rooms, suggest_reschedule_options, get_current_timetable_data, ensure_schema, TIMETABLE_DAYS, TIMETABLE_SLOTS, Course, Teacher, Class, Classroom, Timetable, User, ClassCourseTeacher, Base
+from models import ApprovedTimetable, RoomChange, ClassCancellation, Event, Feedback, Exam, ApprovedExamSchedule
+from timetable_edits import load_timetable_data, patch_approved_timetable, patch_draft_timetable, bump_version, StaleTimetableError, create_approved_timetable, timetable_at, edit_history, log_edit
+from timetable_diff import diff_approved
+from repair import repair_timetable
+from feasibility import check_feasibility, InfeasibleTimetableError
+from exams import generate_exam_schedule
+from invigilation import assign_invigilators
+from room_index import room_index
+from semester_calendar import materialize_calendar, dated_sessions, current_semester
+from ical import CalendarFeed
+from exports import draft_rows, approved_rows, exam_rows, event_rows, csv_stream, xlsx_stream
+from timetable_fragments import CLASSES_PER_PAGE, class_names, draft_grids, approved_grids, fragment_cache
+from availability import set_teacher_availability, cell_states, AVAILABLE, UNAVAILABLE, PREFERRED
 
 from sqlalchemy.exc import IntegrityError
 from flask import session as flask_session
@@ -20,156 +32,29 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key')
 app.secret_key = 'your_secret_key'  # Change this to a random secret key
 app.config['JSON_SORT_KEYS'] = False  # Preserve JSON order for timetable data
+# Wall-clock budget (seconds) for the local-search pass after timetable generation; 0 disables it.
+# Off by default so loading the timetable page doesn't wait on it; ?improve=<seconds> asks for one run.
+app.config['TIMETABLE_IMPROVE_SECONDS'] = float(os.environ.get('TIMETABLE_IMPROVE_SECONDS', '0'))
+MAX_IMPROVE_SECONDS = 30
 
 # Use relative path for the database (relative to PROJECT directory)
 # Add parent directory to sys.path so imports work correctly
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 # Use the default get_session behavior which looks for scheduler.db in the current directory
+# (SCHEDULER_DB_URL points elsewhere, e.g. sqlite:// for the tests)
 os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Change to PROJECT directory
 print(f"DEBUG: Working directory set to {os.getcwd()}")
-session = get_session()
-
-# Exam model for scheduling exams
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Boolean, DateTime, Text
-from sqlalchemy.orm import relationship
-
-class Exam(Base):
-    __tablename__ = 'exams'
-    id = Column(Integer, primary_key=True)
-    course_id = Column(Integer, ForeignKey('courses.id'))
-    room_id = Column(Integer, ForeignKey('classrooms.id'))
-    date = Column(Date)
-    start_time = Column(String)
-    end_time = Column(String)
-    course = relationship('Course')
-    room = relationship('Classroom')
-
-class ApprovedExamSchedule(Base):
-    __tablename__ = 'approved_exam_schedules'
-    id = Column(Integer, primary_key=True)
-    name = Column(String, default='Approved Exam Schedule')
-    description = Column(String)
-    schedule_data = Column(Text)  # JSON string of approved exams
-    approved_at = Column(DateTime, default=datetime.datetime.utcnow)
-    approved_by = Column(Integer, ForeignKey('users.id'), nullable=True)
-    is_active = Column(Boolean, default=True)
+session = get_session(os.environ.get('SCHEDULER_DB_URL'))
 
 # Ensure all tables (including Exam) are created
 try:
     engine = session.get_bind()
     if engine is not None:
-        Base.metadata.create_all(engine)
+        ensure_schema(engine)
 except Exception as _e:
     pass
 
-# ---- Exams: auto-generation helpers ----
-def next_monday(from_date=None):
-    d = from_date or datetime.date.today()
-    days_ahead = (7 - d.weekday()) % 7  # 0=Mon
-    days_ahead = 7 if days_ahead == 0 else days_ahead
-    return d + datetime.timedelta(days=days_ahead)
-
-def generate_exam_schedule(db_session, start_date=None, num_days=5, reset=False):
-    """Generate one exam per course across the upcoming exam window.
-    - Distributes exams across days and slots
-    - Avoids room conflicts and class overlap (a class can't have two exams at the same time)
-    Returns (created_count, skipped_count).
-    """
-    # Optional reset (overwrite current draft exams)
-    if reset:
-        db_session.query(Exam).delete()
-        db_session.commit()
-
-    # Compute exam window
-    start = start_date or next_monday()
-    days = [start + datetime.timedelta(days=i) for i in range(num_days)]
-
-    # Exam slots per day
-    slots = [
-        ("09:00", "11:00"),
-        ("11:30", "13:30"),
-        ("14:00", "16:00"),
-    ]
-
-    courses = db_session.query(Course).order_by(Course.name.asc()).all()
-    rooms = db_session.query(Classroom).order_by(Classroom.name.asc()).all()
-
-    # Build course -> classes mapping to avoid overlapping exams for the same class
-    course_to_class_ids = collections.defaultdict(set)
-    for cct in db_session.query(ClassCourseTeacher).all():
-        course_to_class_ids[cct.course_id].add(cct.class_id)
-
-    used_room_slots = set()      # (date, start, end, room_id)
-    used_class_slots = set()     # (date, start, end, class_id)
-    courses_already_scheduled = set()
-
-    # If not resetting, consider existing draft exams to avoid duplicates
-    if not reset:
-        existing = db_session.query(Exam).all()
-        for ex in existing:
-            if ex.room_id and ex.date and ex.start_time and ex.end_time:
-                used_room_slots.add((ex.date, ex.start_time, ex.end_time, ex.room_id))
-            # mark classes occupied for this course's related classes
-            rel_class_ids = [cct.class_id for cct in db_session.query(ClassCourseTeacher).filter_by(course_id=ex.course_id)]
-            for cid in rel_class_ids:
-                if ex.date and ex.start_time and ex.end_time:
-                    used_class_slots.add((ex.date, ex.start_time, ex.end_time, cid))
-            courses_already_scheduled.add(ex.course_id)
-
-    created = 0
-    skipped = 0
-
-    for course in courses:
-        if course.id in courses_already_scheduled:
-            skipped += 1
-            continue
-        scheduled = False
-        related_class_ids = course_to_class_ids.get(course.id, set())
-
-        for day in days:
-            for start_time, end_time in slots:
-                # Ensure no related class has another exam at this slot
-                class_conflict = any((day, start_time, end_time, cid) in used_class_slots for cid in related_class_ids)
-                if class_conflict:
-                    continue
-
-                # Find a free room for this slot
-                for room in rooms:
-                    if (day, start_time, end_time, room.id) in used_room_slots:
-                        continue
-
-                    # Schedule exam
-                    exam = Exam(
-                        course_id=course.id,
-                        room_id=room.id,
-                        date=day,
-                        start_time=start_time,
-                        end_time=end_time,
-                    )
-                    db_session.add(exam)
-                    db_session.flush()
-
-                    # Mark resources
-                    used_room_slots.add((day, start_time, end_time, room.id))
-                    for cid in related_class_ids:
-                        used_class_slots.add((day, start_time, end_time, cid))
-
-                    created += 1
-                    scheduled = True
-                    break
-
-                if scheduled:
-                    break
-            if scheduled:
-                break
-
-        if not scheduled:
-            skipped += 1
-
-    db_session.commit()
-    return created, skipped
-
 def get_active_approved_exam_schedule(db_session):
     return db_session.query(ApprovedExamSchedule).filter_by(is_active=True).order_by(ApprovedExamSchedule.approved_at.desc()).first()
 
@@ -185,6 +70,8 @@ def get_current_exam_data(db_session):
             'date': ex.date.strftime('%Y-%m-%d') if ex.date else None,
             'start_time': ex.start_time,
             'end_time': ex.end_time,
+            'invigilator_id': ex.invigilator_id,
+            'invigilator': ex.invigilator.name if ex.invigilator else None,
         }
         for ex in exams
     ]
@@ -297,17 +184,34 @@ def generate_exams():
     """Generate exam schedule automatically and redirect to the scheduler page."""
     try:
         reset = request.form.get('reset') == 'true'
-        days = int(request.form.get('days', '5'))
-        created, skipped = generate_exam_schedule(session, num_days=days, reset=reset)
+        days = request.form.get('days', '').strip()
+        pack = request.form.get('pack') == 'true'
+        created, skipped, min_days = generate_exam_schedule(session, num_days=int(days) if days else None, reset=reset, pack=pack)
         msg = f"Generated {created} exams"
         if skipped:
             msg += f"; skipped {skipped} due to unavailable slots"
         flash(msg + '.', 'success')
+        if min_days is not None:
+            flash(f"The shortest exam window that fits every course is {min_days} day{'s' if min_days != 1 else ''}.", 'info')
     except Exception as e:
         session.rollback()
         flash(f'Failed to generate exams: {e}', 'danger')
     return redirect(url_for('exam_scheduler'))
 
+@app.route('/exams/invigilators', methods=['POST'])
+def assign_exam_invigilators():
+    """Assign invigilators to the draft exams around teaching and availability."""
+    try:
+        result = assign_invigilators(session, reassign=request.form.get('reassign') == 'true')
+        msg = f"Assigned invigilators to {result['assigned']} exam rooms"
+        if result['unassigned']:
+            msg += f"; {len(result['unassigned'])} rooms have no free teacher"
+        flash(msg + '.', 'warning' if result['unassigned'] else 'success')
+    except Exception as e:
+        session.rollback()
+        flash(f'Failed to assign invigilators: {e}', 'danger')
+    return redirect(url_for('exam_scheduler'))
+
 @app.route('/exams/approve', methods=['POST'])
 def approve_exams():
     """Admin approves current draft exams. Stores snapshot and clears drafts."""
@@ -365,6 +269,7 @@ def api_exams():
             'date': ex.date.strftime('%Y-%m-%d') if ex.date else None,
             'start_time': ex.start_time,
             'end_time': ex.end_time,
+            'invigilator': ex.invigilator.name if ex.invigilator else None,
         }
         for ex in exams
     ]
@@ -508,32 +413,15 @@ def events_scheduler():
                 e.day_of_week = day_of_week
                 e.day_of_month = int(day_of_month) if day_of_month else None
 
-            # Simple conflict check with Timetable and other events on exact slot
-            # Check room availability for one-time date or representative day
-            def overlaps(a_start, a_end, b_start, b_end):
-                return not (a_end <= b_start or b_end <= a_start)
-
-            # For one-time event, verify timetable and events on that day
-            if recurrence == 'one-time' and e.date:
-                # Check timetable
-                tt = session.query(Timetable).filter(
-                    Timetable.day == e.date.strftime('%A'),
-                    Timetable.classroom_id == e.room_id
-                ).all()
-                for t in tt:
-                    if overlaps(e.start_time, e.end_time, t.start_time, t.end_time):
-                        flash('Room is occupied by timetable at that time.', 'danger')
-                        return redirect(url_for('events_scheduler'))
-                # Check other events same day
-                evs = session.query(Event).filter(
-                    Event.room_id == e.room_id,
-                    Event.recurrence == 'one-time'
-                ).all()
-                for oe in evs:
-                    if oe.date and oe.date.date() == e.date.date():
-                        if overlaps(e.start_time, e.end_time, oe.start_time, oe.end_time):
-                            flash('Room already booked for another event at that time.', 'danger')
-                            return redirect(url_for('events_scheduler'))
+            # Conflict check on every date of the event against timetable
+            # sessions, other events (recurring ones included) and exams
+            clashes = room_index.booking_clashes(session, e)
+            if clashes:
+                day, kind, _ = clashes[0]
+                held_by = {'timetable': 'a timetable session', 'event': 'another event', 'exam': 'an exam'}[kind]
+                more = f' (and {len(clashes) - 1} more)' if len(clashes) > 1 else ''
+                flash(f"Room is occupied by {held_by} at that time on {day.strftime('%Y-%m-%d')}{more}.", 'danger')
+                return redirect(url_for('events_scheduler'))
 
             session.add(e)
             session.commit()
@@ -698,15 +586,29 @@ def add_class_route():
             if file.filename.endswith('.csv'):
                 csvfile = TextIOWrapper(file, encoding='utf-8')
                 reader = csv.DictReader(csvfile)
+                # Optional course/teacher columns map courses to teachers; a class
+                # may span several rows. The whole roster is written in one go.
+                roster = {}
+                sizes = {}
                 for row in reader:
                     name = row.get('name') or row.get('Class Group Name')
-                    # You may want to extend this for course/teacher mapping
+                    course = row.get('course') or row.get('Course')
+                    teacher = row.get('teacher') or row.get('Teacher')
+                    size = row.get('size') or row.get('Size')
                     if name:
-                        add_class(session, name, {})
+                        mapping = roster.setdefault(name, {})
+                        if course and teacher:
+                            mapping[course] = teacher
+                        if size and size.strip().isdigit():
+                            sizes[name] = int(size)
+                try:
+                    add_classes_bulk(session, roster, sizes=sizes)
+                except ValueError as e:
+                    flash(f'Could not import classes: {e}', 'danger')
                 return redirect(url_for('index'))
         name = request.form.get('name')
         if name:
-            add_class(session, name, {})
+            add_class(session, name, {}, size=request.form.get('size', type=int))
             return redirect(url_for('index'))
     return render_template('add_class.html', courses=get_courses(), teachers=get_teachers())
 
@@ -737,6 +639,13 @@ def generate_timetable_route():
     
     # Check if we should regenerate the timetable or use the active approved one
     regenerate = request.args.get('regenerate', 'true').lower() == 'true'
+    # Warm start: keep the current timetable and only schedule what changed
+    warm_start = request.args.get('warm', 'false').lower() == 'true'
+    # Optional seed for a reproducible (and cached) generation
+    seed = request.args.get('seed', type=int)
+    # Optional local-search budget in seconds for this generation
+    improve_seconds = request.args.get('improve', app.config['TIMETABLE_IMPROVE_SECONDS'], type=float)
+    improve_seconds = min(max(improve_seconds, 0), MAX_IMPROVE_SECONDS)
     # View mode: 'day' (default) or 'week'
     view_mode = request.args.get('view', 'day')
     # Day filter: default to today if no explicit day provided (when in day view)
@@ -758,49 +667,29 @@ def generate_timetable_route():
     if not regenerate:
         active_timetable = session.query(ApprovedTimetable).filter_by(is_active=True).first()
     
-    # Build timetable grid
-    classes = session.query(Class).all()
-    timetable_data = {}
-    
     if active_timetable and not regenerate:
-        # Use the stored timetable data
-        timetable_data = json.loads(active_timetable.timetable_data)
         flash('Using the currently approved timetable.', 'info')
     else:
-        # Generate a new timetable
-        generate_timetable(session, days, time_slots)
-        
-        for class_ in classes:
-            # Initialize grid with empty lists for each day/time slot
-            grid = {slot: {day: [] for day in days_all} for slot in time_slots}
-            
-            # Get all timetable entries for this class
-            entries = session.query(Timetable).filter_by(class_id=class_.id).all()
-            
-            # Populate the grid with the entries
-            for entry in entries:
-                slot = (entry.start_time, entry.end_time)
-                
-                # Skip if the slot isn't in our time_slots (should not happen with proper data)
-                if slot not in grid:
-                    continue
-                    
-                # Add the entry to the grid
-                if isinstance(grid[slot][entry.day], list):
-                    grid[slot][entry.day].append(f"{entry.course.name}<br>{entry.teacher.name}<br>{entry.classroom.name}")
-                else:
-                    grid[slot][entry.day] = [f"{entry.course.name}<br>{entry.teacher.name}<br>{entry.classroom.name}"]
-            
-            # Convert empty lists to None for consistent template handling
-            # and single-item lists to strings
-            for slot in time_slots:
-                for day in days_all:
-                    if not grid[slot][day]:
-                        grid[slot][day] = None
-                    elif len(grid[slot][day]) == 1:
-                        grid[slot][day] = grid[slot][day][0]
-                        
-            timetable_data[class_.name] = grid
+        # Generate a new timetable for the whole week, whichever day is shown
+        # (no improvement pass on a warm start: it would reshuffle the published sessions)
+        try:
+            if warm_start:
+                generate_timetable(session, days_all, time_slots, warm_start=True, precheck=True)
+            else:
+                generate_timetable(session, days_all, time_slots, precheck=True, seed=seed,
+                                   improve_seconds=improve_seconds)
+        except InfeasibleTimetableError as e:
+            # Nothing was changed; show why and fall through to the current draft
+            for problem in e.report['problems']:
+                if problem['severity'] == 'error':
+                    flash(problem['message'], 'danger')
+    
+    # Version of the approved timetable drag-and-drop edits go to (see apply_timetable_moves)
+    timetable_version = session.query(ApprovedTimetable.version).filter_by(is_active=True).order_by(ApprovedTimetable.id).limit(1).scalar()
+
+    # Only the first classes are rendered with the page; the rest are fetched on scroll
+    names = class_names(session)
+    class_grids = render_class_grids(names[:CLASSES_PER_PAGE], days, time_slots, active_timetable)
     
     # For demo purposes: Always set is_coordinator to True to bypass login requirement
     is_coordinator = True
@@ -815,7 +704,10 @@ def generate_timetable_route():
     csrf_token = secrets.token_hex(16)
     
     return render_template('timetable.html', 
-                          timetable_data=timetable_data, 
+                          class_grids=class_grids,
+                          lazy_classes=names[CLASSES_PER_PAGE:],
+                          fragment_params={'view': view_mode, 'day': selected_day,
+                                           'source': 'approved' if active_timetable else 'draft'},
                           days=days, 
                           all_days=days_all,
                           time_slots=time_slots, 
@@ -823,12 +715,51 @@ def generate_timetable_route():
                           theme=theme,
                           is_coordinator=is_coordinator,
                           is_approved=bool(active_timetable and not regenerate),
+                          timetable_version=timetable_version,
                           active_timetable=active_timetable if not regenerate else None,
                           selected_day=selected_day,
                           view_mode=view_mode,
                           current_date_time=current_date_time,
                           csrf_token=csrf_token)
 
+def render_class_grids(names, days, time_slots, approved=None):
+    """[(class, html)] of the named classes' grids, rendered once per timetable version and days."""
+    version = fragment_cache.version(session, approved)
+    rendered = {}
+    for name in names:
+        html = fragment_cache.get((version, name, tuple(days)))
+        if html is not None:
+            rendered[name] = html
+    missing = [name for name in names if name not in rendered]
+    if missing:
+        if approved is not None:
+            grids = approved_grids(session, approved, missing, days, time_slots)
+        else:
+            grids = draft_grids(session, missing, days, time_slots)
+        for name in missing:
+            rendered[name] = Markup(render_template('timetable_class.html', class_name=name, grid=grids[name],
+                                                    days=days, time_slots=time_slots))
+            fragment_cache.put((version, name, tuple(days)), rendered[name])
+    return [(name, rendered[name]) for name in names]
+
+@app.route('/timetable/fragment')
+def timetable_fragment():
+    """One class's grid as HTML for the timetable page. Query params: class, view, day, source=approved|draft"""
+    days_all, time_slots = TIMETABLE_DAYS, TIMETABLE_SLOTS
+    class_name = request.args.get('class')
+    if not class_name or not session.query(Class.id).filter_by(name=class_name).first():
+        return jsonify({'error': 'Class not found'}), 404
+    day = request.args.get('day')
+    if request.args.get('view') == 'week':
+        days = days_all
+    else:
+        days = [day if day in days_all else 'Monday']
+    approved = None
+    if request.args.get('source') == 'approved':
+        approved = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+    [(_, html)] = render_class_grids([class_name], days, time_slots, approved)
+    return jsonify({'class': class_name, 'html': str(html)})
+
 @app.route('/find_rooms', methods=['GET', 'POST'])
 def find_rooms_route():
     available = []
@@ -837,6 +768,11 @@ def find_rooms_route():
             day = request.form['day']
             start = request.form['start_time']
             end = request.form['end_time']
+            # A specific date also rules out rooms booked for events that day
+            date = request.form.get('date')
+            date = datetime.datetime.strptime(date, '%Y-%m-%d').date() if date else None
+            if date:
+                day = date.strftime('%A')
             
             # Basic validation
             if start and end:
@@ -870,7 +806,13 @@ def find_rooms_route():
                 end_formatted = end
                 
             # Find available rooms for the entire time range
-            available = find_available_rooms(session, day, start_formatted, end_formatted)
+            if date:
+                # The index frees rooms whose class is cancelled that date, so start from every room
+                available = session.query(Classroom).all()
+                busy = room_index.busy_rooms(session, [room.id for room in available], date, start_formatted, end_formatted)
+                available = [room for room in available if room.id not in busy]
+            else:
+                available = find_available_rooms(session, day, start_formatted, end_formatted)
             print(f"DEBUG: Found {len(available)} available rooms for the entire duration")
             
             # Calculate duration for user feedback
@@ -1005,8 +947,51 @@ def cancel_class():
         date = request.form.get('date')
         reason = request.form.get('reason')
         if all([class_id, course_id, date]):
-            # Add cancellation logic here
-            flash('Class cancelled successfully.', 'success')
+            try:
+                class_ = session.query(Class).get(int(class_id))
+                course = session.query(Course).get(int(course_id))
+                day = datetime.datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                class_ = course = None
+            if not class_ or not course:
+                flash('Invalid class, course or date.', 'danger')
+                return redirect(url_for('cancel_class'))
+            sessions = session.query(Timetable).filter_by(
+                class_id=class_.id, course_id=course.id, day=day.strftime('%A')
+            ).order_by(Timetable.start_time).all()
+            if not sessions:
+                flash(f"{class_.name} has no {course.name} session on {day.strftime('%A')}s.", 'danger')
+                return redirect(url_for('cancel_class'))
+            already = session.query(ClassCancellation.id).filter(
+                ClassCancellation.date >= day,
+                ClassCancellation.date < day + datetime.timedelta(days=1),
+                ClassCancellation.class_id == class_.id,
+                ClassCancellation.course_id == course.id
+            ).first()
+            if already:
+                flash(f"{course.name} for {class_.name} is already cancelled on {date}.", 'info')
+                return redirect(url_for('cancel_class'))
+            user_id = flask_session.get('user_id')
+            try:
+                # Saving it releases the sessions' rooms for that date in the room finder
+                session.add(ClassCancellation(class_id=class_.id, course_id=course.id, date=day,
+                                              reason=reason, cancelled_by=user_id))
+                session.commit()
+                active_timetable = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+                if active_timetable:
+                    log_edit(session, active_timetable, 'cancellation', {
+                        'class_group': class_.name,
+                        'subject': course.name,
+                        'date': date,
+                        'time_slots': [f"{t.start_time}-{t.end_time}" for t in sessions],
+                        'reason': reason,
+                    }, user_id=user_id)
+            except Exception as e:
+                session.rollback()
+                flash(f'Error cancelling class: {str(e)}', 'danger')
+                return redirect(url_for('cancel_class'))
+            flash(f"{course.name} for {class_.name} cancelled on {date}; "
+                  f"{len(sessions)} room slot{'s' if len(sessions) != 1 else ''} released.", 'success')
             return redirect(url_for('index'))
         flash('Please fill out all fields.', 'danger')
     return render_template('cancel_class.html', classes=get_classes(), courses=get_courses())
@@ -1094,6 +1079,22 @@ def change_room():
                 session.add(room_change)
                 session.commit()
                 
+                # Record the change in the active approved timetable's edit log
+                active_timetable = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+                if active_timetable:
+                    result = patch_approved_timetable(session, active_timetable, [{
+                        'class_group': timetable_entry.class_.name,
+                        'subject': timetable_entry.course.name,
+                        'original_day': timetable_entry.day,
+                        'original_time': f"{timetable_entry.start_time}-{timetable_entry.end_time}",
+                        'day': timetable_entry.day,
+                        'time_slot': f"{timetable_entry.start_time}-{timetable_entry.end_time}",
+                        'room': timetable_entry.classroom.name,
+                    }], user_id=user_id, op='room_change')
+                    if not result['success']:
+                        outcome = result['results'][0]
+                        flash(f"Approved timetable not updated: {outcome.get('error') or 'room is taken at that time'}", 'info')
+                
                 flash('Room changed successfully.', 'success')
                 return redirect(url_for('room_changes'))
             except Exception as e:
@@ -1148,18 +1149,8 @@ def add_courses_to_class():
         if class_id and course_ids and teacher_ids and len(course_ids) == len(teacher_ids):
             class_obj = session.query(Class).get(class_id)
             if class_obj:
-                # Clear existing course-teacher mappings for this class
-                session.query(ClassCourseTeacher).filter_by(class_id=class_id).delete()
-                
-                # Add new course-teacher mappings
-                for course_id, teacher_id in zip(course_ids, teacher_ids):
-                    cct = ClassCourseTeacher(
-                        class_id=class_id,
-                        course_id=course_id,
-                        teacher_id=teacher_id
-                    )
-                    session.add(cct)
-                session.commit()
+                # Replace existing course-teacher mappings for this class
+                set_class_course_teachers(session, class_id, dict(zip(course_ids, teacher_ids)))
                 flash('Courses and teachers assigned successfully!', 'success')
                 return redirect(url_for('index'))
         
@@ -1180,21 +1171,14 @@ def course_coordinator():
         teacher_ids = request.form.getlist('teacher_ids[]')
         
         if class_id and course_ids and teacher_ids and len(course_ids) == len(teacher_ids):
-            # Clear existing assignments for this class
-            session.query(ClassCourseTeacher).filter_by(class_id=class_id).delete()
-            
-            # Add new assignments
-            for course_id, teacher_id in zip(course_ids, teacher_ids):
-                if course_id and teacher_id:  # Only add if both are selected
-                    cct = ClassCourseTeacher(
-                        class_id=class_id,
-                        course_id=course_id,
-                        teacher_id=teacher_id
-                    )
-                    session.add(cct)
-            
+            # Replace existing assignments (only rows with both selected)
+            assignments = {
+                course_id: teacher_id
+                for course_id, teacher_id in zip(course_ids, teacher_ids)
+                if course_id and teacher_id
+            }
             try:
-                session.commit()
+                set_class_course_teachers(session, class_id, assignments)
                 flash('Class courses updated successfully!', 'success')
             except Exception as e:
                 session.rollback()
@@ -1224,6 +1208,66 @@ def teachers():
         print(f"DEBUG: Teacher - {t.name} ({t.subject})")
     return render_template('teachers.html', teachers=teachers_list)
 
+@app.route('/teachers/<int:teacher_id>/availability', methods=['GET', 'POST'])
+def teacher_availability(teacher_id):
+    """Edit a teacher's unavailable and preferred periods on the week grid."""
+    teacher = session.query(Teacher).get(teacher_id)
+    if not teacher:
+        flash('Teacher not found.', 'danger')
+        return redirect(url_for('teachers'))
+    # Masks are stored over the teaching grid (see availability.py)
+    days, time_slots = TIMETABLE_DAYS, TIMETABLE_SLOTS
+    if request.method == 'POST':
+        cells = {
+            (day, i): request.form.get(f'cell-{day}-{i}', AVAILABLE)
+            for day in days for i in range(len(time_slots))
+        }
+        try:
+            set_teacher_availability(teacher, cells)
+            session.commit()
+            flash(f'Availability saved for {teacher.name}.', 'success')
+        except Exception as e:
+            session.rollback()
+            flash(f'Error saving availability: {e}', 'danger')
+        return redirect(url_for('teacher_availability', teacher_id=teacher_id))
+    return render_template('teacher_availability.html', teacher=teacher, days=days, time_slots=time_slots,
+                           states=cell_states(teacher, days))
+
+@app.route('/teachers/availability/upload', methods=['POST'])
+def upload_teacher_availability():
+    """
+    Import availability from CSV rows of teacher,day,time_slot,status where status
+    is unavailable or preferred (available clears the cell). Teachers listed in
+    the file get their masks rebuilt from its rows; everyone else is untouched.
+    """
+    slot_index = {f"{start}-{end}": i for i, (start, end) in enumerate(TIMETABLE_SLOTS)}
+    file = request.files.get('csv_file')
+    if not file or not file.filename.endswith('.csv'):
+        flash('Please upload a .csv file.', 'danger')
+        return redirect(url_for('teachers'))
+    days = TIMETABLE_DAYS
+    teachers_by_name = {t.name: t for t in session.query(Teacher).all()}
+    cells = {}
+    skipped = 0
+    for row in csv.DictReader(TextIOWrapper(file, encoding='utf-8')):
+        teacher = teachers_by_name.get((row.get('teacher') or '').strip())
+        day = (row.get('day') or '').strip().capitalize()
+        index = slot_index.get((row.get('time_slot') or '').strip())
+        status = (row.get('status') or '').strip().lower()
+        if teacher is None or day not in days or index is None or status not in (AVAILABLE, UNAVAILABLE, PREFERRED):
+            skipped += 1
+            continue
+        cells.setdefault(teacher, {})[(day, index)] = status
+    try:
+        for teacher, teacher_cells in cells.items():
+            set_teacher_availability(teacher, teacher_cells)
+        session.commit()
+        flash(f'Availability imported for {len(cells)} teachers ({skipped} rows skipped).', 'success')
+    except Exception as e:
+        session.rollback()
+        flash(f'Error importing availability: {e}', 'danger')
+    return redirect(url_for('teachers'))
+
 @app.route('/analytics')
 def analytics_page():
     return render_template('analytics.html')
@@ -1237,7 +1281,7 @@ def teacher_class_counts():
     
     if active_timetable:
         # Load timetable data
-        all_timetable_data = json.loads(active_timetable.timetable_data)
+        all_timetable_data = load_timetable_data(session, active_timetable)
         
         # Analyze each class timetable
         for class_name, class_grid in all_timetable_data.items():
@@ -1379,7 +1423,7 @@ def room_usage():
     
     if active_timetable:
         # Load timetable data
-        all_timetable_data = json.loads(active_timetable.timetable_data)
+        all_timetable_data = load_timetable_data(session, active_timetable)
         
         # Analyze each class timetable
         for class_name, class_grid in all_timetable_data.items():
@@ -1434,7 +1478,7 @@ def course_distribution():
     
     if active_timetable:
         # Load timetable data
-        all_timetable_data = json.loads(active_timetable.timetable_data)
+        all_timetable_data = load_timetable_data(session, active_timetable)
         
         # Analyze each class timetable
         for class_name, class_grid in all_timetable_data.items():
@@ -1505,7 +1549,7 @@ def teacher_timetable(teacher_id):
     
     if active_timetable:
         # Load timetable data from active approved timetable
-        all_timetable_data = json.loads(active_timetable.timetable_data)
+        all_timetable_data = load_timetable_data(session, active_timetable)
         
         # Extract teacher's schedule from each class's timetable
         for class_name, class_grid in all_timetable_data.items():
@@ -1575,6 +1619,71 @@ def teacher_timetable(teacher_id):
                           time_slots=time_slots,
                           active_timetable=active_timetable)
 
+def calendar_feed(kind, model, id):
+    """Stream the iCalendar feed of a teacher, room or class; 304 when the client's copy is current."""
+    owner = session.query(model).get(id)
+    if not owner:
+        abort(404)
+    feed = CalendarFeed(session, kind, owner)
+    response = Response(mimetype='text/calendar')
+    response.set_etag(feed.etag)
+    response.last_modified = feed.last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    response.response = feed.lines(session)
+    # make_conditional sized the still-empty body; the feed is streamed without a length
+    response.headers.pop('Content-Length', None)
+    response.headers['Content-Disposition'] = f'inline; filename="{kind}-{id}.ics"'
+    return response
+
+@app.route('/calendar/teacher/<int:id>.ics')
+def teacher_calendar_feed(id):
+    return calendar_feed('teacher', Teacher, id)
+
+@app.route('/calendar/room/<int:id>.ics')
+def room_calendar_feed(id):
+    return calendar_feed('room', Classroom, id)
+
+@app.route('/calendar/class/<int:id>.ics')
+def class_calendar_feed(id):
+    return calendar_feed('class', Class, id)
+
+@app.route('/export/<what>.<fmt>')
+def export(what, fmt):
+    """
+    Download the draft timetable, the active (or ?id=) approved timetable, exams
+    or events as CSV or XLSX, streamed as the rows are read.
+    """
+    if fmt not in ('csv', 'xlsx'):
+        abort(404)
+    if what == 'draft':
+        rows = draft_rows(session)
+    elif what == 'approved':
+        approved_id = request.args.get('id', type=int)
+        if approved_id:
+            approved = session.query(ApprovedTimetable).get(approved_id)
+        else:
+            approved = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+        if not approved:
+            abort(404)
+        rows = approved_rows(session, approved)
+    elif what == 'exams':
+        rows = exam_rows(session)
+    elif what == 'events':
+        rows = event_rows(session)
+    else:
+        abort(404)
+    filename = f"{what}-{datetime.date.today().isoformat()}.{fmt}"
+    if fmt == 'csv':
+        response = Response(csv_stream(rows), mimetype='text/csv')
+    else:
+        response = Response(xlsx_stream(rows, sheet_name=what.capitalize()),
+                            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @app.route('/admin', methods=['GET', 'POST'])
 def admin():
     # Login requirement removed for demo purposes
@@ -1618,30 +1727,37 @@ def approve_timetable():
     name = request.form.get('name', 'Approved Timetable')
     description = request.form.get('description', f'Timetable approved by {user.username}')
     
+    # Optional version of the active timetable the approver was looking at
+    expected_version = request.form.get('version', type=int)
+    
     try:
-        # Deactivate all previously approved timetables
-        previously_approved = session.query(ApprovedTimetable).filter_by(is_active=True).all()
-        for prev in previously_approved:
-            prev.is_active = False
+        # Deactivate all previously approved timetables, each with a compare-and-swap on its version
+        previously_approved = session.query(ApprovedTimetable.id, ApprovedTimetable.version).filter_by(is_active=True).all()
+        for prev_id, prev_version in previously_approved:
+            if expected_version is not None and prev_version != expected_version:
+                raise StaleTimetableError(prev_id, prev_version)
+            bump_version(session, prev_id, prev_version, is_active=False)
         
         # Get current timetable data
         timetable_data = get_current_timetable_data(session)
         
-        # Create new approved timetable
-        approved_timetable = ApprovedTimetable(
+        # Create new approved timetable (stored as a compressed snapshot)
+        approved_timetable = create_approved_timetable(
+            session,
             name=name,
             description=description,
-            timetable_data=json.dumps(timetable_data),
+            data=timetable_data,
             approved_by=user.id,
             is_active=True
         )
-        
-        session.add(approved_timetable)
         session.commit()
         
         flash('Timetable approved successfully!', 'success')
         return jsonify({'success': True, 'redirect': url_for('view_approved_timetable', id=approved_timetable.id)})
         
+    except StaleTimetableError as e:
+        session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'version': e.current_version}), 409
     except Exception as e:
         session.rollback()
         print(str(e))
@@ -1673,7 +1789,7 @@ def view_approved_timetable(id):
         flash('Timetable not found.', 'danger')
         return redirect(url_for('approved_timetables'))
     
-    timetable_data = json.loads(approved_timetable.timetable_data)
+    timetable_data = load_timetable_data(session, approved_timetable)
     days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
     time_slots = [
         ("08:30", "09:30"),
@@ -1691,28 +1807,79 @@ def view_approved_timetable(id):
                           days=days,
                           time_slots=time_slots)
 
+@app.route('/api/approved-timetables/<int:id>/history')
+def approved_timetable_history(id):
+    """Edit log of an approved timetable. Query params: since=<seq>, limit=<n>"""
+    approved_timetable = session.query(ApprovedTimetable).get(id)
+    if not approved_timetable:
+        return jsonify({'error': 'Timetable not found'}), 404
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+    return jsonify({
+        'id': id,
+        'version': approved_timetable.version,
+        'edits': edit_history(session, id, since_seq=since, limit=limit)
+    })
+
+@app.route('/api/approved-timetables/<int:id>/versions/<int:seq>')
+def approved_timetable_at(id, seq):
+    """An approved timetable as it was right after edit number `seq` (0 = as approved)."""
+    approved_timetable = session.query(ApprovedTimetable).get(id)
+    if not approved_timetable:
+        return jsonify({'error': 'Timetable not found'}), 404
+    return jsonify({'id': id, 'seq': seq, 'timetable': timetable_at(session, approved_timetable, seq)})
+
+@app.route('/api/approved-timetables/diff')
+def approved_timetable_diff():
+    """
+    Moved/added/removed/room-changed sessions between two approved timetables,
+    plus the teachers, rooms and classes affected.
+    Query params: from=<id>[@seq], to=<id>[@seq], summary=1 to omit the change lists.
+    """
+    old_ref, new_ref = request.args.get('from'), request.args.get('to')
+    if not old_ref or not new_ref:
+        return jsonify({'error': 'Both from and to are required'}), 400
+    try:
+        result = diff_approved(session, old_ref, new_ref)
+    except ValueError:
+        return jsonify({'error': 'Timetables are given as <id> or <id>@<seq>'}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    if request.args.get('summary'):
+        result.pop('changes')
+    return jsonify(dict(result, **{'from': old_ref, 'to': new_ref}))
+
 @app.route('/timetable/activate/<int:id>', methods=['POST'])
 def activate_timetable(id):
     # Login requirement removed for demo purposes
     
     try:
-        # Deactivate all timetables
-        active_timetables = session.query(ApprovedTimetable).filter_by(is_active=True).all()
-        for timetable in active_timetables:
-            timetable.is_active = False
-        
-        # Activate the selected timetable
         timetable = session.query(ApprovedTimetable).get(id)
         if not timetable:
             flash('Timetable not found.', 'danger')
             return redirect(url_for('approved_timetables'))
         
-        timetable.is_active = True
+        # Deactivate all other timetables and activate the selected one, each
+        # write a compare-and-swap on the row's version
+        expected_version = request.form.get('version', type=int)
+        target_version = session.query(ApprovedTimetable.version).filter_by(id=id).scalar()
+        if expected_version is not None and target_version != expected_version:
+            raise StaleTimetableError(id, target_version)
+        active_timetables = session.query(ApprovedTimetable.id, ApprovedTimetable.version).filter(
+            ApprovedTimetable.is_active == True, ApprovedTimetable.id != id
+        ).all()
+        for other_id, other_version in active_timetables:
+            bump_version(session, other_id, other_version, is_active=False)
+        bump_version(session, id, target_version, is_active=True)
         session.commit()
         
         flash(f'Timetable "{timetable.name}" is now active.', 'success')
         return redirect(url_for('view_approved_timetable', id=timetable.id))
         
+    except StaleTimetableError as e:
+        session.rollback()
+        flash(str(e), 'danger')
+        return redirect(url_for('approved_timetables'))
     except Exception as e:
         session.rollback()
         print(str(e))
@@ -1721,7 +1888,7 @@ def activate_timetable(id):
 
 @app.route('/update_timetable_slot', methods=['POST'])
 def update_timetable_slot():
-    """Handle AJAX requests for drag-and-drop timetable updates."""
+    """Handle AJAX requests for drag-and-drop timetable updates (one move per request)."""
     # Only allow admin and coordinator to update timetable
     # if not current_user.is_authenticated or not (current_user.is_admin or current_user.is_coordinator):
     #    return jsonify({'success': False, 'error': 'Unauthorized access'}), 403
@@ -1731,96 +1898,134 @@ def update_timetable_slot():
         if not data:
             return jsonify({'success': False, 'error': 'No data provided'}), 400
             
-        # Required fields
         class_group = data.get('class_group')
         subject = data.get('subject')
-        teacher = data.get('teacher')
-        room = data.get('room')
         day = data.get('day')
         time_slot = data.get('time_slot')
-        original_day = data.get('original_day')
-        original_time = data.get('original_time')
         
         # Validate the data
-        if not all([class_group, day, time_slot]):
+        if not all([class_group, subject, day, time_slot, data.get('original_day'), data.get('original_time')]):
             return jsonify({'success': False, 'error': 'Missing required fields'}), 400
             
-        # Get active timetable
-        active_timetable = session.query(ApprovedTimetable).filter_by(is_active=True).first()
-        if not active_timetable:
-            # If no approved timetable, get the current draft
-            timetable_data = get_current_timetable_data(session)
-        else:
-            timetable_data = json.loads(active_timetable.timetable_data)
-            
-        # Check if we're in edit mode (using an approved timetable)
-        is_edit_mode = active_timetable is not None
-        
-        # Update the timetable data
-        if class_group in timetable_data:
-            # Format the cell data based on what's already in the timetable
-            # (different timetables might use different formats)
-            if original_day and original_time:
-                # Remove from original position
-                time_key = original_time
-                if time_key in timetable_data[class_group] and day in timetable_data[class_group][time_key]:
-                    timetable_data[class_group][time_key][original_day] = '-'
-            
-            # Add to new position
-            if time_slot not in timetable_data[class_group]:
-                timetable_data[class_group][time_slot] = {d: '-' for d in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]}
-                
-            # The format could be string, dict, or list based on how the timetable was generated
-            # Check the existing format and match it
-            sample_cell = None
-            for t in timetable_data[class_group]:
-                for d in timetable_data[class_group][t]:
-                    if timetable_data[class_group][t][d] and timetable_data[class_group][t][d] != '-':
-                        sample_cell = timetable_data[class_group][t][d]
-                        break
-                if sample_cell:
-                    break
-                    
-            # Create new cell data based on the existing format
-            if isinstance(sample_cell, dict):
-                cell_data = {
-                    'course': subject,
-                    'teacher': teacher,
-                    'classroom': room
-                }
-            elif isinstance(sample_cell, list):
-                # If it's a list, check the first item's format
-                if sample_cell and isinstance(sample_cell[0], dict):
-                    cell_data = [{
-                        'course': subject,
-                        'teacher': teacher,
-                        'classroom': room
-                    }]
-                else:
-                    # Assume string items in list
-                    cell_data = [f"{subject}<br>{teacher}<br>{room}"]
-            else:
-                # Default to string format if no sample or unrecognized format
-                cell_data = f"{subject}<br>{teacher}<br>{room}"
-                
-            timetable_data[class_group][time_slot][day] = cell_data
-            
-            # If we're in edit mode, save the updated timetable
-            if is_edit_mode:
-                active_timetable.timetable_data = json.dumps(timetable_data)
-                session.commit()
-                
+        # The request body is a single patch move
+        result = apply_timetable_moves([data], expected_version=data.get('version'))
+        outcome = result['results'][0]
+        if outcome['status'] == 'applied':
             return jsonify({
                 'success': True, 
-                'message': f'Updated {subject} for {class_group} on {day} at {time_slot}'
+                'message': f'Updated {subject} for {class_group} on {day} at {time_slot}',
+                'cells': result['cells']
             })
-        else:
-            return jsonify({'success': False, 'error': f'Class group {class_group} not found in timetable'}), 404
+        if outcome['status'] == 'conflict':
+            clashes = ', '.join(f"{c['type']} {c['resource']}" for c in outcome['conflicts'])
+            return jsonify({'success': False, 'error': f'Conflict with {clashes}', 'conflicts': outcome['conflicts']}), 409
+        return jsonify({'success': False, 'error': outcome['error']}), 400
             
+    except StaleTimetableError as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e), 'version': e.current_version}), 409
+    except Exception as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def apply_timetable_moves(moves, expected_version=None):
+    """Apply drag-and-drop moves to the active approved timetable, or to the draft if none is active.
+    An expected_version (optional) must match the active timetable's version.
+    """
+    active_timetable = session.query(ApprovedTimetable).filter_by(is_active=True).first()
+    if active_timetable:
+        return patch_approved_timetable(session, active_timetable, moves,
+                                        user_id=flask_session.get('user_id'),
+                                        expected_version=expected_version)
+    return patch_draft_timetable(session, moves)
+
+@app.route('/api/timetable/patch', methods=['POST'])
+def patch_timetable():
+    """Apply a batch of moves and return per-move results plus only the affected cells.
+    Body: {"moves": [{class_group, subject, original_day, original_time, day, time_slot, room?}, ...],
+           "version": optional expected version of the active timetable}
+    """
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves')
+    if not isinstance(moves, list) or not moves:
+        return jsonify({'success': False, 'error': 'No moves provided'}), 400
+    try:
+        return jsonify(apply_timetable_moves(moves, expected_version=data.get('version')))
+    except StaleTimetableError as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e), 'version': e.current_version}), 409
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/timetable/feasibility')
+def timetable_feasibility():
+    """Counting-bound check of the current configuration against the week grid (see check_feasibility)."""
+    return jsonify(check_feasibility(session, TIMETABLE_DAYS, TIMETABLE_SLOTS))
+
+@app.route('/api/timetable/repair', methods=['POST'])
+def repair_timetable_route():
+    """Re-place only the draft sessions hit by rooms or teachers becoming unavailable.
+    Body: {"rooms": [id or name, ...], "teachers": [id or name, ...],
+           "periods": optional [{day, time_slot}, ...] limiting when they are unavailable}
+    """
+    data = request.get_json(silent=True) or {}
+    rooms, teachers = data.get('rooms') or [], data.get('teachers') or []
+    if not rooms and not teachers:
+        return jsonify({'success': False, 'error': 'No unavailable rooms or teachers given'}), 400
+    periods = data.get('periods')
+    if periods is not None:
+        periods = [(p.get('day'), p.get('time_slot')) for p in periods]
+    try:
+        result = repair_timetable(session, TIMETABLE_DAYS, TIMETABLE_SLOTS, rooms=rooms, teachers=teachers, periods=periods)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify(dict(result, success=not result['unplaced']))
+
+@app.route('/api/calendar/materialize', methods=['POST'])
+def materialize_calendar_route():
+    """Expand the active approved timetable into dated sessions. Body/form: start_date, end_date (YYYY-MM-DD), optional name."""
+    data = request.get_json(silent=True) or request.form
+    try:
+        start_date = datetime.datetime.strptime(data.get('start_date', ''), '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(data.get('end_date', ''), '%Y-%m-%d').date()
+        counts = materialize_calendar(session, start_date, end_date, name=data.get('name'))
+    except ValueError as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify(dict(counts, success=True))
+
+@app.route('/api/calendar')
+def calendar_sessions():
+    """Dated sessions of the current semester. Query params: from, to (YYYY-MM-DD), room_id, class_id, cancelled=0."""
+    semester = current_semester(session)
+    if semester is None:
+        return jsonify({'error': 'No semester has been materialized'}), 404
+    try:
+        first = datetime.datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else semester.start_date
+        last = datetime.datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else semester.end_date
+    except ValueError:
+        return jsonify({'error': 'Dates are given as YYYY-MM-DD'}), 400
+    rows = dated_sessions(session, first, last,
+                          room_id=request.args.get('room_id', type=int),
+                          class_id=request.args.get('class_id', type=int),
+                          include_cancelled=request.args.get('cancelled', '1') != '0')
+    return jsonify({
+        'semester': {'id': semester.id, 'name': semester.name,
+                     'start_date': semester.start_date.isoformat(), 'end_date': semester.end_date.isoformat()},
+        'sessions': [{
+            'date': row.date.isoformat(), 'day': row.day, 'start_time': row.start_time, 'end_time': row.end_time,
+            'class_id': row.class_id, 'course_id': row.course_id, 'teacher_id': row.teacher_id,
+            'room_id': row.room_id, 'original_room_id': row.original_room_id, 'status': row.status,
+        } for row in rows]
+    })
+
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=8081)
 
@@ -11,36 +11,80 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 function initializeDragAndDrop() {
-    const subjectBlocks = document.querySelectorAll('.subject-block');
-    const timetableCells = document.querySelectorAll('.schedule-cell');
+    // Grow as lazily loaded class grids are bound (see bindTimetable)
+    const subjectBlocks = [];
+    const timetableCells = [];
     
     // Track conflicts
     let conflicts = [];
     
-    // Make subject blocks draggable
-    subjectBlocks.forEach(block => {
-        block.setAttribute('draggable', true);
-        
-        // Store original position and data
-        block.dataset.originalCell = block.parentElement.id;
-        block.dataset.originalDay = block.parentElement.dataset.day;
-        block.dataset.originalTime = block.parentElement.dataset.time;
-        block.dataset.classGroup = block.querySelector('.class-badge')?.textContent || '';
-        block.dataset.subject = block.querySelector('.subject-name')?.textContent || '';
-        block.dataset.teacher = block.querySelector('.teacher-name')?.textContent || '';
-        block.dataset.room = block.querySelector('.room-badge')?.textContent.replace('Room: ', '') || '';
-        
-        // Add drag events
-        block.addEventListener('dragstart', handleDragStart);
-    });
+    // Index cells by class/day/time once so lookups don't scan every cell
+    const cellIndex = new Map();
+    
+    // Batched saving: moves are coalesced per block and sent in one request,
+    // either shortly after the last drop (auto-save) or on explicit save
+    const SAVE_DELAY_MS = 1500;
+    const pendingMoves = new Map();  // block id -> block
+    // Version of the approved timetable being edited (none for the draft);
+    // sent with each batch so another editor's changes aren't overwritten
+    const versionHolder = document.querySelector('.timetable-container');
+    let timetableVersion = versionHolder.dataset.version ? Number(versionHolder.dataset.version) : null;
+    let saveTimer = null;
+    let saveInFlight = null;
+    let autoSave = true;
+    const saveBar = createSaveBar();
     
-    // Make cells droppable
-    timetableCells.forEach(cell => {
-        cell.addEventListener('dragover', handleDragOver);
-        cell.addEventListener('dragleave', handleDragLeave);
-        cell.addEventListener('drop', handleDrop);
+    window.addEventListener('beforeunload', function(e) {
+        if (pendingMoves.size > 0) {
+            e.preventDefault();
+            e.returnValue = '';
+        }
     });
     
+    // Make subject blocks draggable and cells droppable, for the page and
+    // for each class grid loaded later
+    function bindTimetable(root) {
+        root.querySelectorAll('.subject-block').forEach(block => {
+            subjectBlocks.push(block);
+            block.setAttribute('draggable', true);
+            
+            // Store original position and data
+            block.dataset.originalCell = block.parentElement.id;
+            block.dataset.originalDay = block.parentElement.dataset.day;
+            block.dataset.originalTime = block.parentElement.dataset.time;
+            block.dataset.classGroup = block.dataset.class || block.querySelector('.class-badge')?.textContent || '';
+            block.dataset.subject = block.dataset.course || block.querySelector('.subject-name')?.textContent || '';
+            block.dataset.teacher = block.querySelector('.teacher-name')?.textContent || '';
+            block.dataset.room = block.querySelector('.room-badge')?.textContent.replace('Room: ', '') || '';
+            
+            // Add drag events
+            block.addEventListener('dragstart', handleDragStart);
+        });
+    
+        root.querySelectorAll('.schedule-cell').forEach(cell => {
+            timetableCells.push(cell);
+            cellIndex.set(cellKey(cell.dataset.class, cell.dataset.day, cell.dataset.time), cell);
+            cell.addEventListener('dragover', handleDragOver);
+            cell.addEventListener('dragleave', handleDragLeave);
+            cell.addEventListener('drop', handleDrop);
+        });
+    }
+    bindTimetable(document);
+    window.bindTimetableFragment = bindTimetable;
+    
+    // Forget the blocks and cells of a class grid that is about to be replaced
+    function unbindTimetable(root) {
+        [subjectBlocks, timetableCells].forEach(list => {
+            for (let i = list.length - 1; i >= 0; i--) {
+                if (root.contains(list[i])) {
+                    list.splice(i, 1);
+                }
+            }
+        });
+        root.querySelectorAll('.subject-block').forEach(block => pendingMoves.delete(block.id));
+    }
+    window.unbindTimetableFragment = unbindTimetable;
+    
     // Drag event handlers
     function handleDragStart(e) {
         e.dataTransfer.setData('text/plain', e.target.id);
@@ -80,6 +124,12 @@ function initializeDragAndDrop() {
             return;
         }
         
+        // Sessions can only move within their own class's grid
+        if (this.dataset.class && draggedBlock.dataset.classGroup !== this.dataset.class) {
+            showNotification(`${draggedBlock.dataset.subject} belongs to ${draggedBlock.dataset.classGroup}'s timetable`, 'error');
+            return;
+        }
+        
         // Remove from old position and add to new
         if (draggedBlock.parentElement) {
             draggedBlock.parentElement.classList.remove('has-subject');
@@ -92,8 +142,8 @@ function initializeDragAndDrop() {
         // Check for conflicts after drop
         checkForConflicts();
         
-        // Save the changes to the server
-        saveChanges(draggedBlock, this);
+        // Queue the move; it is saved with the next batch
+        queueMove(draggedBlock, this);
     }
     
     function highlightValidDropTargets(draggedBlock) {
@@ -368,8 +418,8 @@ function initializeDragAndDrop() {
             const newDay = document.getElementById('available-days').value;
             const newTime = document.getElementById('available-times').value;
             
-            // Find the target cell
-            const targetCell = findCellByDayAndTime(newDay, newTime);
+            // Find the target cell in the same class grid
+            const targetCell = findCellByDayAndTime(newDay, newTime, selectedBlock.dataset.classGroup);
             if (targetCell) {
                 // If target cell already has content, we need to handle that
                 if (targetCell.querySelector('.subject-block') && targetCell.querySelector('.subject-block') !== selectedBlock) {
@@ -380,77 +430,246 @@ function initializeDragAndDrop() {
                         
                         targetCell.appendChild(selectedBlock);
                         sourceCell.appendChild(targetBlock);
+                        queueMove(targetBlock, sourceCell);
+                        queueMove(selectedBlock, targetCell);
                     }
                 } else {
                     // Just move the block
                     targetCell.appendChild(selectedBlock);
+                    queueMove(selectedBlock, targetCell);
                 }
                 
                 // Check for new conflicts
                 checkForConflicts();
-                
-                // Save changes
-                saveChanges(selectedBlock, targetCell);
             }
             
             modal.style.display = 'none';
         });
     }
     
-    function findCellByDayAndTime(day, time) {
-        return Array.from(timetableCells).find(cell => 
-            cell.dataset.day === day && cell.dataset.time === time
-        );
+    function cellKey(classGroup, day, time) {
+        return `${classGroup}|${day}|${time}`;
     }
     
-    function saveChanges(block, cell) {
-        // Get the data
-        const classGroup = block.dataset.classGroup;
-        const subject = block.dataset.subject;
-        const teacher = block.dataset.teacher;
-        const room = block.dataset.room;
-        const day = cell.dataset.day;
-        const timeSlot = cell.dataset.time;
-        
-        // Create the data to send
-        const data = {
-            class_group: classGroup,
-            subject: subject,
-            teacher: teacher,
-            room: room,
-            day: day,
-            time_slot: timeSlot,
-            original_day: block.dataset.originalDay,
-            original_time: block.dataset.originalTime
-        };
+    function findCellByDayAndTime(day, time, classGroup) {
+        return cellIndex.get(cellKey(classGroup, day, time));
+    }
+    
+    function queueMove(block, cell) {
+        block.dataset.targetDay = cell.dataset.day;
+        block.dataset.targetTime = cell.dataset.time;
+        
+        if (cell.dataset.day === block.dataset.originalDay && cell.dataset.time === block.dataset.originalTime) {
+            // Dropped back where the server already has it
+            pendingMoves.delete(block.id);
+            block.classList.remove('pending-move');
+        } else {
+            pendingMoves.set(block.id, block);
+            block.classList.add('pending-move');
+        }
+        
+        updateSaveBar();
+        if (autoSave) {
+            clearTimeout(saveTimer);
+            saveTimer = setTimeout(flushMoves, SAVE_DELAY_MS);
+        }
+    }
+    
+    function flushMoves() {
+        clearTimeout(saveTimer);
+        
+        // One batch at a time, so each batch starts from the saved positions
+        if (saveInFlight) {
+            return saveInFlight.then(flushMoves);
+        }
+        if (pendingMoves.size === 0) {
+            return Promise.resolve();
+        }
         
-        // Update the original position data
-        block.dataset.originalDay = day;
-        block.dataset.originalTime = timeSlot;
+        const blocks = Array.from(pendingMoves.values());
+        pendingMoves.clear();
+        const moves = blocks.map(block => ({
+            class_group: block.dataset.classGroup,
+            subject: block.dataset.subject,
+            original_day: block.dataset.originalDay,
+            original_time: block.dataset.originalTime,
+            day: block.dataset.targetDay,
+            time_slot: block.dataset.targetTime
+        }));
+        
+        const body = { moves: moves };
+        if (timetableVersion !== null) {
+            body.version = timetableVersion;
+        }
         
-        // Send to server
-        fetch('/update_timetable_slot', {
+        updateSaveBar(true);
+        saveInFlight = fetch('/api/timetable/patch', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': getCsrfToken()
             },
-            body: JSON.stringify(data)
+            body: JSON.stringify(body)
         })
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                // Show success notification
-                showNotification('Changes saved successfully', 'success');
-            } else {
-                // Show error notification
-                showNotification('Error saving changes: ' + data.error, 'error');
+        .then(response => response.json().then(data => ({ status: response.status, data: data })))
+        .then(({ status, data }) => {
+            if (status === 409) {
+                return handleStaleVersion(blocks, moves, data);
             }
+            handleSaveResults(blocks, moves, data);
         })
         .catch(error => {
             console.error('Error:', error);
+            // Keep the moves queued so they can be retried
+            blocks.forEach(block => {
+                if (!pendingMoves.has(block.id)) {
+                    pendingMoves.set(block.id, block);
+                }
+            });
             showNotification('Error saving changes', 'error');
+        })
+        .finally(() => {
+            saveInFlight = null;
+            updateSaveBar();
         });
+        return saveInFlight;
+    }
+    
+    function handleStaleVersion(blocks, moves, data) {
+        // Someone else saved first: nothing in this batch was applied.
+        // Reload the grids it touched so they show the saved timetable.
+        if (data.version !== undefined && data.version !== null) {
+            timetableVersion = data.version;
+        }
+        const classes = new Set(moves.map(move => move.class_group));
+        showNotification('The timetable was changed by someone else; reloaded the affected classes', 'error');
+        const reload = window.reloadClassGrid || (() => Promise.resolve());
+        return Promise.all(Array.from(classes, className => reload(className)))
+            .then(() => checkForConflicts());
+    }
+    
+    function handleSaveResults(blocks, moves, data) {
+        if (data.version !== undefined && data.version !== null) {
+            timetableVersion = data.version;
+        }
+        if (!data.results) {
+            blocks.forEach(block => revertBlock(block));
+            showNotification('Error saving changes: ' + (data.error || 'unknown error'), 'error');
+            checkForConflicts();
+            return;
+        }
+        
+        const problems = [];
+        data.results.forEach(result => {
+            const block = blocks[result.index];
+            const move = moves[result.index];
+            if (result.status === 'applied') {
+                block.dataset.originalDay = move.day;
+                block.dataset.originalTime = move.time_slot;
+            } else {
+                problems.push({ move: move, result: result });
+                revertBlock(block);
+            }
+            if (!pendingMoves.has(block.id)) {
+                block.classList.remove('pending-move');
+            }
+        });
+        
+        const saved = moves.length - problems.length;
+        if (problems.length === 0) {
+            showNotification(`Saved ${saved} change${saved === 1 ? '' : 's'}`, 'success');
+        } else {
+            showNotification(`Saved ${saved} of ${moves.length} changes; ${problems.length} rejected`, 'error');
+        }
+        displaySaveProblems(problems);
+        checkForConflicts();
+    }
+    
+    function revertBlock(block) {
+        // Moved again since this batch was sent: leave it for the next batch
+        if (pendingMoves.has(block.id)) {
+            return;
+        }
+        // Put the block back where the server still has it
+        const cell = findCellByDayAndTime(block.dataset.originalDay, block.dataset.originalTime, block.dataset.classGroup);
+        if (cell && cell !== block.parentElement) {
+            block.parentElement.classList.remove('has-subject');
+            cell.appendChild(block);
+            cell.classList.add('has-subject');
+        }
+    }
+    
+    function displaySaveProblems(problems) {
+        let container = document.getElementById('save-problems');
+        if (problems.length === 0) {
+            if (container) {
+                container.style.display = 'none';
+            }
+            return;
+        }
+        
+        if (!container) {
+            container = document.createElement('div');
+            container.id = 'save-problems';
+            container.className = 'conflict-container';
+            saveBar.after(container);
+        }
+        
+        // Names come from user-editable data, so the list is built as text nodes
+        container.replaceChildren();
+        const heading = document.createElement('h3');
+        const icon = document.createElement('i');
+        icon.className = 'fas fa-exclamation-triangle';
+        heading.append(icon, ' Changes Rejected by the Server');
+        const list = document.createElement('ul');
+        problems.forEach(({ move, result }) => {
+            let reason = result.error || '';
+            if (result.status === 'conflict') {
+                reason = result.conflicts.map(c => `${c.type} ${c.resource} is taken by ${c.class_group} (${c.course})`).join('; ');
+            }
+            const item = document.createElement('li');
+            item.className = 'conflict-item';
+            const what = document.createElement('strong');
+            what.textContent = `${move.class_group} - ${move.subject}`;
+            item.append(what, ` to ${move.day}, ${move.time_slot}: ${reason}`);
+            list.appendChild(item);
+        });
+        container.append(heading, list);
+        container.style.display = 'block';
+    }
+    
+    function createSaveBar() {
+        const bar = document.createElement('div');
+        bar.id = 'save-bar';
+        bar.className = 'save-bar';
+        bar.innerHTML = `
+            <span class="save-status">All changes saved</span>
+            <label class="save-auto"><input type="checkbox" id="auto-save-toggle" checked> Auto-save</label>
+            <button type="button" class="btn gradient-btn" id="save-now-btn" disabled><i class="fas fa-save"></i> Save changes</button>
+        `;
+        document.querySelector('.timetable-container').prepend(bar);
+        
+        bar.querySelector('#auto-save-toggle').addEventListener('change', function() {
+            autoSave = this.checked;
+            if (autoSave && pendingMoves.size > 0) {
+                flushMoves();
+            }
+        });
+        bar.querySelector('#save-now-btn').addEventListener('click', () => flushMoves());
+        return bar;
+    }
+    
+    function updateSaveBar(saving) {
+        const status = saveBar.querySelector('.save-status');
+        const count = pendingMoves.size;
+        if (saving || saveInFlight) {
+            status.textContent = 'Saving...';
+        } else if (count > 0) {
+            status.textContent = `${count} unsaved change${count === 1 ? '' : 's'}`;
+        } else {
+            status.textContent = 'All changes saved';
+        }
+        saveBar.querySelector('#save-now-btn').disabled = count === 0;
     }
     
     function getCsrfToken() {